@@ -2,17 +2,29 @@
 """
 
 from collections.abc import Sequence
+import copy
 from enum import Enum
+import grp
+import io
 import itertools
 import os
 from pathlib import Path
+import pwd
+import shutil
 import stat
 import sys
 import tarfile
 import tempfile
-from archive.manifest import Manifest
+import time
+import warnings
+from archive import delta
+from archive.chunks import ChunkStore
+from archive.exclude import ExcludeRules
+from archive.manifest import FileInfo, Manifest, ReadOrder
 from archive.exception import *
-from archive.tools import checksum
+from archive.tools import (checksum, copy_range, is_plain_file, open_input,
+                           sparse_map, reorder_windows, background,
+                           BackgroundWriter, hashed_copy, new_hash)
 
 def _is_normalized(p):
     """Check if the path is normalized.
@@ -52,6 +64,142 @@ class MetadataItem:
         self.path = basedir / self.name
 
 
+class _TarInfo(tarfile.TarInfo):
+    """A TarInfo that reads GNU sparse 1.0 members correctly.
+
+    tarfile gets the name and the size of these members wrong if the
+    name is too long or the stored data is too large to fit into the
+    ustar header, because the pax headers "path" and "size" then
+    override the real values.
+    """
+
+    def _proc_pax(self, tarfile):
+        next = super()._proc_pax(tarfile)
+        pax_headers = next.pax_headers
+        if getattr(next, "_sparse_data", None) is not None:
+            next.path = pax_headers["GNU.sparse.name"].rstrip("/")
+            next.size = int(pax_headers["GNU.sparse.realsize"])
+            if "size" in pax_headers:
+                tarfile.offset = (next._sparse_data +
+                                  next._block(int(pax_headers["size"])))
+        return next
+
+    def _proc_gnusparse_10(self, next, pax_headers, tarfile):
+        next._sparse_data = tarfile.fileobj.tell()
+        super()._proc_gnusparse_10(next, pax_headers, tarfile)
+
+
+class _TarFile(tarfile.TarFile):
+    """A TarFile that copies member data in the kernel if possible.
+
+    This is the case if the tar file is not compressed and the member
+    data is read from or extracted to plain files.  Members having
+    :attr:`tarfile.TarInfo.sparse` set are stored in the GNU sparse
+    1.0 format, omitting the holes.
+    """
+
+    tarinfo = _TarInfo
+
+    def addfile(self, tarinfo, fileobj=None):
+        if fileobj is not None and tarinfo.sparse is not None:
+            return self._addsparse(tarinfo, fileobj)
+        if (fileobj is None or
+            not is_plain_file(self.fileobj) or not is_plain_file(fileobj)):
+            return super().addfile(tarinfo, fileobj)
+        self._check("awx")
+        tarinfo = copy.copy(tarinfo)
+        buf = tarinfo.tobuf(self.format, self.encoding, self.errors)
+        self.fileobj.write(buf)
+        self.offset += len(buf)
+        self._copy_data(fileobj, fileobj.tell(), self.fileobj,
+                        tarinfo.size, OSError)
+        blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            self.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        self.offset += blocks * tarfile.BLOCKSIZE
+        self.members.append(tarinfo)
+
+    def addraw(self, tarinfo, fileobj):
+        """Copy a member verbatim, header and data.
+
+        fileobj must be the uncompressed tar file tarinfo has been
+        read from.  Sparse members are not supported.
+        """
+        self._check("awx")
+        size = tarinfo.offset_data - tarinfo.offset
+        if tarinfo.isreg():
+            size += tarinfo._block(tarinfo.size)
+        if is_plain_file(self.fileobj) and is_plain_file(fileobj):
+            self._copy_data(fileobj, tarinfo.offset, self.fileobj,
+                            size, OSError)
+        else:
+            fileobj.seek(tarinfo.offset)
+            tarfile.copyfileobj(fileobj, self.fileobj, size, OSError)
+        self.offset += size
+        self.members.append(copy.copy(tarinfo))
+
+    def _addsparse(self, tarinfo, fileobj):
+        self._check("awx")
+        sparse = "%d\n" % len(tarinfo.sparse)
+        sparse += "".join("%d\n%d\n" % s for s in tarinfo.sparse)
+        sparse = sparse.encode("ascii")
+        blocks, remainder = divmod(len(sparse), tarfile.BLOCKSIZE)
+        if remainder > 0:
+            sparse += tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+        datasize = sum(size for _, size in tarinfo.sparse)
+        head, tail = os.path.split(tarinfo.name)
+        info = copy.copy(tarinfo)
+        info.name = os.path.join(head, "GNUSparseFile.0", tail)
+        info.size = len(sparse) + datasize
+        info.sparse = None
+        info.pax_headers = dict(tarinfo.pax_headers)
+        info.pax_headers.update({
+            "GNU.sparse.major": "1",
+            "GNU.sparse.minor": "0",
+            "GNU.sparse.name": tarinfo.name,
+            "GNU.sparse.realsize": str(tarinfo.size),
+        })
+        buf = info.tobuf(self.format, self.encoding, self.errors)
+        self.fileobj.write(buf)
+        self.fileobj.write(sparse)
+        self.offset += len(buf) + len(sparse)
+        kernel_copy = is_plain_file(self.fileobj) and is_plain_file(fileobj)
+        for offset, size in tarinfo.sparse:
+            if not size:
+                continue
+            if kernel_copy:
+                self._copy_data(fileobj, offset, self.fileobj, size, OSError)
+            else:
+                fileobj.seek(offset)
+                tarfile.copyfileobj(fileobj, self.fileobj, size)
+        blocks, remainder = divmod(datasize, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            self.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        self.offset += blocks * tarfile.BLOCKSIZE
+        self.members.append(copy.copy(tarinfo))
+
+    def makefile(self, tarinfo, targetpath):
+        if tarinfo.sparse is not None or not is_plain_file(self.fileobj):
+            return super().makefile(tarinfo, targetpath)
+        with open(targetpath, "wb") as target:
+            self._copy_data(self.fileobj, tarinfo.offset_data, target,
+                            tarinfo.size, tarfile.ReadError)
+
+    @staticmethod
+    def _copy_data(src, offset, dst, size, exception):
+        dst.flush()
+        n = copy_range(src.fileno(), offset, dst.fileno(), size)
+        if dst.seekable():
+            # The data has been written behind the back of dst, make
+            # it aware of the new file position.
+            dst.seek(0, os.SEEK_CUR)
+        if n < size:
+            src.seek(offset + n)
+            tarfile.copyfileobj(src, dst, size - n, exception)
+
+
 compression_map = {
     '.tar': '',
     '.tar.gz': 'gz',
@@ -63,6 +211,16 @@ compression_map = {
 
 class Archive:
 
+    ReadBufferSize = 64*1024*1024
+    """Maximum amount of file content to read ahead if a read order
+    other then path order is requested in :meth:`Archive.create`.
+    """
+
+    SpoolBufferSize = 1024*1024
+    """Size of the chunks to read the content of members added with
+    :meth:`Archive.add_member` in.
+    """
+
     def __init__(self):
         self.path = None
         self.basedir = None
@@ -71,37 +229,142 @@ class Archive:
         self._metadata = []
         self._dedup = None
         self._dupindex = None
+        self._readorder = None
+        self._fileobj = None
+        self._deltadir = None
+        self._deltafiles = None
+        self._chunkstore = None
+        self._members = []
+        self._spool = None
+        self._spooled = {}
 
     def create(self, path, compression=None, paths=None, fileinfos=None,
                basedir=None, workdir=None, excludes=None,
-               dedup=DedupMode.LINK, tags=None):
+               dedup=DedupMode.LINK, tags=None, sortbuffer=None,
+               checksums=None, readorder=ReadOrder.PATH, fileobj=None,
+               resolve=None, chunkstore=None, deleted=None, recursive=True):
+        """Create the archive.
+
+        If fileobj is given, the archive is written to this binary
+        file object as a stream rather then to path, which may be
+        :const:`None` in this case.  fileobj is not closed.
+
+        Items in fileinfos may have a delta base, the item having the
+        previous version of the file in another archive.  Those are
+        stored as a binary delta against that version, if this is
+        smaller then the file.  resolve is called with the name of
+        the other archive and must return it opened for reading.
+
+        If chunkstore is a :class:`archive.chunks.ChunkStore`, the
+        content of regular files is added to the chunk store rather
+        then to the archive, only chunks not already in the store are
+        written.  The manifest records the chunks of each file and
+        the location of the chunk store, relative to the archive.
+
+        deleted may be an iterable of paths of items that have been
+        deleted since the base archives of a differential archive.
+        These are recorded in the manifest.  It is only iterated
+        after all fileinfos have been consumed, so it may be filled
+        while they are being generated.
+
+        Members added with :meth:`Archive.add_member` are added to the
+        items from paths or fileinfos.  paths may be :const:`None` if
+        there are any.
+
+        excludes may be a list of paths or an
+        :class:`archive.exclude.ExcludeRules` object.
+
+        If recursive is false, directories in paths are not descended,
+        only the items listed in paths are added.  paths may be an
+        iterator in this case, it is consumed incrementally, e.g. to
+        read a long list of files from a pipe.
+        """
         if compression is None:
             try:
                 compression = compression_map["".join(path.suffixes)]
-            except KeyError:
+            except (AttributeError, KeyError):
                 # Last ressort default
                 compression = 'gz'
-        mode = 'x:' + compression
+        if fileobj is not None:
+            mode = 'w|' + compression
+        else:
+            mode = 'x:' + compression
         save_wd = None
         try:
             if workdir:
                 save_wd = os.getcwd()
                 os.chdir(workdir)
-            self.path = path.resolve()
+            self.path = path.resolve() if path is not None else None
+            self._fileobj = fileobj
             self._dedup = dedup
             self._dupindex = {}
+            self._readorder = readorder or ReadOrder.PATH
+            self._deltafiles = {}
+            self._chunkstore = chunkstore
+            if self._members:
+                if fileinfos is None:
+                    if paths and recursive:
+                        self._check_paths(paths, basedir, excludes)
+                    fileinfos = FileInfo.iterpaths(paths or (),
+                                                   excludes,
+                                                   checksums, recursive)
+                members = self._spool_members(checksums)
+                fileinfos = itertools.chain(fileinfos, members)
+            if chunkstore is not None:
+                if fileinfos is None:
+                    if recursive:
+                        self._check_paths(paths, basedir, excludes)
+                    fileinfos = FileInfo.iterpaths(paths, excludes,
+                                                   checksums, recursive)
+                fileinfos = self._store_chunks(fileinfos)
             if fileinfos is not None:
-                if not isinstance(fileinfos, Sequence):
-                    fileinfos = list(fileinfos)
-                self._check_paths([fi.path for fi in fileinfos], basedir)
+                fileinfos = self._make_deltas(fileinfos, resolve)
+                if sortbuffer is None:
+                    if not isinstance(fileinfos, Sequence):
+                        fileinfos = list(fileinfos)
+                    self._check_paths([fi.path for fi in fileinfos], basedir)
                 try:
-                    self.manifest = Manifest(fileinfos=fileinfos, tags=tags)
+                    self.manifest = Manifest(fileinfos=fileinfos, tags=tags,
+                                             sortbuffer=sortbuffer,
+                                             checksums=checksums,
+                                             readorder=readorder)
                 except ValueError as e:
                     raise ArchiveCreateError("invalid fileinfos: %s" % e)
+                if sortbuffer is not None:
+                    # Do not hold all the paths in memory, check them
+                    # while iterating over the (spooled) manifest.
+                    self._check_paths((fi.path for fi in self.manifest),
+                                      basedir)
             else:
-                self._check_paths(paths, basedir, excludes)
-                self.manifest = Manifest(paths=paths, excludes=excludes,
-                                         tags=tags)
+                if recursive:
+                    self._check_paths(paths, basedir, excludes)
+                try:
+                    self.manifest = Manifest(paths=paths, excludes=excludes,
+                                             tags=tags, sortbuffer=sortbuffer,
+                                             checksums=checksums,
+                                             readorder=readorder,
+                                             recursive=recursive,
+                                             hashworkers=Manifest.HashWorkers)
+                except ValueError as e:
+                    raise ArchiveCreateError(str(e))
+                if not recursive:
+                    # paths may have been an iterator, check the
+                    # items in the manifest instead.
+                    self._check_paths((fi.path for fi in self.manifest),
+                                      basedir, excludes)
+            if deleted is not None:
+                self.manifest.set_deleted(deleted)
+            if chunkstore is not None:
+                # Make sure all chunks are in the store for good
+                # before the archive refers to them.
+                chunkstore.flush()
+                location = chunkstore.path.resolve()
+                if self.path is not None:
+                    try:
+                        location = location.relative_to(self.path.parent)
+                    except ValueError:
+                        pass
+                self.manifest.head["ChunkStore"] = str(location)
             bd_fi = self.manifest.find(self.basedir)
             if bd_fi and not bd_fi.is_dir():
                 raise ArchiveCreateError("base directory %s must "
@@ -114,25 +377,227 @@ class Archive:
         finally:
             if save_wd:
                 os.chdir(save_wd)
+            if self._deltadir:
+                self._deltadir.cleanup()
+                self._deltadir = None
+            if self._spool:
+                self._spool.close()
+                self._spool = None
+                self._spooled = {}
+            self._chunkstore = None
         return self
 
+    def add_member(self, path, source, mode=0o644, mtime=None):
+        """Add a regular file to the archive to be created, taking
+        its content from source rather then from the file system.
+
+        source may be a binary file object, such as a pipe, or an
+        iterable of bytes-like objects.  It is read in
+        :meth:`Archive.create` into a temporary file, calculating the
+        checksums in the same pass.  The file is owned by the current
+        user, mtime defaults to the time the content has been read.
+        """
+        self._members.append((Path(path), source, mode, mtime))
+
+    def _spool_members(self, checksums):
+        """Read the content of the members added with
+        :meth:`Archive.add_member` into the spool file.  Return a list
+        of FileInfo objects for the members.
+        """
+        hashalg = list(checksums or FileInfo.Checksums)
+        uid = os.getuid()
+        gid = os.getgid()
+        try:
+            uname = pwd.getpwuid(uid)[0]
+        except KeyError:
+            uname = None
+        try:
+            gname = grp.getgrgid(gid)[0]
+        except KeyError:
+            gname = None
+        self._spool = tempfile.TemporaryFile()
+        fileinfos = []
+        for path, source, mode, mtime in self._members:
+            if hasattr(source, "read"):
+                chunks = iter(lambda: source.read(self.SpoolBufferSize), b"")
+            else:
+                chunks = source
+            offset = self._spool.tell()
+            try:
+                size, cs = hashed_copy(chunks, self._spool, hashalg)
+            except OSError as e:
+                raise ArchiveCreateError("%s: %s" % (path, e))
+            data = {
+                'type': 'f',
+                'path': path,
+                'uid': uid,
+                'uname': uname,
+                'gid': gid,
+                'gname': gname,
+                'mode': mode,
+                'mtime': time.time() if mtime is None else mtime,
+                'size': size,
+                'checksum': cs,
+            }
+            fileinfos.append(FileInfo(data=data, checksums=hashalg))
+            self._spooled[path] = offset
+        self._spool.flush()
+        return fileinfos
+
+    def _store_chunks(self, fileinfos):
+        """Add the content of regular files to the chunk store.
+        Calculate the checksums along the way, if needed.
+        """
+        for fi in fileinfos:
+            if fi.is_file() and not fi.ref and fi.path not in self._spooled:
+                fi.delta = None
+                hashes = None
+                if fi._checksum is None:
+                    hashes = { a: new_hash(a) for a in fi.Checksums }
+                with open_input(fi.path) as f:
+                    fi.chunks = self._chunkstore.add_file(f, hashes)
+                if hashes:
+                    fi._checksum = { a: h.hexdigest()
+                                     for a, h in hashes.items() }
+            yield fi
+
+    def _make_deltas(self, fileinfos, resolve):
+        """Calculate the deltas for the items having a delta base.
+        Without resolve, these items are stored in full.
+        """
+        sources = {}
+        try:
+            for fi in fileinfos:
+                if fi.is_file() and fi.delta:
+                    if fi.ref or fi.chunks is not None or resolve is None:
+                        fi.delta = None
+                    else:
+                        self._try_delta(fi, resolve, sources)
+                yield fi
+        finally:
+            for a in sources.values():
+                a.close()
+
+    def _try_delta(self, fi, resolve, sources):
+        try:
+            name = fi.delta['archive']
+            if name not in sources:
+                sources[name] = resolve(name)
+            self._make_delta(fi, sources[name])
+        except (ArchiveError, OSError) as e:
+            warnings.warn(ArchiveWarning("%s: storing in full: %s"
+                                         % (fi.path, e)))
+            fi.delta = None
+
+    def _make_delta(self, fi, source):
+        if self._deltadir is None:
+            self._deltadir = tempfile.TemporaryDirectory(
+                prefix="archive-tools-")
+            # Make sure we can write in there, regardless of the umask.
+            os.chmod(self._deltadir.name, 0o700)
+        tarf, tarinfo = source._content_member(Path(fi.delta['path']))
+        with tarf.extractfile(tarinfo) as f:
+            signature = delta.Signature(f, delta.block_size(tarinfo.size))
+        deltafile = Path(self._deltadir.name, str(len(self._deltafiles)))
+        with open_input(fi.path) as f, deltafile.open("wb") as out:
+            delta.delta(signature, f, out)
+        size = deltafile.stat().st_size
+        if size >= fi.size:
+            deltafile.unlink()
+            fi.delta = None
+            return
+        with deltafile.open("rb") as f:
+            cs = checksum(f, fi.checksum.keys())
+        fi.delta = dict(archive=fi.delta['archive'], path=fi.delta['path'],
+                        size=size, checksum=cs)
+        self._deltafiles[fi.path] = deltafile
+
     def _create(self, mode):
-        with tarfile.open(self.path, mode, format=tarfile.PAX_FORMAT) as tarf:
-            with tempfile.TemporaryFile() as tmpf:
-                self.manifest.write(tmpf)
-                tmpf.seek(0)
-                self.add_metadata(".manifest.yaml", tmpf)
-                md_names = self._add_metadata_files(tarf)
-            for fi in self.manifest:
-                arcname = self._arcname(fi.path)
-                if arcname in md_names:
-                    raise ArchiveCreateError("invalid path '%s': this "
-                                             "filename is reserved" % fi.path)
-                self._add_item(tarf, fi, arcname)
-
-    def _add_item(self, tarf, fi, arcname):
+        if self._fileobj is not None:
+            # Stream: no seeking in the output, compress in this
+            # thread and write in a background thread.
+            with BackgroundWriter(self._fileobj) as w:
+                with _TarFile.open(mode=mode, fileobj=w,
+                                   format=tarfile.PAX_FORMAT) as tarf:
+                    self._add_items(tarf, True)
+        elif mode == 'x:':
+            # Uncompressed: the member data is copied in the kernel
+            # directly to the archive file, if possible.
+            with _TarFile.open(self.path, mode,
+                               format=tarfile.PAX_FORMAT) as tarf:
+                self._add_items(tarf, self._readorder != ReadOrder.PATH)
+        else:
+            # Compressed: overlap reading the files in a background
+            # thread, compressing in this thread, and writing the
+            # output in another background thread.
+            with open(self.path, "xb") as f, BackgroundWriter(f) as w:
+                with _TarFile.open(self.path, mode, fileobj=w,
+                                   format=tarfile.PAX_FORMAT) as tarf:
+                    self._add_items(tarf, True)
+
+    def _add_items(self, tarf, readahead):
+        with tempfile.TemporaryFile() as tmpf:
+            self.manifest.write(tmpf)
+            tmpf.seek(0)
+            self.add_metadata(".manifest.yaml", tmpf)
+            md_names = self._add_metadata_files(tarf)
+        if readahead:
+            # Read ahead the content of the files in windows, in read
+            # order, in a background thread.  The members are still
+            # added in path order.
+            windows = reorder_windows(self._read_file, self.manifest,
+                                      self._read_key, Manifest.ReadWindow,
+                                      self.ReadBufferSize, lambda fi: fi.size)
+            items = itertools.chain.from_iterable(background(windows, 1))
+        else:
+            items = ((fi, None) for fi in self.manifest)
+        for fi, data in items:
+            arcname = self._arcname(fi.path)
+            if arcname in md_names:
+                raise ArchiveCreateError("invalid path '%s': this "
+                                         "filename is reserved" % fi.path)
+            if fi.ref or fi.chunks is not None:
+                # The content is in another archive or in the
+                # chunk store.
+                continue
+            self._add_item(tarf, fi, arcname, data)
+
+    def _read_key(self, fi):
+        if (fi.is_file() and not fi.ref and not fi.delta and
+            fi.chunks is None and fi.path not in self._spooled and
+            fi.size <= self.ReadBufferSize):
+            return self._readorder.key(fi)
+        else:
+            return None
+
+    def _read_file(self, fi):
+        """Read the content of a regular file.
+
+        Return :const:`None` if the file is sparse or if it can't be
+        read.  The file will then be read again when adding it.
+        """
+        try:
+            with open_input(fi.path) as f:
+                if sparse_map(f.fileno(), fi.size) is not None:
+                    return None
+                return f.read(fi.size)
+        except OSError:
+            return None
+
+    def _add_item(self, tarf, fi, arcname, data=None):
+        if fi.is_file() and fi.path in self._spooled:
+            ti = self._tarinfo(fi, arcname)
+            self._spool.seek(self._spooled[fi.path])
+            tarf.addfile(ti, fileobj=self._spool)
+            return
         ti = tarf.gettarinfo(str(fi.path), arcname=arcname)
-        if fi.is_file():
+        if fi.is_file() and fi.delta:
+            ti.size = fi.delta['size']
+            ti.type = tarfile.REGTYPE
+            ti.linkname = ''
+            with self._deltafiles[fi.path].open("rb") as f:
+                tarf.addfile(ti, fileobj=f)
+        elif fi.is_file():
             dup = self._check_duplicate(fi, arcname)
             if dup:
                 ti.type = tarfile.LNKTYPE
@@ -142,24 +607,56 @@ class Archive:
                 ti.size = fi.size
                 ti.type = tarfile.REGTYPE
                 ti.linkname = ''
-                with fi.path.open("rb") as f:
-                    tarf.addfile(ti, fileobj=f)
+                if data is not None:
+                    tarf.addfile(ti, fileobj=io.BytesIO(data))
+                else:
+                    with open_input(fi.path) as f:
+                        ti.sparse = sparse_map(f.fileno(), fi.size)
+                        tarf.addfile(ti, fileobj=f)
         else:
             tarf.addfile(ti)
 
+    @staticmethod
+    def _tarinfo(fi, arcname):
+        """Return a tar header for the item fi, not taking anything
+        from the file system.
+        """
+        ti = tarfile.TarInfo(arcname)
+        ti.mode = fi.mode
+        ti.uid = fi.uid
+        ti.gid = fi.gid
+        ti.uname = fi.uname or ""
+        ti.gname = fi.gname or ""
+        ti.mtime = fi.mtime
+        if fi.is_dir():
+            ti.type = tarfile.DIRTYPE
+        elif fi.is_symlink():
+            ti.type = tarfile.SYMTYPE
+            ti.linkname = str(fi.target)
+        else:
+            ti.type = tarfile.REGTYPE
+            ti.size = fi.size
+        return ti
+
     def _check_paths(self, paths, basedir, excludes=None):
         """Check the paths to be added to an archive for several error
-        conditions.  Accept a list of path-like objects.  Also sets
-        self.basedir.
+        conditions.  Accept an iterable of path-like objects.  Also
+        sets self.basedir.
         """
-        if not paths:
+        paths = iter(paths)
+        try:
+            first = next(paths)
+        except StopIteration:
             raise ArchiveCreateError("refusing to create an empty archive")
-        abspath = paths[0].is_absolute()
+        abspath = first.is_absolute()
         if not basedir:
             if abspath:
+                if self.path is None:
+                    raise ArchiveCreateError("basedir is required when "
+                                             "writing to a stream")
                 self.basedir = Path(self.path.name.split('.')[0])
             else:
-                self.basedir = Path(paths[0].parts[0])
+                self.basedir = Path(first.parts[0])
         else:
             self.basedir = basedir
         if self.basedir.is_absolute():
@@ -170,7 +667,8 @@ class Archive:
         # The same rules for paths also apply to excludes, if
         # provided.  So we may just iterate over the chain of both
         # lists.
-        for p in itertools.chain(paths, excludes or ()):
+        excludes = ExcludeRules.get(excludes).paths
+        for p in itertools.chain((first,), paths, excludes):
             if not _is_normalized(p):
                 raise ArchiveCreateError("invalid path '%s': "
                                          "must be normalized" % p)
@@ -212,11 +710,11 @@ class Archive:
                 return None
             idxkey = (st.st_dev, st.st_ino)
         elif self._dedup == DedupMode.CONTENT:
+            hashalg = self.manifest.checksums[0]
             try:
-                hashalg = fileinfo.Checksums[0]
-            except IndexError:
+                idxkey = fileinfo.checksum[hashalg]
+            except KeyError:
                 return None
-            idxkey = fileinfo.checksum[hashalg]
         else:
             return None
         if idxkey in self._dupindex:
@@ -230,15 +728,31 @@ class Archive:
         md = MetadataItem(name=name, path=path, fileobj=fileobj, mode=mode)
         self._metadata.insert(0, md)
 
-    def open(self, path):
+    def open(self, path=None, fileobj=None):
+        """Open the archive for reading.
+
+        If fileobj is given, the archive is read from this binary file
+        object as a stream, path is optional in this case.  The items
+        in a stream can only be accessed in the order of the archive:
+        :meth:`Archive.verify` works, but nothing else needing the
+        content of items, except for :meth:`Archive.extract_files`.
+        """
+        try:
+            if fileobj is not None:
+                self._file = _TarFile.open(path and str(path), 'r|*',
+                                           fileobj=fileobj)
+            else:
+                self._file = _TarFile.open(path, 'r')
+        except (OSError, tarfile.TarError) as e:
+            raise ArchiveReadError(str(e))
+        self.path = path.resolve() if path is not None else None
+        self._fileobj = fileobj
         try:
-            self._file = tarfile.open(path, 'r')
-        except OSError as e:
+            md = self.get_metadata(".manifest.yaml")
+            self.basedir = md.path.parent
+            self.manifest = Manifest(fileobj=md.fileobj)
+        except tarfile.TarError as e:
             raise ArchiveReadError(str(e))
-        self.path = path.resolve()
-        md = self.get_metadata(".manifest.yaml")
-        self.basedir = md.path.parent
-        self.manifest = Manifest(fileobj=md.fileobj)
         if not self.manifest.metadata:
             # Legacy: Manifest version 1.0 did not have metadata.
             self.manifest.add_metadata(self.basedir / ".manifest.yaml")
@@ -258,6 +772,9 @@ class Archive:
         if self._file:
             self._file.close()
         self._file = None
+        if self._chunkstore is not None:
+            self._chunkstore.close()
+        self._chunkstore = None
 
     def __enter__(self):
         return self
@@ -288,20 +805,103 @@ class Archive:
                 raise ArchiveIntegrityError("metadata item '%s' not found"
                                             % md)
         # Check the content of the archive.
+        if self._fileobj is not None:
+            self._verify_stream(tarf_it)
+        else:
+            for fileinfo in self.manifest:
+                if fileinfo.ref:
+                    continue
+                if fileinfo.chunks is not None:
+                    self._verify_chunks(fileinfo)
+                    continue
+                self._verify_item(fileinfo)
+
+    def _verify_stream(self, tarf_it):
+        """Verify the items of a stream in a single pass.
+
+        The members of the tar file must be in the same order as the
+        items in the manifest, as written by :meth:`Archive.create`.
+        Hard links are verified against the checksum of their target.
+        """
+        checksums = {}
         for fileinfo in self.manifest:
-            self._verify_item(fileinfo)
+            if fileinfo.ref:
+                continue
+            if fileinfo.chunks is not None:
+                self._verify_chunks(fileinfo)
+                continue
+            try:
+                tarinfo = next(tarf_it, None)
+                if (tarinfo is None or
+                    tarinfo.name != self._arcname(fileinfo.path)):
+                    raise ArchiveIntegrityError("%s: missing"
+                                                % self._itemname(fileinfo))
+                self._verify_item(fileinfo, tarinfo, checksums)
+            except tarfile.TarError as e:
+                # Most likely, the stream has been truncated.
+                raise ArchiveIntegrityError("%s: %s"
+                                            % (self._itemname(fileinfo), e))
+
+    def _get_chunkstore(self):
+        if self._chunkstore is None:
+            try:
+                location = Path(self.manifest.head["ChunkStore"])
+            except KeyError:
+                raise ArchiveReadError("%s: no chunk store" % self.path)
+            if self.path is not None:
+                location = self.path.parent / location
+            if not location.is_dir():
+                raise ArchiveReadError("%s: chunk store %s not found"
+                                       % (self.path, location))
+            self._chunkstore = ChunkStore(location)
+        return self._chunkstore
 
-    def _verify_item(self, fileinfo):
+    def _read_chunks(self, fileinfo):
+        """Read the content of a regular file from the chunk store.
+        """
+        store = self._get_chunkstore()
+        try:
+            yield from store.iter_read(fileinfo.chunks)
+        except ArchiveIntegrityError as e:
+            raise ArchiveIntegrityError("%s: %s"
+                                        % (self._itemname(fileinfo), e))
+
+    def _verify_chunks(self, fileinfo):
+        itemname = self._itemname(fileinfo)
+        hashes = { a: new_hash(a) for a in fileinfo.checksum.keys() }
+        size = 0
+        for data in self._read_chunks(fileinfo):
+            size += len(data)
+            for h in hashes.values():
+                h.update(data)
+        if size != fileinfo.size:
+            raise ArchiveIntegrityError("%s: wrong size" % itemname)
+        cs = { a: h.hexdigest() for a, h in hashes.items() }
+        if cs != fileinfo.checksum:
+            raise ArchiveIntegrityError("%s: checksum does not match"
+                                        % itemname)
+
+    def _itemname(self, fileinfo):
+        return "%s:%s" % (self.path or "-", fileinfo.path)
+
+    def _verify_item(self, fileinfo, tarinfo=None, checksums=None):
+        """Verify an item.
+
+        If checksums is not :const:`None`, the checksums of regular
+        files are recorded in there and the checksum of hard links is
+        taken from there, rather then reading the link target again.
+        """
 
         def _check_condition(cond, item, message):
             if not cond:
                 raise ArchiveIntegrityError("%s: %s" % (item, message))
 
-        itemname = "%s:%s" % (self.path, fileinfo.path)
-        try:
-            tarinfo = self._file.getmember(self._arcname(fileinfo.path))
-        except KeyError:
-            raise ArchiveIntegrityError("%s: missing" % itemname)
+        itemname = self._itemname(fileinfo)
+        if tarinfo is None:
+            try:
+                tarinfo = self._file.getmember(self._arcname(fileinfo.path))
+            except KeyError:
+                raise ArchiveIntegrityError("%s: missing" % itemname)
         _check_condition(tarinfo.mode == fileinfo.mode,
                          itemname, "wrong mode")
         _check_condition(int(tarinfo.mtime) == int(fileinfo.mtime),
@@ -312,13 +912,25 @@ class Archive:
         elif fileinfo.is_file():
             _check_condition(tarinfo.isfile() or tarinfo.islnk(),
                              itemname, "wrong type, expected regular file")
+            if fileinfo.delta:
+                # Only the delta can be verified here.
+                size = fileinfo.delta['size']
+                expected = fileinfo.delta['checksum']
+            else:
+                size = fileinfo.size
+                expected = fileinfo.checksum
             if tarinfo.isfile():
-                _check_condition(tarinfo.size == fileinfo.size,
+                _check_condition(tarinfo.size == size,
                                  itemname, "wrong size")
-            with self._file.extractfile(tarinfo) as f:
-                cs = checksum(f, fileinfo.checksum.keys())
-                _check_condition(cs == fileinfo.checksum,
-                                 itemname, "checksum does not match")
+            if checksums is not None and tarinfo.islnk():
+                cs = checksums.get(tarinfo.linkname)
+            else:
+                with self._file.extractfile(tarinfo) as f:
+                    cs = checksum(f, expected.keys())
+                if checksums is not None:
+                    checksums[tarinfo.name] = cs
+            _check_condition(cs == expected,
+                             itemname, "checksum does not match")
         elif fileinfo.is_symlink():
             _check_condition(tarinfo.issym(),
                              itemname, "wrong type, expected symbolic link")
@@ -327,13 +939,163 @@ class Archive:
         else:
             raise ArchiveIntegrityError("%s: invalid type" % (itemname))
 
-    def extract_member(self, fi, targetdir):
+    def _content_member(self, path):
+        """Return the tar file and the member having the content of
+        the regular file at path in the manifest.
+        """
+        try:
+            tarinfo = self._file.getmember(self._arcname(path))
+            if tarinfo.islnk():
+                tarinfo = self._file.getmember(tarinfo.linkname)
+        except KeyError:
+            raise ArchiveReadError("%s:%s: not found" % (self.path, path))
+        return (self._file, tarinfo)
+
+    def _source_member(self, fi, ref, resolve):
+        """Return the tar file and the member in another archive
+        referred to by ref.
+        """
+        if resolve is None:
+            raise ArchiveReadError("%s: content is in archive %s"
+                                   % (self._itemname(fi), ref['archive']))
+        source = resolve(ref['archive'])
+        return source._content_member(Path(ref['path']))
+
+    def _extract_delta(self, fi, target, resolve):
+        tarf, tarinfo = self._source_member(fi, fi.delta, resolve)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryFile() as base:
+            with tarf.extractfile(tarinfo) as f:
+                shutil.copyfileobj(f, base)
+            with self._file.extractfile(self._arcname(fi.path)) as f, \
+                 target.open("wb") as out:
+                try:
+                    delta.patch(base, f, out)
+                except ValueError as e:
+                    raise ArchiveIntegrityError("%s: %s"
+                                                % (self._itemname(fi), e))
+        with target.open("rb") as f:
+            if checksum(f, fi.checksum.keys()) != fi.checksum:
+                raise ArchiveIntegrityError("%s: checksum does not match"
+                                            % self._itemname(fi))
+        self._set_attrs(fi, target)
+
+    def _extract_chunks(self, fi, target):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with target.open("wb") as out:
+            for data in self._read_chunks(fi):
+                out.write(data)
+        self._set_attrs(fi, target)
+
+    def _set_attrs(self, fi, target):
+        if os.geteuid() == 0:
+            os.chown(target, fi.uid, fi.gid)
+        os.chmod(target, fi.mode)
+
+    def extract_file(self, fi, target, resolve=None):
+        """Write the content of the regular file fi in the archive to
+        the path target and set its mode and ownership.
+
+        Contrary to :meth:`extract_member`, the content is written to
+        target regardless of the path of the item.  resolve is used
+        as in :meth:`extract` if the content is in another archive.
+        """
+        if not fi.is_file():
+            raise ValueError("%s: not a regular file" % self._itemname(fi))
+        if fi.delta:
+            self._extract_delta(fi, target, resolve)
+        elif fi.chunks is not None:
+            self._extract_chunks(fi, target)
+        else:
+            if fi.ref:
+                tarf, tarinfo = self._source_member(fi, fi.ref, resolve)
+            else:
+                tarf, tarinfo = self._content_member(fi.path)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with tarf.extractfile(tarinfo) as f, target.open("wb") as out:
+                shutil.copyfileobj(f, out)
+            self._set_attrs(fi, target)
+
+    def extract_files(self, files):
+        """Write the content of regular files in the archive to
+        arbitrary targets in one sequential pass over the archive.
+
+        files maps paths of items in the manifest to lists of tuples
+        of the target path and a FileInfo defining the mode and
+        ownership of the target.  Only content stored in this archive
+        is considered.  Content stored as a hard link is copied from
+        the target of the link if that has been extracted in the same
+        pass and skipped otherwise.  Return the set of the paths that
+        have been extracted.
+        """
+        wanted = { self._arcname(p): p for p in files }
+        done = {}
+        for tarinfo in self._file:
+            path = wanted.get(tarinfo.name)
+            if path is None:
+                continue
+            (first, fi), *others = files[path]
+            first.parent.mkdir(parents=True, exist_ok=True)
+            if tarinfo.isreg():
+                with self._file.extractfile(tarinfo) as f, \
+                     first.open("wb") as out:
+                    shutil.copyfileobj(f, out)
+            elif tarinfo.islnk() and tarinfo.linkname in done:
+                shutil.copyfile(done[tarinfo.linkname], first)
+            else:
+                continue
+            self._set_attrs(fi, first)
+            for target, fi in others:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(first, target)
+                self._set_attrs(fi, target)
+            done[tarinfo.name] = first
+        return { wanted[n] for n in done }
+
+    def extract_member(self, fi, targetdir, resolve=None):
         arcname = self._arcname(fi.path)
         mtimes = (fi.mtime, fi.mtime)
-        self._file.extract(arcname, path=str(targetdir))
+        if fi.is_file() and fi.delta:
+            self._extract_delta(fi, targetdir / arcname, resolve)
+        elif fi.is_file() and fi.chunks is not None:
+            self._extract_chunks(fi, targetdir / arcname)
+        elif fi.ref:
+            tarf, tarinfo = self._source_member(fi, fi.ref, resolve)
+            tarinfo = copy.copy(tarinfo)
+            tarinfo.name = arcname
+            tarinfo.mode = fi.mode
+            tarinfo.uid = fi.uid
+            tarinfo.gid = fi.gid
+            tarinfo.uname = fi.uname or ""
+            tarinfo.gname = fi.gname or ""
+            tarf.extract(tarinfo, path=str(targetdir))
+        else:
+            self._file.extract(arcname, path=str(targetdir))
         os.utime(targetdir / arcname, mtimes, follow_symlinks=False)
 
-    def extract(self, targetdir, inclmeta=False):
+    def extract(self, targetdir, inclmeta=False, resolve=None):
+        """Extract the archive into targetdir.
+
+        The content of items having a reference to another archive,
+        as created by `backup-tool` for incremental backups, is taken
+        from there.  Items stored as a delta are reconstructed from
+        their delta base in another archive.  resolve is called with
+        the name of that archive and must return it opened for
+        reading.  These archives are closed again when done.
+        """
+        sources = {}
+        def get_source(name):
+            if name not in sources:
+                sources[name] = resolve(name)
+            return sources[name]
+        try:
+            self._extract(targetdir, inclmeta,
+                          get_source if resolve else None)
+        finally:
+            for a in sources.values():
+                a.close()
+
+    def _extract(self, targetdir, inclmeta, resolve):
         # We extract the directories last in reverse order.  This way,
         # the directory attributes, in particular the file modification
         # time, is set correctly after the file content is written into
@@ -346,7 +1108,7 @@ class Archive:
             if fi.is_dir():
                 dirstack.append(fi)
             else:
-                self.extract_member(fi, targetdir)
+                self.extract_member(fi, targetdir, resolve)
         while True:
             try:
                 fi = dirstack.pop()
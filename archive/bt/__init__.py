@@ -9,7 +9,7 @@ from archive.exception import ArchiveError, ConfigError
 from archive.bt.config import Config
 
 log = logging.getLogger(__name__)
-subcmds = ( "create", "index", )
+subcmds = ( "consolidate", "create", "index", "restore", "watch", )
 
 def backup_tool():
     logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
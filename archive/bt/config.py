@@ -5,12 +5,25 @@ import datetime
 import os
 from pathlib import Path
 import pwd
+import re
 import socket
 from archive.archive import DedupMode
+from archive.manifest import ReadOrder
 import archive.config
 from archive.exception import ConfigError
+from archive.exclude import ExcludeRules
+from archive.tools import parse_size
 
 
+def parse_bool(value):
+    v = value.lower()
+    if v in ('yes', 'true', 'on', '1'):
+        return True
+    elif v in ('no', 'false', 'off', '0'):
+        return False
+    else:
+        raise ConfigError("invalid boolean value '%s'" % value)
+
 def get_config_file():
     try:
         return os.environ['BACKUP_CFG']
@@ -22,11 +35,24 @@ class Config(archive.config.Config):
     defaults = {
         'dirs': None,
         'excludes': "",
+        'excludesize': None,
+        'ignorefile': None,
+        'onefilesystem': 'no',
         'backupdir': None,
         'targetdir': "%(backupdir)s",
         'name': "%(host)s-%(date)s-%(schedule)s.tar.bz2",
         'schedules': None,
         'dedup': 'link',
+        'sortbuffer': None,
+        'checksums': None,
+        'readorder': 'path',
+        'bwlimit': None,
+        'iopslimit': None,
+        'volumesize': None,
+        'shards': None,
+        'deltasize': None,
+        'chunkstore': None,
+        'journal': None,
     }
     args_options = ('policy', 'user')
 
@@ -80,7 +106,17 @@ class Config(archive.config.Config):
 
     @property
     def excludes(self):
-        return self.get('excludes', split=True, type=Path)
+        specs = self.get('excludes', split=True) or ()
+        try:
+            return ExcludeRules.parse(specs,
+                                      maxsize=self.get('excludesize',
+                                                       type=parse_size),
+                                      onefs=self.get('onefilesystem',
+                                                     type=parse_bool),
+                                      ignorefile=self.get('ignorefile'))
+        except re.error as e:
+            raise ConfigError("invalid regular expression in excludes: %s"
+                              % e)
 
     @property
     def backupdir(self):
@@ -94,6 +130,46 @@ class Config(archive.config.Config):
     def dedup(self):
         return self.get('dedup', required=True, type=DedupMode)
 
+    @property
+    def sortbuffer(self):
+        return self.get('sortbuffer', type=int)
+
+    @property
+    def checksums(self):
+        return self.get('checksums', split=True)
+
+    @property
+    def readorder(self):
+        return self.get('readorder', required=True, type=ReadOrder)
+
+    @property
+    def bwlimit(self):
+        return self.get('bwlimit', type=parse_size)
+
+    @property
+    def iopslimit(self):
+        return self.get('iopslimit', type=int)
+
+    @property
+    def volumesize(self):
+        return self.get('volumesize', type=parse_size)
+
+    @property
+    def shards(self):
+        return self.get('shards', type=int)
+
+    @property
+    def deltasize(self):
+        return self.get('deltasize', type=parse_size)
+
+    @property
+    def chunkstore(self):
+        return self.get('chunkstore', type=Path)
+
+    @property
+    def journal(self):
+        return self.get('journal', type=Path)
+
     @property
     def path(self):
         return self.targetdir / self.name
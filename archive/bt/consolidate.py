@@ -0,0 +1,315 @@
+"""Consolidate a chain of backups into a synthetic full backup.
+"""
+
+import copy
+import datetime
+import logging
+import os
+from pathlib import Path
+import shutil
+import tarfile
+import tempfile
+from archive.archive import Archive
+from archive.exception import ArchiveCreateError, ArchiveReadError
+from archive.index import ArchiveIndex
+from archive.tools import tmp_umask
+from archive.bt.create import chown, get_prev_backups, get_schedules, get_tags
+from archive.bt.restore import get_chain, get_state
+
+
+log = logging.getLogger(__name__)
+
+
+SpoolLimit = 1024*1024*1024
+"""Maximum size of the spool for content taken out of order."""
+
+class _Stream:
+    """Read the members of the archive or volume set of an index item
+    sequentially.
+
+    Regular files having their path in pending are copied to spool
+    when passed, as long as the spool does not grow beyond spool_limit
+    bytes, so that :meth:`fetch` may take them later on.
+    """
+
+    def __init__(self, item, pending=(), spool=None, spool_limit=None):
+        self.item = item
+        self._members = self._iter_members()
+        self._pending = set(pending)
+        self._spool = spool
+        self._spool_limit = spool_limit
+        self._spooled = {}
+        self._last = None
+
+    def _iter_members(self):
+        for p in self.item.paths:
+            with p.open("rb") as f:
+                with Archive().open(p, fileobj=f) as archive:
+                    absolute = archive.manifest[0].path.is_absolute()
+                    for tarinfo in archive._file:
+                        yield archive, absolute, tarinfo
+
+    @staticmethod
+    def _path(archive, absolute, name):
+        path = Path(name)
+        if absolute:
+            path = Path("/", path.relative_to(archive.basedir))
+        return path
+
+    def find(self, path):
+        """Skip ahead to the member for the item at path.  Return the
+        tar file, the member and the path of the item it links to, if
+        it is a hard link.
+        """
+        for archive, absolute, tarinfo in self._members:
+            if tarinfo.name == archive._arcname(path):
+                linkpath = None
+                if tarinfo.islnk():
+                    linkpath = self._path(archive, absolute,
+                                          tarinfo.linkname)
+                return archive._file, tarinfo, linkpath
+        raise ArchiveReadError("%s: %s not found"
+                               % (self.item.path.name, path))
+
+    def fetch(self, path):
+        """Return the tar file and the member having the content of the
+        regular file at path.  If the content has been spooled, return
+        :const:`None` and its offset in the spool instead.
+
+        The items may be requested in any order.  If path has been
+        passed already without spooling it, another pass over the
+        archive is started.
+        """
+        self._pending.discard(path)
+        offset = self._spooled.pop(path, None)
+        if offset is not None:
+            return None, offset
+        if self._last is not None and self._last >= path:
+            self._members.close()
+            self._members = self._iter_members()
+        for archive, absolute, tarinfo in self._members:
+            p = self._last = self._path(archive, absolute, tarinfo.name)
+            if p == path:
+                if tarinfo.islnk():
+                    return self.fetch(self._path(archive, absolute,
+                                                 tarinfo.linkname))
+                return archive._file, tarinfo
+            if p in self._pending and tarinfo.isreg():
+                end = self._spool.seek(0, os.SEEK_END)
+                if (self._spool_limit is not None and
+                    end + tarinfo.size > self._spool_limit):
+                    continue
+                self._pending.discard(p)
+                self._spooled[p] = end
+                with archive._file.extractfile(tarinfo) as f:
+                    shutil.copyfileobj(f, self._spool)
+        raise ArchiveReadError("%s: %s not found"
+                               % (self.item.path.name, path))
+
+    def close(self):
+        self._members.close()
+
+
+class _ConsolidatedArchive(Archive):
+    """An archive taking the content of the items from the archives of
+    a chain, rather then from the file system.
+
+    sources maps the paths of the items to tuples of the index item
+    of the archive holding the latest version and the FileInfo in
+    there.  The content is read sequentially from the archives.
+    Content referred to in other archives is read from another pass
+    over those, spooling what is needed later on the way.  index is
+    used to find these archives.  resolve is used to open archives
+    for random access to reconstruct files from deltas.
+    """
+
+    def __init__(self, sources, index, resolve, chunkstore=None):
+        super().__init__()
+        self._sources = sources
+        self._index = index
+        self._resolve = resolve
+        self._chunkstore_location = chunkstore
+        self._streams = {}
+        self._fetch_streams = {}
+        self._spool = None
+        self._copied = {}
+        self._refs = {}
+        for item, src_fi in sources.values():
+            if src_fi.is_file() and src_fi.ref:
+                ref = src_fi.ref
+                self._refs.setdefault(ref['archive'], set()).add(
+                    Path(ref['path']))
+
+    def _create(self, mode):
+        if self._chunkstore_location:
+            location = self._chunkstore_location
+            try:
+                location = location.relative_to(self.path.parent)
+            except ValueError:
+                pass
+            self.manifest.head["ChunkStore"] = str(location)
+        try:
+            with tempfile.TemporaryFile() as self._spool:
+                super()._create(mode)
+        finally:
+            for s in self._streams.values():
+                s.close()
+            for s in self._fetch_streams.values():
+                s.close()
+            self._streams = {}
+            self._fetch_streams = {}
+            self._spool = None
+
+    def _read_key(self, fi):
+        # The content is taken from the archives in the chain, not
+        # from the file system, there is nothing to read ahead.
+        return None
+
+    def _get_stream(self, item):
+        try:
+            return self._streams[item]
+        except KeyError:
+            stream = self._streams[item] = _Stream(item)
+            return stream
+
+    def _get_fetch_stream(self, name):
+        try:
+            return self._fetch_streams[name]
+        except KeyError:
+            for item in self._index:
+                if any(p.name == name for p in item.paths):
+                    break
+            else:
+                raise ArchiveReadError("archive %s not found in the index"
+                                       % name)
+            stream = _Stream(item, self._refs.get(name, ()), self._spool,
+                             SpoolLimit)
+            self._fetch_streams[name] = stream
+            return stream
+
+    def _add_fetched(self, tarf, ti, name, path):
+        src_tarf, src_ti = self._get_fetch_stream(name).fetch(path)
+        if src_tarf is None:
+            self._spool.seek(src_ti)
+            tarf.addfile(ti, fileobj=self._spool)
+        else:
+            with src_tarf.extractfile(src_ti) as f:
+                tarf.addfile(ti, fileobj=f)
+
+    def _add_item(self, tarf, fi, arcname, data=None):
+        ti = self._tarinfo(fi, arcname)
+        if not fi.is_file():
+            tarf.addfile(ti)
+            return
+        item, src_fi = self._sources[fi.path]
+        name = item.path.name
+        if src_fi.delta:
+            # Reconstruct the file from the delta.
+            with tempfile.TemporaryDirectory(prefix="archive-tools-") as d:
+                target = Path(d, "content")
+                source = self._resolve(name)
+                source.extract_file(src_fi, target, self._resolve)
+                with target.open("rb") as f:
+                    tarf.addfile(ti, fileobj=f)
+            return
+        if src_fi.ref:
+            self._add_fetched(tarf, ti, src_fi.ref['archive'],
+                              Path(src_fi.ref['path']))
+            return
+        stream = self._get_stream(item)
+        src_tarf, src_ti, linkpath = stream.find(fi.path)
+        if linkpath is not None:
+            dup = self._copied.get((name, linkpath))
+            if dup:
+                ti.type = tarfile.LNKTYPE
+                ti.linkname = dup
+                ti.size = 0
+                tarf.addfile(ti)
+                return
+            # The link target is not in the consolidated archive,
+            # take the content from another pass over the source.
+            self._add_fetched(tarf, ti, name, linkpath)
+            return
+        self._copied[name, fi.path] = arcname
+        with src_tarf.extractfile(src_ti) as f:
+            tarf.addfile(ti, fileobj=f)
+
+
+def get_chunkstore(chain):
+    """Return the location of the chunk store used by the archives in
+    chain, if any.
+    """
+    locations = set()
+    for i in chain:
+        with i.open() as archive:
+            location = archive.manifest.head.get("ChunkStore")
+            if location:
+                locations.add((i.path.parent / location).resolve())
+    if len(locations) > 1:
+        raise ArchiveCreateError("the archives use different chunk stores")
+    return locations.pop() if locations else None
+
+def consolidate(args, config):
+    chain = get_chain(config, datetime.datetime.now())
+    if len(chain) < 2:
+        log.info("%s is a full backup, nothing to consolidate",
+                 chain[-1].path.name)
+        return 0
+    schedules = { s.name: s for s in get_schedules(config) }
+    schedule = schedules[chain[0].schedule]
+    config['schedule'] = schedule.name
+    log.info("consolidating %s", ", ".join(i.path.name for i in chain))
+    state = get_state(chain)
+    checksums = None
+    fileinfos = []
+    for item, fi in state.values():
+        if fi.is_file():
+            algs = set(fi.checksum.keys())
+            checksums = algs if checksums is None else checksums & algs
+        fi = copy.copy(fi)
+        fi.ref = None
+        fi.delta = None
+        fileinfos.append(fi)
+    if checksums is not None and not checksums:
+        raise ArchiveCreateError("no checksum algorithm common to all files")
+    if checksums is not None:
+        # Keep the order of preference of the configuration.
+        prefs = config.checksums or []
+        checksums = ([ a for a in prefs if a in checksums ] +
+                     sorted(checksums.difference(prefs)))
+    chunkstore = None
+    if any(fi.is_file() and fi.chunks is not None for fi in fileinfos):
+        chunkstore = get_chunkstore(chain)
+
+    idx = ArchiveIndex()
+    for i in get_prev_backups(config):
+        idx.append(i)
+    opened = {}
+    def resolve(name):
+        if name not in opened:
+            opened[name] = idx.open_archive(name)
+        return opened[name]
+
+    log.debug("creating archive %s", config.path)
+    try:
+        with tmp_umask(0o277):
+            arch = _ConsolidatedArchive(state, idx, resolve, chunkstore)
+            arch.create(config.path, fileinfos=fileinfos,
+                        tags=get_tags(config, schedule),
+                        checksums=checksums)
+            if config.user:
+                chown(arch.path, config.user)
+    finally:
+        for a in opened.values():
+            a.close()
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('consolidate',
+                                   help=("merge the last full backup and "
+                                         "its differential backups into "
+                                         "a new full backup"))
+    clsgrp = parser.add_mutually_exclusive_group()
+    clsgrp.add_argument('--policy', default='sys')
+    clsgrp.add_argument('--user')
+    parser.set_defaults(func=consolidate)
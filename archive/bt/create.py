@@ -1,16 +1,20 @@
 """Create a backup.
 """
 
-from collections.abc import Sequence
+import bisect
 import datetime
+import itertools
 import logging
 import os
 import pwd
-from archive.archive import Archive
+from archive.archive import Archive, DedupMode
+from archive.chunks import ChunkStore
 from archive.exception import ArchiveCreateError
 from archive.index import ArchiveIndex
-from archive.manifest import Manifest, DiffStatus, diff_manifest
-from archive.tools import tmp_umask
+from archive.manifest import FileInfo, Manifest, DiffStatus, diff_manifest
+from archive.tools import Throttle, tmp_throttle, tmp_umask
+from archive.volume import VolumeSet
+from archive.bt.journal import ChangeJournal, JournalPosition
 from archive.bt.schedule import ScheduleDate, BaseSchedule, NoFullBackupError
 
 
@@ -31,13 +35,182 @@ def get_prev_backups(config):
         f_d['user'] = config.user
     return list(filter(lambda i: i >= f_d, idx))
 
+def is_covered(path, paths):
+    """Return :const:`True` if path or any of its parents is in the
+    set paths.
+    """
+    return path in paths or any(p in paths for p in path.parents)
+
+def drop_deleted(items, deleted):
+    """Remove the paths covered by deleted from the mapping items.
+    """
+    deleted = set(deleted)
+    if deleted:
+        for p in [ p for p in items if is_covered(p, deleted) ]:
+            del items[p]
+
+def record_deleted(paths, fileinfos, deleted):
+    """Pass the items from fileinfos through.  Add the paths from
+    paths that are missing in fileinfos to the set deleted.  Both,
+    paths and fileinfos must be sorted.
+    """
+    paths = iter(paths)
+    p = next(paths, None)
+    for fi in fileinfos:
+        while p is not None and p < fi.path:
+            deleted.add(p)
+            p = next(paths, None)
+        if p == fi.path:
+            p = next(paths, None)
+        yield fi
+    while p is not None:
+        deleted.add(p)
+        p = next(paths, None)
+
+def get_journal_changes(config, base, position):
+    """Return the paths and directory trees changed since the base
+    archive was created according to the change journal, or
+    :const:`None` if the journal has no complete information on that.
+    position is the current position in the journal.
+    """
+    if position is None:
+        return None
+    for t in base.tags:
+        if t.startswith("journal:"):
+            start = JournalPosition.parse(t[len("journal:"):])
+            if start:
+                return ChangeJournal(config.journal).changes(start, position)
+    log.debug("no journal position recorded in the base archive")
+    return None
+
+def iter_changes(dirs, excludes, checksums, paths, trees):
+    """Yield FileInfo objects for the changed paths and the content of
+    the changed directory trees, as far as they still exist.  The
+    parent directories of changed paths are taken as well, because
+    their modification time changes when items are created or deleted.
+    """
+    roots = {}
+    for p in itertools.chain(paths, trees):
+        for d in dirs:
+            if p == d or d in p.parents:
+                roots[p] = d
+                if p != d:
+                    roots.setdefault(p.parent, d)
+                break
+    for p in sorted(roots):
+        if any(q in trees for q in p.parents):
+            continue
+        rules = excludes.rules_for(roots[p], p)
+        if rules is None:
+            continue
+        fileinfos = FileInfo.iterpaths([p], rules, checksums)
+        try:
+            fi = next(fileinfos, None)
+        except FileNotFoundError:
+            continue
+        if fi is None:
+            continue
+        yield fi
+        if p in trees:
+            yield from fileinfos
+        else:
+            fileinfos.close()
+
+def changes_deleted(present, paths, trees):
+    """Yield the items from the sorted list of paths present that are
+    covered by changed paths that do not exist any more.
+    """
+    for p in sorted(paths | trees):
+        if os.path.lexists(str(p)):
+            continue
+        i = bisect.bisect_left(present, p)
+        while i < len(present) and (present[i] == p or
+                                    p in present[i].parents):
+            yield present[i]
+            i += 1
+
+def deleted_parents(dirs, deleted, checksums):
+    """Yield FileInfo objects for the directories that contained the
+    deleted paths, as far as they still exist.
+    """
+    parents = set()
+    for p in deleted:
+        for d in dirs:
+            if p != d and d in p.parents:
+                q = p.parent
+                while q != d and not q.is_dir():
+                    q = q.parent
+                if q.is_dir():
+                    parents.add(q)
+                break
+    for p in sorted(parents):
+        try:
+            yield FileInfo(path=p, checksums=checksums)
+        except FileNotFoundError:
+            continue
+
 def filter_fileinfos(base, fileinfos):
     for stat, fi1, fi2 in diff_manifest(base, fileinfos):
         if stat == DiffStatus.MISSING_B or stat == DiffStatus.MATCH:
             continue
         yield fi2
 
-def get_schedule(config):
+def index_content(base, name, contents):
+    """Add the regular files in the manifest of the base archive
+    having the file name name to the mapping contents.  The keys are
+    the checksums and the size, the values references to the content.
+    """
+    for fi in base:
+        if fi.is_file() and fi.size > 0:
+            # If the item in the base archive refers to yet another
+            # archive, refer to the latter directly.
+            ref = fi.ref or {'archive': name, 'path': str(fi.path)}
+            for alg, cs in fi.checksum.items():
+                contents.setdefault((alg, cs, fi.size), ref)
+
+def add_content_refs(contents, fileinfos):
+    """Refer to the content in a base archive for items having the
+    same content as an item in there, rather then storing it again.
+    """
+    for fi in fileinfos:
+        if fi.is_file() and fi.size > 0:
+            for alg, cs in fi.checksum.items():
+                ref = contents.get((alg, cs, fi.size))
+                if ref:
+                    fi.ref = dict(ref)
+                    break
+        yield fi
+
+def index_delta_bases(base, name, bases, deltasize):
+    """Add the regular files of at least deltasize in the manifest of
+    the base archive having the file name name to the mapping bases.
+    The keys are the paths, the values the delta bases to use for a
+    new version of the file.
+    """
+    for fi in base:
+        if fi.is_file() and fi.size >= deltasize:
+            # Use the version stored in full as delta base.
+            if fi.ref:
+                bases[fi.path] = fi.ref
+            elif fi.delta:
+                bases[fi.path] = {
+                    'archive': fi.delta['archive'],
+                    'path': fi.delta['path'],
+                }
+            else:
+                bases[fi.path] = {'archive': name, 'path': str(fi.path)}
+
+def add_delta_bases(bases, fileinfos):
+    """Set the delta base for modified files.
+    """
+    for fi in fileinfos:
+        if fi.is_file() and not fi.ref:
+            base = bases.get(fi.path)
+            if base:
+                fi.delta = dict(base)
+        yield fi
+
+def get_schedules(config):
     last_schedule = None
     schedules = []
     for s in config.schedules:
@@ -49,6 +222,10 @@ def get_schedule(config):
         sd_str = config.get('schedule.%s.date' % n, required=True)
         last_schedule = cls(n, ScheduleDate(sd_str), last_schedule)
         schedules.append(last_schedule)
+    return schedules
+
+def get_schedule(config):
+    schedules = get_schedules(config)
     now = datetime.datetime.now()
     for s in schedules:
         if s.match_date(now):
@@ -57,19 +234,84 @@ def get_schedule(config):
         log.debug("no schedule date matches now")
         return None
 
-def get_fileinfos(config, schedule):
-    fileinfos = Manifest(paths=config.dirs, excludes=config.excludes)
+def get_base_archives(config, schedule):
     try:
-        base_archives = schedule.get_base_archives(get_prev_backups(config))
+        return schedule.get_base_archives(get_prev_backups(config))
     except NoFullBackupError:
         raise ArchiveCreateError("No previous full backup found, can not "
                                  "create %s archive" % schedule.name)
-    for p in [i.path for i in base_archives]:
-        log.debug("considering %s to create differential archive", p)
-        with Archive().open(p) as base:
-            fileinfos = filter_fileinfos(base.manifest, fileinfos)
+
+def get_fileinfos(config, base_archives, deleted=None, position=None):
+    """Return the items to add to the archive.  If deleted is a set,
+    the paths of the items deleted since the base archives are added
+    to it while the items are being iterated.
+
+    If position is the current position in the change journal, the
+    items are taken from the paths recorded in the journal since the
+    last base archive has been created, rather then from scanning all
+    directories, if possible.
+    """
+    contents = {}
+    bases = {}
+    manifests = []
+    for i in base_archives:
+        log.debug("considering %s to create differential archive", i.path)
+        with i.open() as base:
+            manifests.append(base.manifest)
+            if config.dedup == DedupMode.CONTENT:
+                index_content(base.manifest, i.path.name, contents)
+            if config.deltasize:
+                index_delta_bases(base.manifest, i.path.name, bases,
+                                  config.deltasize)
+    changes = None
+    if manifests:
+        changes = get_journal_changes(config, manifests[-1], position)
+    if changes is None:
+        fileinfos = Manifest(paths=config.dirs, excludes=config.excludes,
+                             sortbuffer=config.sortbuffer,
+                             checksums=config.checksums,
+                             readorder=config.readorder,
+                             hashworkers=Manifest.HashWorkers)
+    else:
+        log.debug("taking %d changed paths and %d directory trees "
+                  "from the journal", len(changes[0]), len(changes[1]))
+        fileinfos = iter_changes(config.dirs, config.excludes,
+                                 config.checksums, *changes)
+        fileinfos = Manifest(fileinfos=fileinfos,
+                             sortbuffer=config.sortbuffer,
+                             checksums=config.checksums,
+                             readorder=config.readorder)
+    if deleted is not None and manifests:
+        # Compare the complete list of the current items with the
+        # state after the base archives, before the unchanged items
+        # are filtered out.
+        present = {}
+        for m in manifests:
+            drop_deleted(present, m.deleted)
+            present.update((fi.path, None) for fi in m)
+        if changes is None:
+            fileinfos = record_deleted(sorted(present), fileinfos, deleted)
+        else:
+            deleted.update(changes_deleted(sorted(present), *changes))
+    for m in manifests:
+        fileinfos = filter_fileinfos(m, fileinfos)
+    if contents:
+        fileinfos = add_content_refs(contents, fileinfos)
+    if bases:
+        fileinfos = add_delta_bases(bases, fileinfos)
     return fileinfos
 
+def get_tags(config, schedule):
+    tags = [
+        "host:%s" % config.host,
+        "policy:%s" % config.policy,
+        "schedule:%s" % schedule.name,
+        "type:%s" % schedule.ClsName,
+    ]
+    if config.user:
+        tags.append("user:%s" % config.user)
+    return tags
+
 def chown(path, user):
     try:
         pw = pwd.getpwnam(user)
@@ -86,28 +328,81 @@ def create(args, config):
     if schedule is None:
         return 0
     config['schedule'] = schedule.name
-    fileinfos = get_fileinfos(config, schedule)
-    if not isinstance(fileinfos, Sequence):
-        fileinfos = list(fileinfos)
-    if not fileinfos:
-        log.debug("nothing to archive")
-        return 0
+    throttle = None
+    if config.bwlimit or config.iopslimit:
+        throttle = Throttle(config.bwlimit, config.iopslimit)
+    with tmp_throttle(throttle):
+        return _create(config, schedule)
+
+def _create(config, schedule):
+    base_archives = get_base_archives(config, schedule)
+    position = None
+    if config.journal:
+        # Take the position before scanning, changes made while the
+        # backup is running are then included in the next one.
+        position = ChangeJournal(config.journal).position()
+        if position is None:
+            log.warning("no watcher is recording changes in %s",
+                        config.journal)
+    deleted = set()
+    fileinfos = iter(get_fileinfos(config, base_archives, deleted, position))
+    try:
+        first = next(fileinfos)
+    except StopIteration:
+        # An archive can't be empty.  If there are deletions to
+        # record, add the directories that contained the deleted
+        # items, so that the deletions are not lost.
+        fileinfos = deleted_parents(config.dirs, deleted, config.checksums)
+        first = next(fileinfos, None)
+        if first is None:
+            if deleted:
+                log.warning("no directory left to record %d deleted "
+                            "items", len(deleted))
+            log.debug("nothing to archive")
+            return 0
+    fileinfos = itertools.chain((first,), fileinfos)
 
     log.debug("creating archive %s", config.path)
 
-    tags = [
-        "host:%s" % config.host,
-        "policy:%s" % config.policy,
-        "schedule:%s" % schedule.name,
-        "type:%s" % schedule.ClsName,
-    ]
-    if config.user:
-        tags.append("user:%s" % config.user)
+    tags = get_tags(config, schedule)
+    if position:
+        tags.append("journal:%s" % str(position))
+    idx = ArchiveIndex()
+    for i in base_archives:
+        idx.append(i)
     with tmp_umask(0o277):
-        arch = Archive().create(config.path, fileinfos=fileinfos, tags=tags,
-                                dedup=config.dedup)
+        if config.chunkstore:
+            with ChunkStore(config.chunkstore) as store:
+                arch = Archive().create(config.path, fileinfos=fileinfos,
+                                        tags=tags, dedup=config.dedup,
+                                        sortbuffer=config.sortbuffer,
+                                        checksums=config.checksums,
+                                        readorder=config.readorder,
+                                        chunkstore=store, deleted=deleted)
+            paths = [arch.path]
+        elif config.volumesize or config.shards:
+            arch = VolumeSet().create(config.path, fileinfos=fileinfos,
+                                      tags=tags, dedup=config.dedup,
+                                      sortbuffer=config.sortbuffer,
+                                      checksums=config.checksums,
+                                      readorder=config.readorder,
+                                      volumesize=config.volumesize,
+                                      shards=config.shards,
+                                      resolve=idx.open_archive,
+                                      deleted=deleted)
+            paths = arch.paths
+        else:
+            arch = Archive().create(config.path, fileinfos=fileinfos,
+                                    tags=tags, dedup=config.dedup,
+                                    sortbuffer=config.sortbuffer,
+                                    checksums=config.checksums,
+                                    readorder=config.readorder,
+                                    resolve=idx.open_archive,
+                                    deleted=deleted)
+            paths = [arch.path]
         if config.user:
-            chown(arch.path, config.user)
+            for p in paths:
+                chown(p, config.user)
     return 0
 
 def add_parser(subparsers):
@@ -0,0 +1,213 @@
+"""Provide the change journal for backup-tool.
+
+The journal is written by ``backup-tool watch`` while it is running
+and records the paths that have been changed.  ``backup-tool create``
+takes the items for incremental backups from the journal rather then
+scanning all directories, if possible.
+"""
+
+import collections
+import fcntl
+import logging
+import os
+from pathlib import Path
+import uuid
+from archive.exception import ArchiveError
+
+
+log = logging.getLogger(__name__)
+
+
+class JournalPosition(collections.namedtuple('JournalPosition',
+                                             ['session', 'offset'])):
+    """A position in the change journal.  session identifies the run
+    of the watcher having written the journal, offset is the position
+    in the journal file.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "%s/%d" % self
+
+    @classmethod
+    def parse(cls, s):
+        """Return the position from its string representation, or
+        :const:`None` if s is not valid.
+        """
+        session, _, offset = s.rpartition("/")
+        try:
+            return cls(session, int(offset)) if session else None
+        except ValueError:
+            return None
+
+
+class ChangeJournal:
+    """A journal of changed paths.
+
+    The journal file starts with a header identifying the session,
+    followed by records, each being a type byte followed by a path and
+    terminated by a null byte.  A path record marks an item that has
+    been modified, created, or deleted, a tree record marks a
+    directory that has been created or moved in, including all of its
+    content.  An overflow record marks that changes have been lost.
+
+    The watcher keeps an exclusive lock on the journal file while it
+    is running.  The file is truncated and a new session is started
+    each time the watcher starts.
+    """
+
+    Magic = b"archive-tools change journal"
+    PathRecord = b"P"
+    TreeRecord = b"T"
+    OverflowRecord = b"O"
+    BlockSize = 65536
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.session = None
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def open(self):
+        """Open the journal for writing and truncate it.
+        """
+        f = self.path.open("ab")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise ArchiveError("%s: journal is in use by another watcher"
+                               % self.path)
+        f.truncate(0)
+        self._file = f
+        return self
+
+    def begin(self):
+        """Start a new session.  Positions in the journal are only
+        valid from now on.
+        """
+        self.session = uuid.uuid4().hex
+        self._file.write(b"%s %s\0" % (self.Magic, self.session.encode()))
+        self._file.flush()
+
+    def record(self, paths, trees=()):
+        """Record the changed paths and directory trees.
+        """
+        records = [ self.PathRecord + os.fsencode(p) + b"\0" for p in paths ]
+        records.extend(self.TreeRecord + os.fsencode(p) + b"\0"
+                       for p in trees)
+        if records:
+            self._file.write(b"".join(records))
+            self._file.flush()
+
+    def overflow(self):
+        """Record that changes have been lost.
+        """
+        self._file.write(self.OverflowRecord + b"\0")
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _read_session(self, f):
+        f.seek(0)
+        head = f.read(len(self.Magic) + 64).split(b"\0", 1)
+        if len(head) < 2:
+            return None
+        magic, _, session = head[0].rpartition(b" ")
+        if magic != self.Magic:
+            return None
+        return session.decode("ascii")
+
+    def _is_locked(self, f):
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        else:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+    def position(self):
+        """Return the current end of the journal as a
+        :class:`JournalPosition`.  Return :const:`None` if no watcher
+        is currently running.
+        """
+        try:
+            f = self.path.open("rb")
+        except FileNotFoundError:
+            log.debug("change journal %s not found", self.path)
+            return None
+        with f:
+            if not self._is_locked(f):
+                log.debug("no watcher running on %s", self.path)
+                return None
+            session = self._read_session(f)
+            if session is None:
+                log.debug("watcher on %s not ready", self.path)
+                return None
+            # Search backwards for the end of the last complete record.
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(end - self.BlockSize, 0)
+                f.seek(start)
+                i = f.read(end - start).rfind(b"\0")
+                if i >= 0:
+                    return JournalPosition(session, start + i + 1)
+                end = start
+            return None
+
+    def _records(self, f, start, end):
+        """Read the records between the offsets start and end from f
+        in blocks of :attr:`BlockSize` bytes.
+        """
+        f.seek(start)
+        size = end - start
+        rest = b""
+        while size > 0:
+            data = f.read(min(size, self.BlockSize))
+            if not data:
+                break
+            size -= len(data)
+            *records, rest = (rest + data).split(b"\0")
+            yield from records
+
+    def changes(self, start, end):
+        """Return the paths and the directory trees recorded between
+        the positions start and end as a pair of sets.  Return
+        :const:`None` if the journal does not have complete
+        information on this range, because the watcher has been
+        restarted in between or changes have been lost.
+        """
+        if start.session != end.session:
+            log.info("watcher on %s has been restarted", self.path)
+            return None
+        if start.offset > end.offset:
+            return None
+        try:
+            f = self.path.open("rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            if self._read_session(f) != end.session:
+                log.info("watcher on %s has been restarted", self.path)
+                return None
+            paths = set()
+            trees = set()
+            for r in self._records(f, start.offset, end.offset):
+                rtype, p = r[:1], r[1:]
+                if rtype == self.OverflowRecord:
+                    log.info("change journal %s overflowed", self.path)
+                    return None
+                elif rtype == self.TreeRecord:
+                    trees.add(Path(os.fsdecode(p)))
+                else:
+                    paths.add(Path(os.fsdecode(p)))
+        return paths, trees
@@ -0,0 +1,198 @@
+"""Restore the backed up files as they were at a point in time.
+"""
+
+import concurrent.futures
+import datetime
+import logging
+import os
+from pathlib import Path
+from archive.archive import Archive
+from archive.exception import ArchiveReadError
+from archive.index import ArchiveIndex
+from archive.tools import parse_date
+from archive.bt.create import drop_deleted, get_prev_backups, get_schedules
+from archive.bt.schedule import NoFullBackupError
+
+
+log = logging.getLogger(__name__)
+
+Workers = os.cpu_count() or 1
+"""Maximum number of archives to be read concurrently."""
+
+def get_chain(config, date):
+    """Return the archives needed to restore the state at date: the
+    last backup made at or before date, preceded by its base archives.
+    """
+    archives = [ i for i in get_prev_backups(config)
+                 if i.date.timestamp() <= date.timestamp() ]
+    if not archives:
+        raise ArchiveReadError("no backup found at or before %s" % date)
+    last = archives[-1]
+    schedules = { s.name: s for s in get_schedules(config) }
+    try:
+        schedule = schedules[last.schedule]
+    except KeyError:
+        raise ArchiveReadError("%s: unknown schedule %s"
+                               % (last.path, last.schedule))
+    try:
+        return schedule.get_base_archives(archives[:-1]) + [last]
+    except NoFullBackupError:
+        raise ArchiveReadError("no full backup found for %s" % last.path)
+
+def get_state(chain):
+    """Return the state of the files after the archives in chain.
+    This is a mapping of the paths to tuples of the index item of the
+    archive having the latest version of the item and its FileInfo.
+    """
+    state = {}
+    for i in chain:
+        log.debug("reading manifest of %s", i.path)
+        with i.open() as archive:
+            drop_deleted(state, archive.manifest.deleted)
+            for fi in archive.manifest:
+                state[fi.path] = (i, fi)
+    return state
+
+def target_path(targetdir, path):
+    if path.is_absolute():
+        return targetdir / path.relative_to(path.anchor)
+    else:
+        return targetdir / path
+
+def plan_files(chain, state, targetdir):
+    """Decide where to take the content of the regular files from.
+
+    Return a mapping of index items to the files to extract from that
+    archive, in the format expected by :meth:`Archive.extract_files`,
+    and a list of the files that can not be extracted this way.
+    """
+    names = { p.name: i for i in chain for p in i.paths }
+    sources = {}
+    deferred = []
+    for i, fi in state.values():
+        if not fi.is_file():
+            continue
+        target = target_path(targetdir, fi.path)
+        if fi.delta or fi.chunks is not None:
+            deferred.append((i, fi, target))
+            continue
+        if fi.ref:
+            source = names.get(fi.ref['archive'])
+            path = Path(fi.ref['path'])
+        else:
+            source = i
+            path = fi.path
+        if source is None:
+            deferred.append((i, fi, target))
+            continue
+        files = sources.setdefault(source, {})
+        files.setdefault(path, []).append((target, fi))
+    return sources, deferred
+
+def extract_stream(path, files):
+    """Extract files from the archive at path in one sequential pass.
+    """
+    log.debug("reading %s", path)
+    with path.open("rb") as f:
+        with Archive().open(path, fileobj=f) as archive:
+            return archive.extract_files(files)
+
+def extract_deferred(config, deferred):
+    """Extract the files having their content stored as a delta, in a
+    chunk store or in an archive outside of the chain, or in a hard
+    link that could not be resolved in the sequential pass.
+    """
+    idx = ArchiveIndex()
+    for i in get_prev_backups(config):
+        idx.append(i)
+    sources = {}
+    def resolve(name):
+        if name not in sources:
+            sources[name] = idx.open_archive(name)
+        return sources[name]
+    try:
+        by_archive = {}
+        for i, fi, target in deferred:
+            by_archive.setdefault(i.path, (i, []))[1].append((fi, target))
+        for i, items in by_archive.values():
+            log.debug("extracting %d files from %s", len(items), i.path)
+            with i.open() as archive:
+                for fi, target in items:
+                    archive.extract_file(fi, target, resolve)
+    finally:
+        for a in sources.values():
+            a.close()
+
+def set_attrs(fi, target):
+    if os.geteuid() == 0:
+        os.chown(target, fi.uid, fi.gid, follow_symlinks=False)
+    if not fi.is_symlink():
+        os.chmod(target, fi.mode)
+    os.utime(target, (fi.mtime, fi.mtime), follow_symlinks=False)
+
+def restore(args, config):
+    if args.at:
+        try:
+            date = parse_date(args.at)
+        except ValueError as e:
+            raise ArchiveReadError(str(e))
+    else:
+        date = datetime.datetime.now()
+    chain = get_chain(config, date)
+    log.info("restoring from %s", ", ".join(i.path.name for i in chain))
+    state = get_state(chain)
+    targetdir = Path(args.targetdir)
+    items = sorted((fi for _, fi in state.values()), key=lambda fi: fi.path)
+    # Create the directories and symbolic links first, these need
+    # nothing from the archives beyond the manifest.
+    for fi in items:
+        target = target_path(targetdir, fi.path)
+        if fi.is_dir():
+            target.mkdir(parents=True, exist_ok=True)
+        elif fi.is_symlink():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if os.path.lexists(target):
+                target.unlink()
+            target.symlink_to(fi.target)
+    # Extract each file once, from the archive holding its latest
+    # version, reading each archive in one pass.
+    sources, deferred = plan_files(chain, state, targetdir)
+    # The volumes of a set are read concurrently as well, each one
+    # extracts the files it happens to have.
+    tasks = [ (i, p) for i in sources for p in i.paths ]
+    found = { i: set() for i in sources }
+    if tasks:
+        workers = min(Workers, len(tasks))
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = [ (i, executor.submit(extract_stream, p, sources[i]))
+                        for i, p in tasks ]
+            for i, f in futures:
+                found[i].update(f.result())
+    for i, files in sources.items():
+        for path, targets in files.items():
+            if path not in found[i]:
+                for target, fi in targets:
+                    deferred.append((state[fi.path][0], fi, target))
+    if deferred:
+        extract_deferred(config, deferred)
+    # Set the attributes, the directories last in reverse order, so
+    # that their modification time is not changed by their content.
+    for fi in items:
+        if not fi.is_dir():
+            set_attrs(fi, target_path(targetdir, fi.path))
+    for fi in reversed(items):
+        if fi.is_dir():
+            set_attrs(fi, target_path(targetdir, fi.path))
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('restore',
+                                   help="restore files from the backups")
+    clsgrp = parser.add_mutually_exclusive_group()
+    clsgrp.add_argument('--policy', default='sys')
+    clsgrp.add_argument('--user')
+    parser.add_argument('--at', metavar='DATE',
+                        help=("restore the state as of this date, "
+                              "default: the latest backup"))
+    parser.add_argument('targetdir', help="directory to restore into")
+    parser.set_defaults(func=restore)
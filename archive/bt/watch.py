@@ -0,0 +1,279 @@
+"""Watch the directories to back up and record changes in the journal.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import signal
+import struct
+from archive.exception import ArchiveError
+from archive.bt.journal import ChangeJournal
+
+
+log = logging.getLogger(__name__)
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+_event = struct.Struct("iIII")
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    return _libc
+
+def _oserror(path=None):
+    e = ctypes.get_errno()
+    return OSError(e, os.strerror(e), path)
+
+
+class Inotify:
+    """A minimal wrapper around the Linux inotify API.
+    """
+
+    def __init__(self):
+        self._libc = _get_libc()
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise _oserror()
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise _oserror(str(path))
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """Wait at most timeout seconds for events.  Return a list of
+        tuples (wd, mask, cookie, name).
+        """
+        if not select.select([self], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, size = _event.unpack_from(data, pos)
+            pos += _event.size
+            name = data[pos:pos+size].rstrip(b"\0")
+            pos += size
+            events.append((wd, mask, cookie, name))
+        return events
+
+
+class Watcher:
+    """Watch the directories dirs and record the changes in journal.
+
+    All directories not excluded are watched with inotify.  Newly
+    created directories are added to the watch as they appear and are
+    recorded as a whole in the journal, since items may have been
+    created in there before the watch could be added.  If the kernel
+    drops events, all directories are watched anew and an overflow is
+    recorded in the journal, so that the next incremental backup falls
+    back to scanning all directories.
+
+    A path is recorded only once until the next time a reader closes
+    the journal after having taken a position, even if it is modified
+    repeatedly, such as a file kept open by a daemon.
+    """
+
+    Mask = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+            IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+    def __init__(self, journal, dirs, excludes):
+        self.journal = journal
+        self.dirs = list(dirs)
+        self.excludes = excludes
+        self.inotify = None
+        self._watches = {}
+        self._paths = {}
+        self._journal_wd = None
+        self._recorded = set()
+
+    def __enter__(self):
+        self.inotify = Inotify()
+        try:
+            self.journal.open()
+            self._journal_wd = self.inotify.add_watch(self.journal.path,
+                                                      IN_CLOSE_NOWRITE)
+            for d in self.dirs:
+                self._watch_tree(d, d)
+            # Only start the session when all directories are being
+            # watched, so that no changes are missed from its start.
+            self.journal.begin()
+        except:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def close(self):
+        self.journal.close()
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+
+    def _root(self, path):
+        for d in self.dirs:
+            if path == d or d in path.parents:
+                return d
+        return None
+
+    def _watch_tree(self, root, path):
+        rules = self.excludes.rules_for(root, path)
+        if rules is None or rules.match_path(path) or rules.match_dir(path):
+            return
+        dev = rules.device(root)
+        stack = [(path, rules)]
+        while stack:
+            d, rules = stack.pop()
+            try:
+                if dev is not None and rules.device(d) != dev:
+                    continue
+                wd = self.inotify.add_watch(d, self.Mask)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise ArchiveError("%s: too many directories to watch, "
+                                       "consider to raise the limit "
+                                       "fs.inotify.max_user_watches" % d)
+                log.warning("can't watch %s: %s", d, e.strerror)
+                continue
+            self._watches[wd] = d
+            self._paths[d] = wd
+            rules = rules.enter(d)
+            try:
+                entries = list(os.scandir(str(d)))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            except OSError as e:
+                log.warning("can't read %s: %s", d, e.strerror)
+                continue
+            for e in entries:
+                if e.is_dir(follow_symlinks=False):
+                    p = d / e.name
+                    if not (rules.match_path(p) or rules.match_dir(p)):
+                        stack.append((p, rules))
+
+    def _unwatch_tree(self, path):
+        for p in [ p for p in self._paths if p == path or path in p.parents ]:
+            wd = self._paths.pop(p)
+            del self._watches[wd]
+            self.inotify.rm_watch(wd)
+
+    def process(self, timeout=None):
+        """Wait at most timeout seconds for changes and record them in
+        the journal.
+        """
+        paths = set()
+        trees = set()
+        overflow = False
+        for wd, mask, cookie, name in self.inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if wd == self._journal_wd:
+                # A reader may have taken a position in the journal.
+                # Changes from now on must be recorded again, even if
+                # the path has been recorded before that position.
+                self._recorded.clear()
+                continue
+            d = self._watches.get(wd)
+            if d is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                if self._paths.get(d) == wd:
+                    del self._paths[d]
+                continue
+            path = d / os.fsdecode(name) if name else d
+            if self.excludes.match_path(path):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                trees.add(path)
+                self._watch_tree(self._root(path), path)
+            else:
+                if mask & IN_ISDIR and mask & IN_MOVED_FROM:
+                    self._unwatch_tree(path)
+                elif mask & IN_MOVE_SELF:
+                    self._unwatch_tree(d)
+                paths.add(path)
+        if overflow:
+            log.warning("inotify event queue overflowed, "
+                        "watching all directories anew")
+            self._recorded.clear()
+            for d in self.dirs:
+                self._watch_tree(d, d)
+        paths -= self._recorded
+        self._recorded |= paths
+        self.journal.record(paths, trees)
+        if overflow:
+            self.journal.overflow()
+
+    def run(self):
+        while True:
+            self.process()
+
+
+def watch(args, config):
+    if not config.journal:
+        raise ArchiveError("journal is not set in the configuration")
+    # Terminate cleanly on SIGTERM as well.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    journal = ChangeJournal(config.journal)
+    with Watcher(journal, config.dirs, config.excludes) as watcher:
+        log.info("recording changes in %s", config.journal)
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('watch',
+                                   help="record changes for incremental "
+                                   "backups in the journal")
+    clsgrp = parser.add_mutually_exclusive_group()
+    clsgrp.add_argument('--policy', default='sys')
+    clsgrp.add_argument('--user')
+    parser.set_defaults(func=watch)
@@ -0,0 +1,304 @@
+"""Provide the ChunkStore class, an alternative storage for the
+content of files in archives.
+
+The content of regular files is cut into chunks at positions defined
+by the content itself, using a gear rolling hash.  Each chunk is
+identified by its SHA-256 hash and is stored only once, compressed,
+in pack files.  Inserting or removing data in a file only changes the
+chunks around the modification.
+"""
+
+import collections
+import hashlib
+import os
+from pathlib import Path
+import struct
+import threading
+import zlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from archive.exception import ArchiveIntegrityError, ArchiveReadError
+from archive.tools import bounded_map
+
+
+MinChunkSize = 256*1024
+AvgChunkSize = 1024*1024
+MaxChunkSize = 4*1024*1024
+
+# The gear table must never change, otherwise the chunk boundaries
+# would change and chunks already in the store would not be reused.
+_gear = [ int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big')
+          for i in range(256) ]
+_mask64 = (1 << 64) - 1
+
+def _cut_point_py(buf, minsize, maxsize, mask):
+    """Return the length of the first chunk in buf.
+    """
+    n = min(len(buf), maxsize)
+    if n <= minsize:
+        return n
+    gear = _gear
+    h = 0
+    for i in range(minsize, n):
+        h = ((h << 1) + gear[buf[i]]) & _mask64
+        if not h & mask:
+            return i + 1
+    return n
+
+_cut_block = 64*1024
+
+def _cut_point_numpy(buf, minsize, maxsize, mask):
+    """Return the length of the first chunk in buf, same as
+    :func:`_cut_point_py`, but calculating the hash for all positions
+    in a block at once.
+    """
+    # The hash at position i is the sum of gear[buf[i-j]] << j for j
+    # from 0 to 63 modulo 2**64, starting with zero at minsize.  The
+    # sum is calculated in six steps, each doubling the number of
+    # terms.  The blocks overlap by 63 bytes to have all terms.
+    n = min(len(buf), maxsize)
+    if n <= minsize:
+        return n
+    data = numpy.frombuffer(buf, dtype=numpy.uint8, count=n)
+    mask = numpy.uint64(mask)
+    for start in range(minsize, n, _cut_block):
+        lo = max(start - 63, minsize)
+        h = _gear_array[data[lo:start + _cut_block]]
+        shift = 1
+        while shift < 64:
+            h[shift:] += h[:-shift] << numpy.uint64(shift)
+            shift *= 2
+        hits = numpy.flatnonzero((h[start - lo:] & mask) == 0)
+        if len(hits):
+            return start + int(hits[0]) + 1
+    return n
+
+if numpy is not None:
+    _gear_array = numpy.array(_gear, dtype=numpy.uint64)
+    _cut_point = _cut_point_numpy
+else:
+    _cut_point = _cut_point_py
+
+def iter_chunks(fileobj, minsize=MinChunkSize, avgsize=AvgChunkSize,
+                maxsize=MaxChunkSize):
+    """Cut the content read from the binary file object fileobj into
+    chunks at content defined positions.  Yield the chunks.
+    """
+    # Take the bits for the test of the cut point from the high end
+    # of the hash, these depend on the most input bytes.
+    bits = avgsize.bit_length() - 1
+    mask = ((1 << bits) - 1) << (64 - bits)
+    buf = b""
+    eof = False
+    while True:
+        if not eof and len(buf) < maxsize:
+            data = fileobj.read(maxsize)
+            if data:
+                buf += data
+                continue
+            eof = True
+        if not buf:
+            break
+        n = _cut_point(buf, minsize, maxsize, mask)
+        yield buf[:n]
+        buf = buf[n:]
+
+
+class ChunkStore:
+    """A store of content chunks in a directory.
+
+    The chunks are appended to pack files in the subdirectory `packs`.
+    An index file is written for each pack file when it is complete.
+    Chunks in a pack file without index are ignored.  Different
+    processes may add chunks to the same store concurrently, as each
+    writes its own pack files, but chunks may be stored more then
+    once then.
+    """
+
+    PackSize = 64*1024*1024
+    """Start a new pack file when the current one exceeds this size."""
+    Workers = min(os.cpu_count() or 1, 4)
+    """Number of threads compressing or reading chunks."""
+    MaxOpenFiles = 16
+    """Number of pack files to keep open for reading.  The least
+    recently used ones are closed beyond that."""
+
+    _idx_entry = struct.Struct(">32sQQ")
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.packdir = self.path / "packs"
+        if not self.packdir.is_dir():
+            for d in (self.path, self.packdir):
+                if not d.is_dir():
+                    d.mkdir()
+                    # Make sure we can add pack files, regardless of
+                    # the umask.
+                    os.chmod(d, 0o700)
+        self._index = {}
+        self._lock = threading.Lock()
+        self._files = collections.OrderedDict()
+        self._pack = None
+        self._pack_name = None
+        self._pack_entries = None
+        for idx in sorted(self.packdir.glob("*.idx")):
+            self._read_index(idx)
+
+    def _read_index(self, idx):
+        name = idx.stem
+        entry = self._idx_entry
+        data = idx.read_bytes()
+        if len(data) % entry.size:
+            raise ArchiveReadError("%s: invalid chunk index" % idx)
+        for cid, offset, length in entry.iter_unpack(data):
+            self._index.setdefault(cid, (name, offset, length))
+
+    def __contains__(self, cid):
+        return bytes.fromhex(cid) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def _pack_chunk(data):
+        cid = hashlib.sha256(data).digest()
+        packed = zlib.compress(data)
+        if len(packed) < len(data):
+            return cid, b"Z" + packed
+        else:
+            return cid, b"R" + data
+
+    def add_file(self, fileobj, checksums=None):
+        """Add the content read from the binary file object fileobj
+        to the store.  Return the list of the ids of its chunks.  If
+        checksums is a dict mapping hash algorithm names to hash
+        objects, these are updated with the content.
+        """
+        cids = []
+        chunks = iter_chunks(fileobj)
+        if checksums:
+            def update(data):
+                for h in checksums.values():
+                    h.update(data)
+                return data
+            chunks = map(update, chunks)
+        for _, (cid, packed) in bounded_map(self._pack_chunk, chunks,
+                                            self.Workers):
+            self._add(cid, packed)
+            cids.append(cid.hex())
+        return cids
+
+    def _add(self, cid, packed):
+        with self._lock:
+            if cid in self._index:
+                return
+            if self._pack is None:
+                self._pack_name = os.urandom(8).hex()
+                path = self.packdir / ("%s.pack" % self._pack_name)
+                self._pack = path.open("xb")
+                self._pack_entries = []
+            offset = self._pack.tell()
+            self._pack.write(packed)
+            entry = (self._pack_name, offset, len(packed))
+            self._index[cid] = entry
+            self._pack_entries.append((cid, offset, len(packed)))
+            if self._pack.tell() >= self.PackSize:
+                self._finish_pack()
+
+    def _finish_pack(self):
+        self._pack.flush()
+        os.fsync(self._pack.fileno())
+        self._pack.close()
+        self._pack = None
+        idx = self.packdir / ("%s.idx" % self._pack_name)
+        tmp = self.packdir / ("%s.idx.tmp" % self._pack_name)
+        with tmp.open("xb") as f:
+            for e in self._pack_entries:
+                f.write(self._idx_entry.pack(*e))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, idx)
+        self._pack_entries = None
+
+    def read(self, cid):
+        """Return the content of the chunk having the id cid.
+        """
+        try:
+            name, offset, length = self._index[bytes.fromhex(cid)]
+        except KeyError:
+            raise ArchiveIntegrityError("chunk %s not found in %s"
+                                        % (cid, self.path))
+        with self._lock:
+            if name == self._pack_name and self._pack:
+                self._pack.flush()
+            pack = self._open_pack(name)
+        try:
+            packed = os.pread(pack[0], length, offset)
+        finally:
+            with self._lock:
+                pack[1] -= 1
+        try:
+            if packed[:1] == b"Z":
+                data = zlib.decompress(packed[1:])
+            else:
+                data = packed[1:]
+        except zlib.error:
+            data = None
+        if data is None or hashlib.sha256(data).hexdigest() != cid:
+            raise ArchiveIntegrityError("chunk %s in %s is corrupt"
+                                        % (cid, self.path))
+        return data
+
+    def _open_pack(self, name):
+        """Return the file descriptor of the pack file name and the
+        number of its users, incremented by one, as a list.  Close
+        the least recently used pack files not in use if there are
+        more then :attr:`MaxOpenFiles`.  Must be called holding
+        self._lock.
+        """
+        try:
+            pack = self._files[name]
+            self._files.move_to_end(name)
+        except KeyError:
+            path = self.packdir / ("%s.pack" % name)
+            pack = self._files[name] = [os.open(path, os.O_RDONLY), 0]
+        pack[1] += 1
+        excess = len(self._files) - self.MaxOpenFiles
+        for n, p in list(self._files.items()):
+            if excess <= 0:
+                break
+            if not p[1]:
+                os.close(p[0])
+                del self._files[n]
+                excess -= 1
+        return pack
+
+    def iter_read(self, cids):
+        """Read the chunks having the ids in cids in parallel threads.
+        Yield their content in order.
+        """
+        for _, data in bounded_map(self.read, cids, self.Workers):
+            yield data
+
+    def flush(self):
+        """Complete the current pack file, so that all chunks added
+        so far are stored for good.
+        """
+        with self._lock:
+            if self._pack:
+                self._finish_pack()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            for fd, _ in self._files.values():
+                os.close(fd)
+            self._files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
@@ -5,12 +5,30 @@ import argparse
 import importlib
 import sys
 import warnings
+from archive.archive import Archive
 from archive.exception import *
+from archive.volume import VolumeSet, parse_volume_tags, volume_paths
 
-subcmds = [ "create", "verify", "ls", "info", "check", "diff", "find", ]
+subcmds = [ "create", "verify", "ls", "info", "check", "diff", "find",
+            "convert", "importtar", ]
 
 argparser = argparse.ArgumentParser()
 
+def open_archive(path):
+    """Open the archive for reading.  The path "-" means to read the
+    archive as a stream from stdin.  If path is a volume of a set, all
+    volumes of the set are opened as one logical archive.
+    """
+    if str(path) == "-":
+        return Archive().open(fileobj=sys.stdin.buffer)
+    archive = Archive().open(path)
+    volume, count, _ = parse_volume_tags(archive.manifest.tags)
+    paths = volume_paths(path, count) if volume is not None else None
+    if not paths:
+        return archive
+    archive.close()
+    return VolumeSet().open(paths)
+
 def showwarning(message, category, filename, lineno, file=None, line=None):
     """Display ArchiveWarning in a somewhat more user friendly manner.
     All other warnings are formatted the standard way.
@@ -3,7 +3,7 @@
 
 from pathlib import Path
 import sys
-from archive.archive import Archive
+from archive.cli import open_archive
 from archive.exception import ArgError
 from archive.manifest import FileInfo
 
@@ -24,18 +24,21 @@ def check(args):
     if args.stdin:
         if args.files:
             raise ArgError("can't accept both, --stdin and the files argument")
+        if str(args.archive) == "-":
+            raise ArgError("can't read both, the archive and the list of "
+                           "files from stdin")
         files = [Path(l.strip()) for l in sys.stdin]
     else:
         if args.files:
             files = args.files
         else:
             files = None
-    with Archive().open(args.archive) as archive:
+    with open_archive(args.archive) as archive:
         if files is None:
             files = [ archive.basedir ]
         metadata = { Path(md) for md in archive.manifest.metadata }
-        FileInfo.Checksums = archive.manifest.checksums
-        file_iter = FileInfo.iterpaths(files, set())
+        file_iter = FileInfo.iterpaths(files, set(),
+                                       archive.manifest.checksums)
         skip = None
         while True:
             try:
@@ -68,7 +71,8 @@ def add_parser(subparsers):
                         help=("read files to be checked from stdin, "
                               "rather then from the command line"))
     parser.add_argument('archive', type=Path,
-                        help=("path to the archive file"))
+                        help=("path to the archive file, "
+                              "\"-\" to read it from stdin"))
     parser.add_argument('files', nargs='*', type=Path,
                         help="files to be checked")
     parser.set_defaults(func=check)
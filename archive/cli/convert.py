@@ -0,0 +1,143 @@
+"""Implement the convert subcommand.
+"""
+
+import bz2
+import contextlib
+import gzip
+import io
+import lzma
+from pathlib import Path
+import sys
+from archive.archive import Archive, compression_map
+from archive.exception import ArchiveCreateError, ArchiveReadError, ArgError
+from archive.tools import BackgroundWriter
+
+
+BufferSize = 1024*1024
+"""Size of the chunks to copy from the input to the output."""
+
+class _TeeReader(io.RawIOBase):
+    """Read from a binary file object, writing all data read to
+    another one.
+    """
+
+    def __init__(self, fileobj, copy):
+        self.fileobj = fileobj
+        self.copy = copy
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.fileobj.readinto(b)
+        if n:
+            self.copy.write(memoryview(b)[:n])
+        return n
+
+@contextlib.contextmanager
+def _nullcontext(fileobj):
+    # _nullcontext() is not available in Python 3.6.
+    yield fileobj
+
+def _decompressor(fileobj):
+    """Return a file object reading the uncompressed tar file from
+    fileobj, which must be a buffered binary file object.
+    """
+    magic = fileobj.peek(6)[:6]
+    if magic.startswith(b"\x1f\x8b"):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    elif magic.startswith(b"BZh"):
+        return bz2.BZ2File(fileobj, "rb")
+    elif magic.startswith(b"\xfd7zXZ\x00"):
+        return lzma.LZMAFile(fileobj, "rb")
+    else:
+        return fileobj
+
+def _compressor(fileobj, compression):
+    """Return a file object writing the tar file to fileobj with the
+    requested compression, using the same settings as :mod:`tarfile`.
+    """
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=9)
+    elif compression == 'bz2':
+        return bz2.BZ2File(fileobj, "wb", compresslevel=9)
+    elif compression == 'xz':
+        return lzma.LZMAFile(fileobj, "wb")
+    else:
+        return _nullcontext(fileobj)
+
+def _convert(path, inp, out, compression, verify):
+    # Decompress and read the input in this thread, compress in a
+    # background thread and write the output in another one.  The
+    # uncompressed tar file is copied unchanged, including the
+    # manifest.
+    with BackgroundWriter(out) as w:
+        with _compressor(w, compression) as c, BackgroundWriter(c) as wc:
+            tee = _TeeReader(_decompressor(inp), wc)
+            try:
+                with Archive().open(path, fileobj=tee) as archive:
+                    if verify:
+                        archive.verify()
+                while tee.read(BufferSize):
+                    pass
+            except (EOFError, lzma.LZMAError, OSError) as e:
+                raise ArchiveReadError("%s: %s" % (path or "-", e))
+
+def convert(args):
+    if str(args.output) == "-":
+        if sys.stdout.isatty():
+            raise ArgError("refusing to write the archive to a terminal")
+        if args.compression is None:
+            args.compression = 'gz'
+    elif args.compression is None:
+        try:
+            args.compression = compression_map["".join(args.output.suffixes)]
+        except KeyError:
+            # Last ressort default
+            args.compression = 'gz'
+    if args.compression == 'none':
+        args.compression = ''
+    if str(args.archive) == "-":
+        path = None
+        inp = _nullcontext(sys.stdin.buffer)
+    else:
+        path = args.archive
+        try:
+            inp = path.open("rb")
+        except OSError as e:
+            raise ArchiveReadError(str(e))
+    with inp as f:
+        if str(args.output) == "-":
+            _convert(path, f, sys.stdout.buffer, args.compression,
+                     args.verify)
+            return 0
+        try:
+            out = args.output.open("xb")
+        except OSError as e:
+            raise ArchiveCreateError(str(e))
+        try:
+            with out:
+                _convert(path, f, out, args.compression, args.verify)
+        except BaseException:
+            args.output.unlink()
+            raise
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('convert',
+                                   help=("copy the archive changing "
+                                         "the compression"))
+    parser.add_argument('--compression',
+                        choices=['none', 'gz', 'bz2', 'xz'],
+                        help=("compression mode of the output, default: "
+                              "derived from the suffix of the output"))
+    parser.add_argument('--verify', action='store_true',
+                        help=("verify the checksums of the items while "
+                              "copying them"))
+    parser.add_argument('archive', type=Path,
+                        help=("path to the archive file, "
+                              "\"-\" to read it from stdin"))
+    parser.add_argument('output', type=Path,
+                        help=("path to the output file, "
+                              "\"-\" to write it to stdout"))
+    parser.set_defaults(func=convert)
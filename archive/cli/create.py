@@ -1,18 +1,113 @@
 """Implement the create subcommand.
 """
 
+import os
 from pathlib import Path
+import re
+import sys
 from archive.archive import Archive, DedupMode
+from archive.exception import ArgError
+from archive.exclude import ExcludeRules
+from archive.manifest import ReadOrder
+from archive.tools import parse_size
+from archive.volume import VolumeSet
 
 
+def _read_file_list(fileobj, sep):
+    """Read a list of paths from the binary file object fileobj,
+    separated by sep.  Yield the paths as they are read.
+    """
+    buf = b""
+    while True:
+        data = fileobj.read(64*1024)
+        if not data:
+            break
+        buf += data
+        entries = buf.split(sep)
+        buf = entries.pop()
+        for e in entries:
+            if e:
+                yield Path(os.fsdecode(e))
+    if buf:
+        yield Path(os.fsdecode(buf))
+
+def _file_list(args):
+    """Return the files to add to the archive and whether to descend
+    into directories.
+    """
+    if args.files_from is None:
+        if args.null:
+            raise ArgError("--null requires --files-from")
+        if not args.files and not args.stdin_member:
+            raise ArgError("no files to add to the archive")
+        return args.files, True
+    if args.files:
+        raise ArgError("can't accept both, --files-from and "
+                       "the files argument")
+    sep = b"\0" if args.null else b"\n"
+    if str(args.files_from) == "-":
+        if args.stdin_member:
+            raise ArgError("can't read both, the list of files and "
+                           "the member content from stdin")
+        return _read_file_list(sys.stdin.buffer, sep), False
+    # Take the path of the list relative to the current directory,
+    # it is only opened after changing to the work directory.
+    files_from = args.files_from.resolve()
+    def files():
+        with files_from.open("rb") as f:
+            yield from _read_file_list(f, sep)
+    return files(), False
+
+def _exclude_rules(args):
+    try:
+        return ExcludeRules(paths=args.exclude or (),
+                            patterns=args.exclude_pattern or (),
+                            regexes=args.exclude_regex or (),
+                            maxsize=args.max_size,
+                            onefs=args.one_file_system,
+                            ignorefile=args.exclude_ignore)
+    except re.error as e:
+        raise ArgError("invalid regular expression: %s" % e)
+
 def create(args):
     if args.compression == 'none':
         args.compression = ''
-    archive = Archive().create(args.archive, args.compression, args.files,
-                               basedir=args.basedir, workdir=args.directory,
-                               excludes=args.exclude,
-                               dedup=DedupMode(args.deduplicate),
-                               tags=args.tag)
+    files, recursive = _file_list(args)
+    excludes = _exclude_rules(args)
+    if str(args.archive) == "-":
+        if args.volume_size or args.shards:
+            raise ArgError("can not write a volume set to stdout")
+        if sys.stdout.isatty():
+            raise ArgError("refusing to write the archive to a terminal")
+        path = None
+        fileobj = sys.stdout.buffer
+    else:
+        path = args.archive
+        fileobj = None
+    if args.volume_size or args.shards:
+        if args.stdin_member:
+            raise ArgError("can not add content from stdin to a volume set")
+        VolumeSet().create(path, args.compression, files,
+                           basedir=args.basedir, workdir=args.directory,
+                           excludes=excludes,
+                           dedup=DedupMode(args.deduplicate),
+                           tags=args.tag, sortbuffer=args.sort_buffer,
+                           checksums=args.checksum,
+                           readorder=ReadOrder(args.read_order),
+                           volumesize=args.volume_size, shards=args.shards,
+                           recursive=recursive)
+        return 0
+    archive = Archive()
+    if args.stdin_member:
+        archive.add_member(args.stdin_member, sys.stdin.buffer)
+    archive.create(path, args.compression, files,
+                   basedir=args.basedir, workdir=args.directory,
+                   excludes=excludes,
+                   dedup=DedupMode(args.deduplicate),
+                   tags=args.tag, sortbuffer=args.sort_buffer,
+                   checksums=args.checksum,
+                   readorder=ReadOrder(args.read_order),
+                   fileobj=fileobj, recursive=recursive)
     return 0
 
 def add_parser(subparsers):
@@ -28,11 +123,56 @@ def add_parser(subparsers):
                         help=("common base directory in the archive"))
     parser.add_argument('--exclude', type=Path, action='append',
                         help=("exclude this path"))
+    parser.add_argument('--exclude-pattern', action='append',
+                        metavar="pattern",
+                        help=("exclude items matching this glob pattern, "
+                              "matched against the name of items unless "
+                              "it contains a slash"))
+    parser.add_argument('--exclude-regex', action='append', metavar="regex",
+                        help=("exclude items having a path matching this "
+                              "regular expression"))
+    parser.add_argument('--exclude-ignore', metavar="name",
+                        help=("read exclude patterns from files having "
+                              "this name in each directory"))
+    parser.add_argument('--max-size', type=parse_size, metavar="size",
+                        help=("exclude regular files larger then this"))
+    parser.add_argument('--one-file-system', action='store_true',
+                        help=("do not descend into directories on other "
+                              "file systems"))
     parser.add_argument('--deduplicate',
                         choices=[d.value for d in DedupMode], default='link',
                         help=("when to use hard links to duplicate files"))
+    parser.add_argument('--checksum', action='append',
+                        help=("hash algorithm to calculate checksums, "
+                              "may be used more then once"))
+    parser.add_argument('--sort-buffer', type=int, metavar="num",
+                        help=("maximum number of file entries to keep in "
+                              "memory, use temporary files to sort more"))
+    parser.add_argument('--read-order',
+                        choices=[o.value for o in ReadOrder], default='path',
+                        help=("order to read the content of files in"))
+    volumes = parser.add_mutually_exclusive_group()
+    volumes.add_argument('--volume-size', type=parse_size, metavar="size",
+                         help=("split the archive into volumes of at most "
+                               "this uncompressed size"))
+    volumes.add_argument('--shards', type=int, metavar="num",
+                         help=("split the archive into this many volumes "
+                               "of about equal size, created in parallel "
+                               "worker processes"))
     parser.add_argument('archive', type=Path,
-                        help=("path to the archive file"))
-    parser.add_argument('files', nargs='+', type=Path,
+                        help=("path to the archive file, "
+                              "\"-\" to write it to stdout"))
+    parser.add_argument('--stdin-member', type=Path, metavar="path",
+                        help=("add a regular file at this path in the "
+                              "archive, having the content read from stdin"))
+    parser.add_argument('--files-from', type=Path, metavar="file",
+                        help=("read the list of files to add from this "
+                              "file, \"-\" to read it from stdin, "
+                              "directories in the list are not descended"))
+    parser.add_argument('--null', action='store_true',
+                        help=("the list of files in --files-from is "
+                              "separated by null characters rather then "
+                              "newlines"))
+    parser.add_argument('files', nargs='*', type=Path,
                         help="files to add to the archive")
     parser.set_defaults(func=create)
@@ -2,7 +2,7 @@
 """
 
 from pathlib import Path
-from archive.archive import Archive
+from archive.cli import open_archive
 from archive.exception import ArchiveReadError
 from archive.manifest import DiffStatus, _common_checksum, diff_manifest
 
@@ -29,10 +29,10 @@ def _skip_dir_filter(diff):
 
 
 def diff(args):
-    archive1 = Archive().open(args.archive1)
+    archive1 = open_archive(args.archive1)
     manifest1 = archive1.manifest
     archive1.close()
-    archive2 = Archive().open(args.archive2)
+    archive2 = open_archive(args.archive2)
     manifest2 = archive2.manifest
     archive2.close()
     algorithm = _common_checksum(manifest1, manifest2)
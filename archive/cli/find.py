@@ -5,7 +5,7 @@ import datetime
 import fnmatch
 from pathlib import Path
 import re
-from archive.archive import Archive
+from archive.cli import open_archive
 from archive.tools import parse_date
 
 
@@ -76,8 +76,13 @@ class SearchFilter:
 
 def find(args):
     searchfilter = SearchFilter(args)
+    seen = set()
     for path in args.archives:
-        with Archive().open(path) as archive:
+        if path.resolve() in seen:
+            # Another volume of a set that has already been searched.
+            continue
+        with open_archive(path) as archive:
+            seen.update(getattr(archive, 'paths', ()))
             for fi in filter(searchfilter, archive.manifest):
                 print("%s:%s" % (path, fi.path))
 
@@ -0,0 +1,295 @@
+"""Implement the import subcommand.
+"""
+
+import os
+from pathlib import Path
+import shutil
+import stat
+import sys
+import tarfile
+import tempfile
+import warnings
+from archive.archive import Archive
+from archive.exception import (ArchiveCreateError, ArchiveInvalidTypeError,
+                               ArchiveReadError, ArchiveWarning, ArgError)
+from archive.manifest import FileInfo
+from archive.tools import (check_hashalg, hashed_copy, is_plain_file,
+                           parse_size)
+
+
+BufferSize = 1024*1024
+"""Size of the chunks to read the content of members in."""
+
+SpoolLimit = 1024*1024*1024
+"""Default maximum size of the spool when reading the input a second
+time."""
+
+class _ImportArchive(Archive):
+    """An archive taking the content of the items from a plain tar
+    file, rather then from the file system.
+
+    sources maps the paths of regular files to a tuple of a kind and
+    a source.  The kind is either 'spool' with the offset of the
+    content in spool, 'member' with the member of the input tar file
+    tarf, or 'link' with the path of the regular file that is the
+    target of a hard link.
+
+    If reopen is not :const:`None`, it must be a callable returning
+    the input tar file opened anew in stream mode, tarf is ignored
+    then.  The members are read sequentially, those passed before they
+    are needed are spooled on the way, as long as the spool does not
+    grow beyond spool_limit bytes.  Members not spooled are read in
+    another pass over the input.
+    """
+
+    def __init__(self, sources, tarf, spool, reopen=None, spool_limit=None):
+        super().__init__()
+        self._sources = sources
+        self._input = tarf if reopen is None else None
+        self._spool = spool
+        self._copied = {}
+        self._reopen = reopen
+        self._spool_limit = spool_limit
+        self._stream = None
+        self._position = None
+        self._pending = { s.offset for k, s in sources.values()
+                          if k == 'member' }
+        self._spooled = {}
+
+    def close(self):
+        if self._reopen is not None and self._input is not None:
+            self._input.close()
+            self._input = None
+        super().close()
+
+    def _read_key(self, fi):
+        # The content is taken from the input, not from the file
+        # system, there is nothing to read ahead.
+        return None
+
+    def _add_item(self, tarf, fi, arcname, data=None):
+        ti = self._tarinfo(fi, arcname)
+        if not fi.is_file():
+            tarf.addfile(ti)
+            return
+        kind, source = self._sources[fi.path]
+        key = fi.path
+        if kind == 'link':
+            key = source
+            kind, source = self._sources[key]
+        dup = self._copied.get(key)
+        if dup:
+            ti.type = tarfile.LNKTYPE
+            ti.linkname = dup
+            ti.size = 0
+            tarf.addfile(ti)
+            return
+        self._copied[key] = arcname
+        if kind == 'member' and self._reopen is not None:
+            kind, source = self._advance(source)
+        if kind == 'spool':
+            self._spool.seek(source)
+            tarf.addfile(ti, fileobj=self._spool)
+        else:
+            with self._input.extractfile(source) as f:
+                tarf.addfile(ti, fileobj=f)
+
+    def _advance(self, member):
+        """Read the input up to member.  Return the kind and the
+        source of its content.
+        """
+        self._pending.discard(member.offset)
+        offset = self._spooled.pop(member.offset, None)
+        if offset is not None:
+            return ('spool', offset)
+        if self._stream is None or self._position >= member.offset:
+            # The member has been passed without spooling it, start
+            # another pass.
+            if self._input is not None:
+                self._input.close()
+            self._input = self._reopen()
+            self._stream = iter(self._input)
+        for ti in self._stream:
+            self._position = ti.offset
+            if ti.offset == member.offset:
+                return ('member', ti)
+            if ti.offset in self._pending:
+                end = self._spool.seek(0, os.SEEK_END)
+                if (self._spool_limit is not None and
+                    end + ti.size > self._spool_limit):
+                    continue
+                self._pending.discard(ti.offset)
+                self._spooled[ti.offset] = end
+                with self._input.extractfile(ti) as f:
+                    shutil.copyfileobj(f, self._spool, BufferSize)
+        raise ArchiveReadError("unexpected end of data")
+
+
+def _member_path(name, basedir):
+    p = Path(name)
+    if p.is_absolute():
+        p = p.relative_to(p.anchor)
+    if ".." in p.parts:
+        raise ArchiveReadError("invalid path '%s' in the input" % name)
+    if basedir:
+        p = basedir / p
+    return p
+
+def read_members(tarf, checksums, basedir=None, spool=None):
+    """Read the members of the tar file tarf in one pass.
+
+    Return a list of FileInfo objects and the mapping of the sources
+    of the regular files as expected by :class:`_ImportArchive`.  The
+    content of regular files is written to spool, if not
+    :const:`None`.  Otherwise, it is taken from the members of the tar
+    file later on, either with random access to tarf or by reading the
+    tar file again.
+    """
+    fileinfos = {}
+    sources = {}
+    for ti in tarf:
+        path = _member_path(ti.name, basedir)
+        if path == Path("."):
+            continue
+        data = {
+            'path': path,
+            'uid': ti.uid,
+            'uname': ti.uname or None,
+            'gid': ti.gid,
+            'gname': ti.gname or None,
+            'mode': stat.S_IMODE(ti.mode),
+            'mtime': ti.mtime,
+        }
+        if ti.isdir():
+            data['type'] = 'd'
+        elif ti.issym():
+            data['type'] = 'l'
+            data['target'] = ti.linkname
+        elif ti.isreg():
+            data['type'] = 'f'
+            data['size'] = ti.size
+            with tarf.extractfile(ti) as f:
+                if spool is not None:
+                    sources[path] = ('spool', spool.tell())
+                else:
+                    sources[path] = ('member', ti)
+                chunks = iter(lambda: f.read(BufferSize), b"")
+                size, data['checksum'] = hashed_copy(chunks, spool, checksums)
+                if size != ti.size:
+                    raise ArchiveReadError("unexpected end of data")
+        elif ti.islnk():
+            target = _member_path(ti.linkname, basedir)
+            try:
+                target_fi = fileinfos[target]
+                kind, source = sources[target]
+            except KeyError:
+                warnings.warn(ArchiveWarning("%s: link target %s not found, "
+                                             "ignored" % (path, target)))
+                continue
+            data['type'] = 'f'
+            data['size'] = target_fi.size
+            data['checksum'] = target_fi.checksum
+            sources[path] = ('link', source if kind == 'link' else target)
+        else:
+            e = ArchiveInvalidTypeError(path, _tar_ftype(ti))
+            warnings.warn(ArchiveWarning("%s ignored" % e))
+            continue
+        fileinfos[path] = FileInfo(data=data, checksums=checksums)
+    return list(fileinfos.values()), sources
+
+def _tar_ftype(ti):
+    if ti.isfifo():
+        return stat.S_IFIFO
+    elif ti.ischr():
+        return stat.S_IFCHR
+    elif ti.isblk():
+        return stat.S_IFBLK
+    else:
+        return 0
+
+def import_tar(args):
+    if args.compression == 'none':
+        args.compression = ''
+    checksums = args.checksum or FileInfo.Checksums
+    try:
+        check_hashalg(checksums)
+    except ValueError as e:
+        raise ArgError(str(e))
+    if str(args.archive) == "-":
+        if sys.stdout.isatty():
+            raise ArgError("refusing to write the archive to a terminal")
+        path = None
+        fileobj = sys.stdout.buffer
+    else:
+        path = args.archive
+        fileobj = None
+    try:
+        if str(args.tarfile) == "-":
+            tarf = tarfile.open(mode='r|*', fileobj=sys.stdin.buffer)
+        else:
+            tarf = tarfile.open(str(args.tarfile), 'r:*')
+    except (OSError, tarfile.TarError) as e:
+        raise ArchiveReadError(str(e))
+    # The content of the members needs to be spooled to a temporary
+    # file if the input can only be read once.  An uncompressed file
+    # allows random access to the members at low cost.  A compressed
+    # file is read a second time sequentially, only members out of
+    # order need to be spooled then, up to the spool limit.
+    use_spool = args.spool or str(args.tarfile) == "-"
+    reopen = None
+    if not (use_spool or is_plain_file(tarf.fileobj)):
+        def reopen():
+            try:
+                return tarfile.open(str(args.tarfile), 'r|*')
+            except (OSError, tarfile.TarError) as e:
+                raise ArchiveReadError(str(e))
+    with tarf, tempfile.TemporaryFile(dir=args.tmpdir) as spool:
+        try:
+            fileinfos, sources = read_members(tarf, checksums, args.basedir,
+                                              spool if use_spool else None)
+        except (OSError, EOFError, tarfile.TarError) as e:
+            raise ArchiveReadError("%s: %s" % (args.tarfile, e))
+        if not fileinfos:
+            raise ArchiveCreateError("refusing to create an empty archive")
+        spool.flush()
+        with _ImportArchive(sources, tarf, spool, reopen,
+                            args.spool_limit) as archive:
+            archive.create(path, args.compression, fileinfos=fileinfos,
+                           basedir=args.basedir, tags=args.tag,
+                           checksums=checksums, fileobj=fileobj)
+    return 0
+
+def add_parser(subparsers):
+    parser = subparsers.add_parser('import',
+                                   help=("create an archive from the "
+                                         "content of a plain tar file"))
+    parser.add_argument('--tag', action='append',
+                        help=("user defined tags to mark the archive"))
+    parser.add_argument('--compression',
+                        choices=['none', 'gz', 'bz2', 'xz'],
+                        help=("compression mode"))
+    parser.add_argument('--basedir', type=Path,
+                        help=("common base directory in the archive, "
+                              "prepended to the paths in the tar file"))
+    parser.add_argument('--checksum', action='append',
+                        help=("hash algorithm to calculate checksums, "
+                              "may be used more then once"))
+    parser.add_argument('--spool', action='store_true',
+                        help=("copy the content of the members to a "
+                              "temporary file rather then reading the "
+                              "tar file a second time"))
+    parser.add_argument('--spool-limit', type=parse_size, metavar="size",
+                        default=SpoolLimit,
+                        help=("maximum size of the temporary file when "
+                              "reading a compressed tar file a second "
+                              "time, members beyond are read in yet "
+                              "another pass"))
+    parser.add_argument('--tmpdir', type=Path,
+                        help=("directory for the temporary file"))
+    parser.add_argument('tarfile', type=Path,
+                        help=("path to the tar file, "
+                              "\"-\" to read it from stdin"))
+    parser.add_argument('archive', type=Path,
+                        help=("path to the archive file, "
+                              "\"-\" to write it to stdout"))
+    parser.set_defaults(func=import_tar)
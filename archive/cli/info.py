@@ -4,13 +4,13 @@
 import datetime
 from pathlib import Path
 import stat
-from archive.archive import Archive
+from archive.cli import open_archive
 from archive.exception import ArchiveReadError
 
 
 def info(args):
     typename = {"f": "file", "d": "directory", "l": "symbolic link"}
-    with Archive().open(args.archive) as archive:
+    with open_archive(args.archive) as archive:
         fi = archive.manifest.find(args.entry)
         if not fi:
             raise ArchiveReadError("%s: not found in archive" % args.entry)
@@ -34,7 +34,8 @@ def add_parser(subparsers):
                                    help=("show informations about "
                                          "an entry in the archive"))
     parser.add_argument('archive', type=Path,
-                        help=("path to the archive file"))
+                        help=("path to the archive file, "
+                              "\"-\" to read it from stdin"))
     parser.add_argument('entry', type=Path,
                         help=("path of the entry"))
     parser.set_defaults(func=info)
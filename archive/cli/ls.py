@@ -2,7 +2,7 @@
 """
 
 from pathlib import Path
-from archive.archive import Archive
+from archive.cli import open_archive
 from archive.exception import ArchiveReadError
 
 
@@ -26,7 +26,7 @@ def ls_checksum_format(archive, algorithm):
         print("%s  %s" % (fi.checksum[algorithm], fi.path))
 
 def ls(args):
-    with Archive().open(args.archive) as archive:
+    with open_archive(args.archive) as archive:
         if args.format == 'ls':
             ls_ls_format(archive)
         elif args.format == 'checksum':
@@ -48,5 +48,6 @@ def add_parser(subparsers):
     parser.add_argument('--checksum',
                         help=("hash algorithm"))
     parser.add_argument('archive', type=Path,
-                        help=("path to the archive file"))
+                        help=("path to the archive file, "
+                              "\"-\" to read it from stdin"))
     parser.set_defaults(func=ls)
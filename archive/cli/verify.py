@@ -2,11 +2,11 @@
 """
 
 from pathlib import Path
-from archive.archive import Archive
+from archive.cli import open_archive
 
 
 def verify(args):
-    with Archive().open(args.archive) as archive:
+    with open_archive(args.archive) as archive:
         archive.verify()
     return 0
 
@@ -14,5 +14,6 @@ def add_parser(subparsers):
     parser = subparsers.add_parser('verify',
                                    help="verify integrity of the archive")
     parser.add_argument('archive', type=Path,
-                        help=("path to the archive file"))
+                        help=("path to the archive file, "
+                              "\"-\" to read it from stdin"))
     parser.set_defaults(func=verify)
@@ -0,0 +1,250 @@
+"""Binary delta encoding of files, using a rolling checksum as rsync
+does.
+
+A delta describes a new version of a file in terms of an older
+version, the base: a sequence of instructions to either copy a range
+of bytes from the base or to insert literal data.  Calculating the
+delta requires the signature of the base only, having a weak rolling
+checksum and a strong hash for each block of the base.
+"""
+
+import hashlib
+import math
+import struct
+import zlib
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+_magic = b"ATDELTA1"
+_copy_op = struct.Struct(">cQQ")
+_data_op = struct.Struct(">cQ")
+_end_op = b"E"
+_adler_mod = 65521
+
+MinBlockSize = 2048
+MaxBlockSize = 128*1024
+MaxLiteral = 1024*1024
+"""Maximum size of literal data in one instruction."""
+_table_mask = (1 << 20) - 1
+ScanWindow = 64*1024
+"""Number of positions to calculate the weak checksum for at once
+when scanning for matching blocks with numpy."""
+
+
+def block_size(size):
+    """Return the block size to use for a base of size bytes.
+    """
+    return max(MinBlockSize, min(MaxBlockSize, int(math.sqrt(size))))
+
+def _strong(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class Signature:
+    """The signature of the base version of a file.
+
+    Read the base from the binary file object fileobj sequentially.
+    """
+
+    def __init__(self, fileobj, blocksize):
+        self.blocksize = blocksize
+        self.blocks = {}
+        offset = 0
+        while True:
+            data = fileobj.read(blocksize)
+            if not data:
+                break
+            weak = zlib.adler32(data)
+            entry = (len(data), _strong(data), offset)
+            self.blocks.setdefault(weak, []).append(entry)
+            offset += len(data)
+        self._weak_table = None
+
+    @property
+    def weak_table(self):
+        """A numpy boolean array telling whether there may be a block
+        having a weak checksum with the low bits used as index.
+        """
+        if self._weak_table is None:
+            keys = numpy.array(list(self.blocks), dtype=numpy.int64)
+            self._weak_table = numpy.zeros(_table_mask + 1, dtype=bool)
+            self._weak_table[keys & _table_mask] = True
+        return self._weak_table
+
+    def find(self, weak, buf, pos, n):
+        """Return the offset of the block in the base matching the n
+        bytes at pos in buf, having the weak checksum weak.  Return
+        :const:`None` if there is no such block.
+        """
+        candidates = self.blocks.get(weak)
+        if candidates:
+            strong = None
+            for length, s, offset in candidates:
+                if length != n:
+                    continue
+                if strong is None:
+                    strong = _strong(buf[pos:pos+n])
+                if s == strong:
+                    return offset
+        return None
+
+
+class _Writer:
+    """Write the instructions of a delta, merging adjacent copies.
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.copy = None
+        out.write(_magic)
+
+    def add_copy(self, offset, length):
+        if self.copy and sum(self.copy) == offset:
+            self.copy[1] += length
+        else:
+            self.flush()
+            self.copy = [offset, length]
+
+    def add_data(self, data):
+        self.flush()
+        for i in range(0, len(data), MaxLiteral):
+            chunk = data[i:i+MaxLiteral]
+            self.out.write(_data_op.pack(b"D", len(chunk)))
+            self.out.write(chunk)
+
+    def flush(self):
+        if self.copy:
+            self.out.write(_copy_op.pack(b"C", *self.copy))
+            self.copy = None
+
+    def close(self):
+        self.flush()
+        self.out.write(_end_op)
+
+
+def _next_candidate(signature, buf, first, last):
+    """Return the first position from first to last in buf where the
+    weak checksum of the block starting there is in signature.  Only
+    consider ScanWindow positions, return the position after these if
+    none matches.
+    """
+    bs = signature.blocksize
+    end = min(last, first + ScanWindow - 1)
+    x = numpy.frombuffer(buf[first:end+bs], dtype=numpy.uint8)
+    x = x.astype(numpy.int64)
+    p = numpy.arange(end - first + 1)
+    s = numpy.concatenate(([0], numpy.cumsum(x)))
+    r = numpy.concatenate(([0], numpy.cumsum(numpy.arange(len(x)) * x)))
+    # The adler32 of each block: a is one plus the sum of the bytes, b
+    # the sum of the bytes weighted by their distance to the end plus
+    # the block size.
+    a = s[p+bs] - s[p]
+    b = (bs + (bs + p) * a - (r[p+bs] - r[p])) % _adler_mod
+    a = (1 + a) % _adler_mod
+    weak = (b << 16) | a
+    for i in numpy.flatnonzero(signature.weak_table[weak & _table_mask]):
+        if int(weak[i]) in signature.blocks:
+            return first + int(i)
+    return min(end + 1, last)
+
+def delta(signature, fileobj, out):
+    """Write the delta of the new version of a file, read from the
+    binary file object fileobj, against the base having signature to
+    the binary file object out.
+    """
+    bs = signature.blocksize
+    readsize = max(16*bs, MaxLiteral)
+    writer = _Writer(out)
+    buf = bytearray()
+    eof = False
+    pos = 0
+    start = 0
+    weak = None
+    while True:
+        if not eof and len(buf) - pos < bs + 1:
+            # Discard the data that has been dealt with and refill
+            # the buffer.
+            if pos - start > MaxLiteral:
+                writer.add_data(buf[start:pos])
+                start = pos
+            del buf[:start]
+            pos -= start
+            start = 0
+            data = fileobj.read(readsize)
+            if data:
+                buf += data
+            else:
+                eof = True
+        n = min(bs, len(buf) - pos)
+        if n == 0:
+            break
+        if weak is None:
+            weak = zlib.adler32(buf[pos:pos+n])
+        offset = signature.find(weak, buf, pos, n)
+        if offset is not None:
+            if pos > start:
+                writer.add_data(buf[start:pos])
+            writer.add_copy(offset, n)
+            pos += n
+            start = pos
+            weak = None
+        elif n == bs and pos + n < len(buf) and numpy is not None:
+            # Skip ahead to the next block having a known weak
+            # checksum.  The positions in between would not match.
+            pos = _next_candidate(signature, buf, pos + 1, len(buf) - bs)
+            weak = None
+        elif n == bs and pos + n < len(buf):
+            # Roll the checksum one byte ahead.
+            a = weak & 0xffff
+            b = weak >> 16
+            x = buf[pos]
+            a = (a - x + buf[pos+n]) % _adler_mod
+            b = (b - n*x - 1 + a) % _adler_mod
+            weak = (b << 16) | a
+            pos += 1
+        else:
+            # The tail of the file, shorter then a block.
+            pos = len(buf)
+    if pos > start:
+        writer.add_data(buf[start:pos])
+    writer.close()
+
+def patch(base, fileobj, out):
+    """Reconstruct the new version of a file from the base and the
+    delta.  base must be a seekable binary file object, the delta is
+    read from the binary file object fileobj and the result written
+    to out.  Raise :exc:`ValueError` if the delta is invalid.
+    """
+    if fileobj.read(len(_magic)) != _magic:
+        raise ValueError("invalid delta")
+    while True:
+        op = fileobj.read(1)
+        if op == b"C":
+            data = op + fileobj.read(_copy_op.size - 1)
+            if len(data) != _copy_op.size:
+                raise ValueError("invalid delta: truncated")
+            _, offset, length = _copy_op.unpack(data)
+            base.seek(offset)
+            while length > 0:
+                data = base.read(min(length, MaxLiteral))
+                if not data:
+                    raise ValueError("invalid delta: copy beyond the "
+                                     "end of the base")
+                out.write(data)
+                length -= len(data)
+        elif op == b"D":
+            data = op + fileobj.read(_data_op.size - 1)
+            if len(data) != _data_op.size:
+                raise ValueError("invalid delta: truncated")
+            _, length = _data_op.unpack(data)
+            data = fileobj.read(length)
+            if len(data) != length:
+                raise ValueError("invalid delta: truncated")
+            out.write(data)
+        elif op == _end_op:
+            return
+        else:
+            raise ValueError("invalid delta")
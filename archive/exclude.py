@@ -0,0 +1,251 @@
+"""Provide the ExcludeRules class, deciding which items to skip when
+scanning directories.
+"""
+
+import copy
+import os
+from pathlib import Path
+import re
+from archive.exception import ArchiveCreateError
+
+
+def _translate(pattern):
+    """Translate a glob pattern into a regular expression.
+
+    `*` and `?` do not match a slash, `**` matches anything including
+    slashes, `**/` matches zero or more directories.
+    """
+    i, n = 0, len(pattern)
+    res = []
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            if i < n and pattern[i] == '*':
+                i += 1
+                if i < n and pattern[i] == '/':
+                    i += 1
+                    res.append('(?:.*/)?')
+                else:
+                    res.append('.*')
+            else:
+                res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = i
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                res.append('\\[')
+            else:
+                stuff = pattern[i:j].replace('\\', '\\\\')
+                if stuff[0] == '!':
+                    stuff = '^' + stuff[1:]
+                res.append('[%s]' % stuff)
+                i = j + 1
+        else:
+            res.append(re.escape(c))
+    return ''.join(res)
+
+def _compile(regexes):
+    if regexes:
+        return re.compile('|'.join('(?:%s)' % r for r in regexes), re.S)
+    else:
+        return None
+
+
+class ExcludeRules:
+    """A set of rules to exclude items when scanning directories.
+
+    paths are exact paths to exclude.  patterns are glob patterns: a
+    pattern not containing a slash is matched against the name of the
+    items, otherwise against their full path.  A trailing slash
+    restricts the pattern to directories.  regexes are regular
+    expressions searched in the full path.  Regular files larger
+    then maxsize are excluded.  If onefs is true, directories on
+    another file system then the one of the path they have been
+    found in are not descended.
+
+    If ignorefile is set, files having that name are read in each
+    directory.  They contain glob patterns, one per line, applying to
+    the items in that directory and below.  Patterns containing a
+    slash are taken relative to the directory.  Empty lines and lines
+    starting with `#` are ignored, lines starting with `re:` are
+    regular expressions.
+
+    All patterns are compiled into a few combined regular expressions
+    and the rules are checked before an item is descended into, so
+    that excluded directory trees are not scanned at all.
+    """
+
+    def __init__(self, paths=(), patterns=(), regexes=(), maxsize=None,
+                 onefs=False, ignorefile=None):
+        self.paths = set(paths)
+        self.patterns = list(patterns)
+        self.regexes = list(regexes)
+        self.maxsize = maxsize
+        self.onefs = onefs
+        self.ignorefile = ignorefile
+        # Lists of regular expressions matching the name or the full
+        # path of any item or of directories only, and searched in the
+        # full path.
+        self._rules = ([], [], [], [], [])
+        self._add_patterns(self.patterns, "")
+        self._rules[4].extend(self.regexes)
+        self._compile()
+
+    @classmethod
+    def get(cls, excludes):
+        """Return excludes as ExcludeRules.  excludes may also be an
+        iterable of paths or :const:`None`.
+        """
+        if isinstance(excludes, cls):
+            return excludes
+        return cls(paths=excludes or ())
+
+    @classmethod
+    def parse(cls, specs, **kwargs):
+        """Create the rules from a list of strings.  Strings starting
+        with `re:` are regular expressions, strings containing a
+        wildcard or not containing any slash other then a trailing
+        one are glob patterns, any other strings are exact paths.
+        """
+        paths = []
+        patterns = []
+        regexes = []
+        for s in specs:
+            s = str(s)
+            if s.startswith("re:"):
+                regexes.append(s[3:])
+            elif "/" not in s.rstrip("/") or any(c in s for c in "*?["):
+                patterns.append(s)
+            else:
+                paths.append(Path(s))
+        return cls(paths, patterns, regexes, **kwargs)
+
+    def _add_patterns(self, patterns, prefix):
+        for p in patterns:
+            dironly = p.endswith("/") and len(p) > 1
+            if dironly:
+                p = p.rstrip("/")
+            if "/" in p:
+                if prefix:
+                    p = p.lstrip("/")
+                rule = re.escape(prefix) + _translate(p)
+                self._rules[3 if dironly else 1].append(rule)
+            else:
+                self._rules[2 if dironly else 0].append(_translate(p))
+
+    def _compile(self):
+        self._name_re = _compile(self._rules[0])
+        self._path_re = _compile(self._rules[1])
+        self._dir_name_re = _compile(self._rules[2])
+        self._dir_path_re = _compile(self._rules[3])
+        self._search_re = _compile(self._rules[4])
+
+    def __bool__(self):
+        return bool(self.paths or any(self._rules) or self.maxsize or
+                    self.onefs or self.ignorefile)
+
+    def match_dir(self, path):
+        """Check whether the directory path is excluded by the rules
+        that apply to directories only.
+        """
+        if self._dir_name_re and self._dir_name_re.fullmatch(path.name):
+            return True
+        if self._dir_path_re and self._dir_path_re.fullmatch(str(path)):
+            return True
+        return False
+
+    def match_path(self, path):
+        """Check whether path is excluded by the rules that apply to
+        any type of item.  This needs nothing but the path.
+        """
+        if path in self.paths:
+            return True
+        if self._name_re and self._name_re.fullmatch(path.name):
+            return True
+        s = str(path)
+        if self._path_re and self._path_re.fullmatch(s):
+            return True
+        if self._search_re and self._search_re.search(s):
+            return True
+        return False
+
+    def match_parents(self, path):
+        """Check whether any of the parent directories of path is
+        excluded.
+        """
+        return any(self.match_path(p) or self.match_dir(p)
+                   for p in path.parents)
+
+    def match_type(self, fileinfo):
+        """Check whether the item fileinfo is excluded by the rules
+        depending on its type and size.  The rules checked by
+        :meth:`ExcludeRules.match_path` are not repeated.
+        """
+        if fileinfo.is_dir():
+            return self.match_dir(fileinfo.path)
+        if (self.maxsize is not None and fileinfo.is_file() and
+            fileinfo.size > self.maxsize):
+            return True
+        return False
+
+    def enter(self, path):
+        """Return the rules to apply in the directory path.
+        """
+        if not self.ignorefile:
+            return self
+        ignorefile = path / self.ignorefile
+        try:
+            with ignorefile.open("rt") as f:
+                lines = [ l.rstrip("\n") for l in f ]
+        except FileNotFoundError:
+            return self
+        except OSError as e:
+            raise ArchiveCreateError("%s: %s" % (ignorefile, e))
+        patterns = []
+        regexes = []
+        for l in lines:
+            if not l.strip() or l.startswith("#"):
+                continue
+            if l.startswith("re:"):
+                regexes.append(l[3:])
+            else:
+                patterns.append(l)
+        rules = copy.copy(self)
+        rules._rules = tuple(list(r) for r in self._rules)
+        # The patterns from an ignore file only apply within path.
+        prefix = str(path / "_")[:-1]
+        rules._add_patterns(patterns, prefix)
+        rules._rules[4].extend("^%s.*(?:%s)" % (re.escape(prefix), r)
+                               for r in regexes)
+        rules._compile()
+        return rules
+
+    def rules_for(self, root, path):
+        """Return the rules to apply to path, found when scanning the
+        directory root, or :const:`None` if path is inside of an
+        excluded directory.  The ignore files in root and in the
+        directories in between are taken into account.
+        """
+        rules = self
+        d = root
+        for name in path.relative_to(root).parts:
+            if rules.match_path(d) or rules.match_dir(d):
+                return None
+            rules = rules.enter(d)
+            d = d / name
+        return rules
+
+    def device(self, path):
+        """Return the device of the directory path, if needed for the
+        one file system rule.
+        """
+        if self.onefs:
+            return os.lstat(path).st_dev
+        return None
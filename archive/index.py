@@ -4,9 +4,12 @@
 from collections.abc import Mapping, Sequence
 from distutils.version import StrictVersion
 from pathlib import Path
+import warnings
 import yaml
 from archive.archive import Archive
+from archive.exception import ArchiveReadError, ArchiveWarning
 from archive.tools import parse_date
+from archive.volume import VolumeSet, parse_volume_tags
 
 
 class IndexItem:
@@ -20,6 +23,11 @@ class IndexItem:
             self.user = data.get('user')
             self.schedule = data.get('schedule')
             self.type = data.get('type')
+            if 'volumes' in data:
+                self.volumes = [ Path(p) for p in data['volumes'] ]
+            else:
+                self.volumes = None
+            self._volume = (None, None, None)
         elif archive is not None:
             self.date = parse_date(archive.manifest.head['Date'])
             self.path = archive.path
@@ -40,6 +48,12 @@ class IndexItem:
             self.user = tagmap.get('user')
             self.schedule = tagmap.get('schedule')
             self.type = tagmap.get('type')
+            if isinstance(archive, VolumeSet):
+                self.volumes = archive.paths
+                self._volume = (None, None, None)
+            else:
+                self.volumes = None
+                self._volume = parse_volume_tags(archive.manifest.tags)
         else:
             raise TypeError("Either data or archive must be provided")
 
@@ -54,8 +68,23 @@ class IndexItem:
             v = getattr(self, k, None)
             if v:
                 d[k] = v
+        if self.volumes:
+            d['volumes'] = [ str(p) for p in self.volumes ]
         return d
 
+    @property
+    def paths(self):
+        """The paths of all volumes or the path of the archive."""
+        return self.volumes or [self.path]
+
+    def open(self):
+        """Open the archive or the volume set for reading.
+        """
+        if self.volumes:
+            return VolumeSet().open(self.volumes)
+        else:
+            return Archive().open(self.path)
+
     def __ge__(self, other):
         """self >= other
 
@@ -109,12 +138,27 @@ class ArchiveIndex(Sequence):
         return StrictVersion(self.head["Version"])
 
     def find(self, path):
+        """Find the item for an archive.  path may be the path of any
+        volume of a volume set.
+        """
         for i in self:
-            if i.path == path:
+            if path in i.paths:
                 return i
         else:
             return None
 
+    def open_archive(self, name):
+        """Open the archive having the file name name for reading.
+        name may be the name of any volume of a volume set.  This may
+        be used as the resolve argument to :meth:`Archive.extract`.
+        """
+        for i in self:
+            if any(p.name == name for p in i.paths):
+                return i.open()
+        else:
+            raise ArchiveReadError("archive %s not found in the index"
+                                   % name)
+
     def write(self, fileobj):
         fileobj.write("%YAML 1.1\n".encode("ascii"))
         yaml.dump(self.head, stream=fileobj, encoding="ascii",
@@ -124,16 +168,36 @@ class ArchiveIndex(Sequence):
                   default_flow_style=False, explicit_start=True)
 
     def add_archives(self, paths, prune=False):
+        """Add archives to the index.
+
+        The volumes of a set are combined into one item, incomplete
+        sets are skipped with a warning.
+        """
         seen = set()
+        volsets = {}
         for p in paths:
             p = p.resolve()
             seen.add(p)
             if self.find(p):
                 continue
             with Archive().open(p) as archive:
-                self.append(IndexItem(archive=archive))
+                item = IndexItem(archive=archive)
+            volume, count, volset = item._volume
+            if volume is None:
+                self.append(item)
+            else:
+                key = (p.parent, volset, item.date, count)
+                volsets.setdefault(key, (item, {}))[1][volume] = p
+        for (_, volset, _, count), (item, volumes) in volsets.items():
+            if sorted(volumes.keys()) != list(range(1, count+1)):
+                warnings.warn(ArchiveWarning("incomplete volume set %s"
+                                             % volset))
+                continue
+            item.volumes = [ volumes[n] for n in range(1, count+1) ]
+            item.path = item.volumes[0]
+            self.append(item)
         if prune:
-            items = [ i for i in self if i.path in seen ]
+            items = [ i for i in self if seen.issuperset(i.paths) ]
             self.items = items
 
     def sort(self, *, key=None, reverse=False):
@@ -6,16 +6,27 @@ import datetime
 from distutils.version import StrictVersion
 from enum import Enum
 import grp
+import heapq
 import itertools
 import os
 from pathlib import Path
+import pickle
 import pwd
 import stat
+import tempfile
 import warnings
 import yaml
 import archive
-from archive.exception import ArchiveInvalidTypeError, ArchiveWarning
-from archive.tools import now_str, parse_date, checksum, mode_ft, ft_mode
+from archive.exception import (ArchiveInvalidTypeError, ArchiveReadError,
+                               ArchiveWarning)
+from archive.exclude import ExcludeRules
+from archive.tools import (now_str, parse_date, checksum, check_hashalg,
+                           mode_ft, ft_mode, open_input, physical_offset,
+                           reorder_map, bounded_map)
+
+# Use the much faster libyaml based loader to read large manifests,
+# if available.
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 
 class DiffStatus(Enum):
@@ -32,11 +43,82 @@ class DiffStatus(Enum):
     MISSING_B = 6
 
 
+class ReadOrder(Enum):
+    """Order to read the content of files in.
+
+    Reading files in the order of their inode number or of their
+    physical position on disk rather then in path order reduces the
+    seeking on rotating disks.
+    """
+    PATH = 'path'
+    INODE = 'inode'
+    EXTENT = 'extent'
+    def __repr__(self):
+        return '<%s.%s>' % (self.__class__.__name__, self.name)
+
+    def key(self, fi):
+        """Return the sort key of a regular file.
+
+        Return :const:`None` if fi is not a regular file or if the
+        key cannot be determined.
+        """
+        if not fi.is_file():
+            return None
+        try:
+            if self == ReadOrder.INODE:
+                fstat = os.lstat(fi.path)
+                return (fstat.st_dev, fstat.st_ino)
+            elif self == ReadOrder.EXTENT:
+                with open(fi.path, "rb") as f:
+                    fstat = os.fstat(f.fileno())
+                    offset = physical_offset(f.fileno())
+                # Fall back to the inode number if the position on
+                # disk is not known.
+                return (fstat.st_dev, offset or 0, fstat.st_ino)
+            else:
+                return 0
+        except OSError:
+            # Leave it to the caller to run into the error again and
+            # to report it in the proper context.
+            return None
+
+
+def _hash_ordered(fileinfos, readorder, count):
+    """Calculate the checksums of the regular files in read order.
+
+    Yield the items in the original order.
+    """
+    if readorder is None or readorder == ReadOrder.PATH:
+        return iter(fileinfos)
+    def key(fi):
+        if fi.is_file() and fi._checksum is None:
+            return readorder.key(fi)
+        else:
+            return None
+    items = reorder_map(lambda fi: fi.checksum, fileinfos, key, count)
+    return (fi for fi, _ in items)
+
+def _hash_ahead(fileinfos, workers):
+    """Calculate the checksums of the regular files in worker threads
+    while iterating over fileinfos.
+    """
+    def hash(fi):
+        if fi.is_file():
+            fi.checksum
+    return (fi for fi, _ in bounded_map(hash, fileinfos, workers))
+
+
 class FileInfo:
 
     Checksums = ['sha256']
 
-    def __init__(self, data=None, path=None):
+    def __init__(self, data=None, path=None, checksums=None):
+        if checksums is not None:
+            self.Checksums = list(checksums)
+        self.ref = None
+        self.delta = None
+        self.chunks = None
+        self._input = data is None
         if data is not None:
             self.path = Path(data['path'])
             self.uid = data['uid']
@@ -48,6 +130,9 @@ class FileInfo:
             if self.is_file():
                 self.size = data['size']
                 self._checksum = data['checksum'] or []
+                self.ref = data.get('ref')
+                self.delta = data.get('delta')
+                self.chunks = data.get('chunks')
             elif self.is_symlink():
                 self.target = Path(data['target'])
         elif path is not None:
@@ -89,10 +174,27 @@ class FileInfo:
     @property
     def checksum(self):
         if self._checksum is None:
-            with self.path.open('rb') as f:
+            # Keep the file in the page cache, the content is
+            # usually read again to add it to an archive.
+            with open_input(self.path, drop_cache=False) as f:
                 self._checksum = checksum(f, self.Checksums)
         return self._checksum
 
+    def add_checksum(self, algorithm):
+        """Calculate the checksum using algorithm in addition to those
+        in :attr:`Checksums` and return it.  This requires reading the
+        file, raise :exc:`ValueError` if the item has not been taken
+        from the file system.
+        """
+        cs = self.checksum
+        if algorithm not in cs:
+            if not self._input:
+                raise ValueError("%s: cannot calculate checksum %s"
+                                 % (self.path, algorithm))
+            with open_input(self.path, drop_cache=False) as f:
+                cs.update(checksum(f, [algorithm]))
+        return cs[algorithm]
+
     def is_dir(self):
         return stat.S_ISDIR(self.st_mode)
 
@@ -116,6 +218,12 @@ class FileInfo:
         if self.is_file():
             d['size'] = self.size
             d['checksum'] = self.checksum
+            if self.ref:
+                d['ref'] = self.ref
+            if self.delta:
+                d['delta'] = self.delta
+            if self.chunks is not None:
+                d['chunks'] = self.chunks
         elif self.is_symlink():
             d['target'] = str(self.target)
         return d
@@ -133,44 +241,164 @@ class FileInfo:
         return "%s  %s  %s  %s  %s" % (m, ug, s, d, p)
 
     @classmethod
-    def iterpaths(cls, paths, excludes):
+    def iterpaths(cls, paths, excludes, checksums=None, recursive=True):
         """Iterate over paths, descending directories.
-        Yield a FileInfo object for each path.
+        Yield a FileInfo object for each path.  The checksums of
+        regular files will be calculated using the hash algorithms in
+        checksums, defaulting to :attr:`FileInfo.Checksums`.
+
+        excludes may be a set of paths or an
+        :class:`archive.exclude.ExcludeRules` object.  Excluded
+        directories are not descended.
+
+        If recursive is false, directories are not descended, only
+        the items in paths are taken.  paths may be an iterator then,
+        it is consumed incrementally.  Items inside of an excluded
+        directory are skipped as well.
 
         If last FileInfo object did correspond to a directory, the caller
         may send a true value to the generator to skip descending into the
         directory.  For other file types, any value sent to the generator
         will have no effect.
         """
+        excludes = ExcludeRules.get(excludes)
+        return cls._iterpaths(paths, excludes, checksums, recursive, None)
+
+    @classmethod
+    def _iterpaths(cls, paths, excludes, checksums, recursive, dev):
         for p in paths:
-            if p in excludes:
+            if excludes.match_path(p):
+                continue
+            if not recursive and excludes.match_parents(p):
                 continue
             try:
-                info = cls(path=p)
+                info = cls(path=p, checksums=checksums)
             except ArchiveInvalidTypeError as e:
                 warnings.warn(ArchiveWarning("%s ignored" % e))
                 continue
-            if (yield info):
+            if excludes.match_type(info):
+                continue
+            if (yield info) or not recursive:
                 continue
             if info.is_dir():
-                yield from cls.iterpaths(p.iterdir(), excludes)
+                subdev = excludes.device(p)
+                if dev is not None and subdev != dev:
+                    # Do not cross file system boundaries.
+                    continue
+                yield from cls._iterpaths(p.iterdir(), excludes.enter(p),
+                                          checksums, True, subdev)
+
+
+class _FileInfoSpool(Sequence):
+    """A sequence of FileInfo objects spooled to a temporary file.
+
+    The items are written to the file in the order they are taken from
+    the iterable fileinfos.  The checksum of regular files is
+    calculated before spooling them, so that it does not get lost.
+    The sequence may be iterated over any number of times, each
+    iteration reads the items back from the file.  Accessing items by
+    index is supported, but requires a sequential scan of the file.
+    """
+
+    def __init__(self, fileinfos):
+        self._file = tempfile.NamedTemporaryFile(prefix="archive-tools-")
+        self._len = 0
+        for fi in fileinfos:
+            if fi.is_file():
+                fi.checksum
+            pickle.dump(fi, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+            self._len += 1
+        self._file.flush()
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        # Open the file anew for each iteration, so that more then
+        # one iteration may be active at the same time.
+        with open(self._file.name, "rb") as f:
+            for _ in range(self._len):
+                yield pickle.load(f)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(itertools.islice(self, *index.indices(self._len)))
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("index out of range")
+        return next(itertools.islice(self, index, None))
+
+    def close(self):
+        self._file.close()
+
+
+def _spool_sort(fileinfos, key, reverse, sortbuffer, readorder=None):
+    """Sort an iterable of FileInfo objects with bounded memory.
+
+    Sorted runs of at most sortbuffer items are spooled to temporary
+    files and then merged.  Return a list if all items fit into one
+    run, a :class:`_FileInfoSpool` otherwise.  The checksums of the
+    items in each run are calculated in readorder before spooling.
+    """
+    runs = []
+    it = iter(fileinfos)
+    while True:
+        run = list(itertools.islice(it, sortbuffer))
+        run.sort(key=key, reverse=reverse)
+        if not runs and len(run) < sortbuffer:
+            return run
+        if not run:
+            break
+        runs.append(_FileInfoSpool(_hash_ordered(run, readorder, len(run))))
+        del run
+    try:
+        return _FileInfoSpool(heapq.merge(*runs, key=key, reverse=reverse))
+    finally:
+        for r in runs:
+            r.close()
 
 
 class Manifest(Sequence):
+    """The list of items in an archive.
+
+    If hashworkers is set when scanning paths in path read order, the
+    checksums of the files found so far are calculated in that many
+    threads while the directory tree is being scanned.  By default,
+    the checksums are calculated in the calling thread.
+    """
 
     Version = "1.1"
+    ReadWindow = 10000
+    """Maximum number of files to calculate checksums for in read order."""
+    HashWorkers = min(os.cpu_count() or 1, 4)
+    """Default number of threads calculating checksums while scanning
+    the directory tree, used by :meth:`Archive.create`.
+    """
 
     def __init__(self, fileobj=None, paths=None, excludes=None,
-                 fileinfos=None, tags=None):
+                 fileinfos=None, tags=None, sortbuffer=None, checksums=None,
+                 readorder=None, recursive=True, hashworkers=None):
+        if sortbuffer is not None and sortbuffer < 1:
+            raise ValueError("sortbuffer must be positive")
+        self.sortbuffer = sortbuffer
+        self.readorder = readorder
         if fileobj is not None:
-            docs = yaml.safe_load_all(fileobj)
+            docs = yaml.load_all(fileobj, Loader=_YamlLoader)
             self.head = next(docs)
             # Legacy: version 1.0 head did not have Metadata:
             self.head.setdefault("Metadata", [])
             self.fileinfos = [ FileInfo(data=d) for d in next(docs) ]
         elif paths is not None or fileinfos is not None:
+            if checksums is None:
+                checksums = FileInfo.Checksums
+            checksums = list(checksums)
+            if not checksums:
+                raise ValueError("at least one checksum algorithm "
+                                 "is required")
+            check_hashalg(checksums)
             self.head = {
-                "Checksums": FileInfo.Checksums,
+                "Checksums": checksums,
                 "Date": now_str(),
                 "Generator": "archive-tools %s" % archive.__version__,
                 "Metadata": [],
@@ -179,15 +407,16 @@ class Manifest(Sequence):
             if tags is not None:
                 self.head["Tags"] = tags
             if fileinfos is None:
-                fileinfos = list(FileInfo.iterpaths(paths, set(excludes or ())))
+                fileinfos = FileInfo.iterpaths(paths, excludes,
+                                               checksums, recursive)
+                if readorder in (None, ReadOrder.PATH) and hashworkers:
+                    fileinfos = _hash_ahead(fileinfos, hashworkers)
+            else:
+                fileinfos = self._check_checksums(fileinfos, checksums)
+            if sortbuffer is None:
+                self.fileinfos = list(fileinfos)
             else:
-                fileinfos = list(fileinfos)
-                cs = set(FileInfo.Checksums)
-                for fi in fileinfos:
-                    if fi.is_file() and not cs.issubset(fi.checksum.keys()):
-                        raise ValueError("Missing checksum on item %s"
-                                         % fi.path)
-            self.fileinfos = fileinfos
+                self.fileinfos = fileinfos
             self.sort()
         else:
             raise TypeError("Either fileobj or paths or fileinfos "
@@ -199,6 +428,17 @@ class Manifest(Sequence):
     def __getitem__(self, index):
         return self.fileinfos.__getitem__(index)
 
+    def __iter__(self):
+        return iter(self.fileinfos)
+
+    @staticmethod
+    def _check_checksums(fileinfos, checksums):
+        cs = set(checksums)
+        for fi in fileinfos:
+            if fi.is_file() and not cs.issubset(fi.checksum.keys()):
+                raise ValueError("Missing checksum on item %s" % fi.path)
+            yield fi
+
     @property
     def version(self):
         return StrictVersion(self.head["Version"])
@@ -219,9 +459,30 @@ class Manifest(Sequence):
     def tags(self):
         return tuple(self.head.get("Tags", ()))
 
+    @property
+    def deleted(self):
+        """The paths of the items deleted since the base archives of
+        a differential archive.  A directory implies all its content.
+        """
+        return tuple(Path(p) for p in self.head.get("Deleted", ()))
+
     def add_metadata(self, path):
         self.head["Metadata"].append(str(path))
 
+    def set_deleted(self, paths):
+        """Record the items at paths as deleted.  The content of
+        deleted directories is omitted.
+        """
+        deleted = []
+        for p in sorted(set(paths)):
+            if deleted and deleted[-1] in p.parents:
+                continue
+            deleted.append(p)
+        if deleted:
+            self.head["Deleted"] = [ str(p) for p in deleted ]
+        else:
+            self.head.pop("Deleted", None)
+
     def find(self, path):
         for fi in self:
             if fi.path == path:
@@ -233,14 +494,31 @@ class Manifest(Sequence):
         fileobj.write("%YAML 1.1\n".encode("ascii"))
         yaml.dump(self.head, stream=fileobj, encoding="ascii", 
                   default_flow_style=False, explicit_start=True)
-        yaml.dump([ fi.as_dict() for fi in self ],
-                  stream=fileobj, encoding="ascii",
-                  default_flow_style=False, explicit_start=True)
+        # Dump the items one by one rather then building the list
+        # of all of them in memory.  The result is the same.
+        start = True
+        for fi in _hash_ordered(self, self.readorder, self.ReadWindow):
+            yaml.dump([ fi.as_dict() ], stream=fileobj, encoding="ascii",
+                      default_flow_style=False, explicit_start=start)
+            start = False
+        if start:
+            yaml.dump([], stream=fileobj, encoding="ascii",
+                      default_flow_style=False, explicit_start=True)
 
     def sort(self, *, key=None, reverse=False):
+        """Sort the items in the manifest.
+
+        If the manifest has been created with `sortbuffer` set, at
+        most that many items are held in memory at any time.  Larger
+        manifests are sorted using temporary files.
+        """
         if key is None:
             key = lambda fi: fi.path
-        self.fileinfos.sort(key=key, reverse=reverse)
+        if self.sortbuffer is None:
+            self.fileinfos.sort(key=key, reverse=reverse)
+        else:
+            self.fileinfos = _spool_sort(self.fileinfos, key, reverse,
+                                         self.sortbuffer, self.readorder)
 
 
 def _common_checksum(manifest_a, manifest_b):
@@ -254,7 +532,24 @@ def _common_checksum(manifest_a, manifest_b):
                                "cannot compare archive content.")
 
 
-def diff_manifest(manifest_a, manifest_b, checksum=FileInfo.Checksums[0]):
+def _pair_checksum(fi_a, fi_b):
+    """Return a checksum algorithm that is present in both FileInfo objects.
+    If there is none, but one of them has been taken from the file
+    system, calculate the first algorithm of the other one for it.
+    """
+    for algorithm in fi_a.checksum.keys():
+        if algorithm in fi_b.checksum:
+            return algorithm
+    for fi, other in ((fi_b, fi_a), (fi_a, fi_b)):
+        if fi._input and other.checksum:
+            algorithm = next(iter(other.checksum))
+            fi.add_checksum(algorithm)
+            return algorithm
+    raise ArchiveReadError("No common checksum algorithm, cannot "
+                           "compare content of %s." % fi_a.path)
+
+
+def diff_manifest(manifest_a, manifest_b, checksum=None):
     """Compare two iterables of :class:`~archive.manifest.FileInfo` objects.
 
     Items are matched by the :attr:`~archive.manifest.FileInfo.path`.
@@ -277,6 +572,10 @@ def diff_manifest(manifest_a, manifest_b, checksum=FileInfo.Checksums[0]):
     (:const:`~archive.manifest.DiffStatus.MISSING_A`, :const:`None`, `fi_b`),
     if there is no match for `fi_b`.
 
+    The content of regular files is compared using the hash
+    algorithm `checksum`.  If this is :const:`None`, the first
+    algorithm present in both items will be used for each pair.
+
     It is assumed that `manifest_a` and `manifest_b` are sorted by
     path.  Spurious mismatches will be reported if this is not the
     case.
@@ -289,8 +588,11 @@ def diff_manifest(manifest_a, manifest_b, checksum=FileInfo.Checksums[0]):
             if fi_a.target != fi_b.target:
                 return DiffStatus.SYMLNK_TARGET
         elif fi_a.type == "f":
-            if (fi_a.size != fi_b.size or
-                fi_a.checksum[algorithm] != fi_b.checksum[algorithm]):
+            if fi_a.size != fi_b.size:
+                return DiffStatus.CONTENT
+            if algorithm is None:
+                algorithm = _pair_checksum(fi_a, fi_b)
+            if fi_a.checksum[algorithm] != fi_b.checksum[algorithm]:
                 return DiffStatus.CONTENT
         if (fi_a.uid != fi_b.uid or fi_a.uname != fi_b.uname or
             fi_a.gid != fi_b.gid or fi_a.gname != fi_b.gname or
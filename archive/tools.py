@@ -6,10 +6,22 @@
    keep anything in here compatible between different versions.
 """
 
+import collections
+import concurrent.futures
 import datetime
+import errno
 import hashlib
+import io
 import os
+import queue
 import stat
+import struct
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 try:
     from dateutil.tz import gettz
 except ImportError:
@@ -125,20 +137,793 @@ def parse_date(date_string):
                                      % date_string) from None
 
 
+_tree_executor = (None, None)
+
+def _get_tree_executor():
+    global _tree_executor
+    workers, executor = _tree_executor
+    if workers != TreeHash.Workers:
+        executor = concurrent.futures.ThreadPoolExecutor(TreeHash.Workers)
+        _tree_executor = (TreeHash.Workers, executor)
+    return executor
+
+def _hash_leaf(algorithm, data):
+    try:
+        h = hashlib.new(algorithm, b'\x00')
+        h.update(data)
+        return h.digest()
+    finally:
+        if isinstance(data, memoryview):
+            data.release()
+
+_zero_leaves = {}
+
+class TreeHash:
+    """A chunked tree hash that may be calculated in parallel.
+
+    The name of the algorithm is the name of a hashlib algorithm with
+    a prefix `tree-`, e.g. `tree-sha256`.  The data is split into
+    leaf chunks of :attr:`LeafSize` bytes, the last chunk may be
+    shorter.  The digest of each leaf is `H(0x00 || chunk)`, the
+    digest of the tree is `H(0x01 || leaf_1 || ... || leaf_n)`, where
+    `H` is the underlying hash function.  Empty data has one empty
+    leaf.  The leaves are hashed concurrently in up to
+    :attr:`Workers` threads.  The digest of a leaf of zeros is only
+    calculated once, see :meth:`update_zeros`.
+
+    The class provides the subset of the interface of hashlib hash
+    objects that is needed in archive-tools.
+    """
+
+    Prefix = "tree-"
+    LeafSize = 4*1024*1024
+    Workers = os.cpu_count() or 1
+
+    def __init__(self, name):
+        if not name.startswith(self.Prefix):
+            raise ValueError("unsupported hash type %s" % name)
+        self.name = name
+        self._algorithm = name[len(self.Prefix):]
+        self.digest_size = hashlib.new(self._algorithm).digest_size
+        self._buf = bytearray()
+        self._leaves = []
+        self._pending = threading.BoundedSemaphore(2*self.Workers)
+        self._digest = None
+
+    def _submit(self, data):
+        self._pending.acquire()
+        f = _get_tree_executor().submit(_hash_leaf, self._algorithm, data)
+        f.add_done_callback(lambda f: self._pending.release())
+        self._leaves.append(f)
+        return f
+
+    def update(self, data):
+        if self._digest is not None:
+            raise ValueError("update() called after digest()")
+        view = memoryview(data).cast('B')
+        try:
+            if self._buf:
+                n = self.LeafSize - len(self._buf)
+                self._buf += view[:n]
+                view = view[n:]
+                if len(self._buf) == self.LeafSize:
+                    self._submit(bytes(self._buf))
+                    self._buf = bytearray()
+            # Full leaves are hashed directly from data without
+            # copying.  We must wait for these to be done before
+            # returning, because the caller may modify data.
+            borrowed = []
+            while len(view) >= self.LeafSize:
+                borrowed.append(self._submit(view[:self.LeafSize]))
+                view = view[self.LeafSize:]
+            self._buf += view
+            for f in borrowed:
+                f.result()
+        finally:
+            view.release()
+
+    def _zero_leaf(self):
+        key = (self._algorithm, self.LeafSize)
+        f = _zero_leaves.get(key)
+        if f is None:
+            f = concurrent.futures.Future()
+            f.set_result(_hash_leaf(self._algorithm, bytes(self.LeafSize)))
+            _zero_leaves[key] = f
+        return f
+
+    def update_zeros(self, size):
+        """Update the hash with size zero bytes, such as a hole in a
+        sparse file.  Full leaves of zeros take the digest calculated
+        once rather then hashing the data again.
+        """
+        if self._digest is not None:
+            raise ValueError("update_zeros() called after digest()")
+        if self._buf:
+            n = min(self.LeafSize - len(self._buf), size)
+            self._buf += bytes(n)
+            size -= n
+            if len(self._buf) == self.LeafSize:
+                self._submit(bytes(self._buf))
+                self._buf = bytearray()
+        if size >= self.LeafSize:
+            self._leaves.extend([self._zero_leaf()] * (size // self.LeafSize))
+            size %= self.LeafSize
+        self._buf += bytes(size)
+
+    def digest(self):
+        if self._digest is None:
+            if self._buf or not self._leaves:
+                self._submit(bytes(self._buf))
+                self._buf = bytearray()
+            h = hashlib.new(self._algorithm, b'\x01')
+            for f in self._leaves:
+                h.update(f.result())
+            self._leaves = []
+            self._digest = h.digest()
+        return self._digest
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+
+def new_hash(name):
+    """Return a new hash object for the algorithm name.
+    This may either be a :class:`TreeHash` or any algorithm supported
+    by :mod:`hashlib`.
+    """
+    if name.startswith(TreeHash.Prefix):
+        return TreeHash(name)
+    else:
+        return hashlib.new(name)
+
+
+def check_hashalg(hashalg):
+    """Check that all hash algorithms in hashalg are supported.
+    Raise :exc:`ValueError` otherwise.  Algorithms having a variable
+    digest length, such as shake_128, are not supported.
+    """
+    for h in hashalg:
+        try:
+            m = new_hash(h)
+        except (ValueError, TypeError):
+            raise ValueError("unsupported checksum algorithm '%s'" % h)
+        if not m.digest_size:
+            raise ValueError("unsupported checksum algorithm '%s'" % h)
+
+
+def is_plain_file(fileobj):
+    """Check if fileobj is a buffered binary file directly reading or
+    writing a file descriptor.
+    """
+    return isinstance(getattr(fileobj, 'raw', None), io.FileIO)
+
+
+_chunksize = 1024*1024
+"""Size of the buffer used to read data in :func:`checksum`."""
+
+_concurrent_min_size = 4*1024*1024
+"""Minimal amount of data to calculate different hashes concurrently."""
+
+_buffers = threading.local()
+
+_zeros = bytes(_chunksize)
+
+def _get_buffer():
+    try:
+        return _buffers.buf
+    except AttributeError:
+        _buffers.buf = bytearray(_chunksize)
+        return _buffers.buf
+
+def _remaining_size(fileobj):
+    """Return the number of bytes left to be read from fileobj if it is
+    a regular file, None otherwise.
+    """
+    if not is_plain_file(fileobj):
+        return None
+    try:
+        fstat = os.fstat(fileobj.fileno())
+    except OSError:
+        return None
+    if not stat.S_ISREG(fstat.st_mode):
+        return None
+    return max(fstat.st_size - fileobj.tell(), 0)
+
+def sparse_map(fd, size=None):
+    """Return the data segments of a sparse file.
+
+    Find the holes in the file using :data:`os.SEEK_DATA` and
+    :data:`os.SEEK_HOLE`.  Return a list of `(offset, length)` tuples
+    of the data segments, that are ordered by offset.  If the file
+    ends with a hole, the list is terminated by a segment of length
+    zero at the end of the file.  Return :const:`None` if the file has
+    no holes or if the operating system or the file system does not
+    support finding them.  The file offset of fd is not changed.
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        return None
+    fstat = os.fstat(fd)
+    if size is None:
+        size = fstat.st_size
+    if not stat.S_ISREG(fstat.st_mode) or not size:
+        return None
+    if getattr(fstat, "st_blocks", None) is None or fstat.st_blocks*512 >= size:
+        # Cheap check: there is enough space allocated on disk to
+        # hold all the data, so there can't be holes.
+        return None
+    segments = []
+    pos = 0
+    save_pos = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        while pos < size:
+            try:
+                data = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # No more data after pos.
+                    break
+                raise
+            if data >= size:
+                break
+            hole = min(os.lseek(fd, data, os.SEEK_HOLE), size)
+            segments.append((data, hole - data))
+            pos = hole
+    except OSError:
+        return None
+    finally:
+        os.lseek(fd, save_pos, os.SEEK_SET)
+    if segments == [(0, size)]:
+        return None
+    if pos < size:
+        segments.append((size, 0))
+    return segments
+
+def _update(hashes, data, executor):
+    if executor:
+        futures = [ executor.submit(h.update, data) for h in hashes ]
+        for f in futures:
+            f.result()
+    else:
+        for h in hashes:
+            h.update(data)
+
+def _update_zeros(hashes, size, executor):
+    """Update hashes with size zero bytes.
+    """
+    others = []
+    for h in hashes:
+        if isinstance(h, TreeHash):
+            h.update_zeros(size)
+        else:
+            others.append(h)
+    if size < _concurrent_min_size:
+        executor = None
+    zeros = memoryview(_zeros)
+    while size > 0:
+        n = min(size, len(zeros))
+        _update(others, zeros[:n], executor)
+        size -= n
+
+def _checksum_read(fileobj, hashes, executor, size=None):
+    """Update hashes reading the content of fileobj into a buffer.
+    Read at most size bytes if size is not :const:`None`.
+    """
+    buf = _get_buffer()
+    view = memoryview(buf)
+    readinto = getattr(fileobj, 'readinto', None)
+    total = 0
+    while True:
+        bufsize = len(buf)
+        if size is not None:
+            bufsize = min(bufsize, size - total)
+            if not bufsize:
+                break
+        if readinto:
+            n = readinto(view[:bufsize])
+            chunk = view[:n]
+        else:
+            chunk = fileobj.read(bufsize)
+            n = len(chunk)
+        if not n:
+            break
+        total += n
+        if total < _concurrent_min_size:
+            _update(hashes, chunk, None)
+        else:
+            _update(hashes, chunk, executor)
+
+def _checksum_sparse(fileobj, segments, hashes, executor):
+    """Update hashes with the content of a sparse file, only reading
+    the data segments.  Note that the holes still need to be hashed,
+    except for whole leaves of a :class:`TreeHash`.
+    """
+    pos = 0
+    for offset, length in segments:
+        _update_zeros(hashes, offset - pos, executor)
+        fileobj.seek(offset)
+        _checksum_read(fileobj, hashes, executor, length)
+        pos = offset + length
+    fileobj.seek(0, os.SEEK_END)
+
 def checksum(fileobj, hashalg):
     """Calculate hashes for a file.
+
+    The data is read into a large reusable buffer.  Files are not
+    mapped into memory, because a file being truncated by another
+    process while hashing would kill the process with SIGBUS.  Holes
+    in sparse files are not read.  If more then one algorithm is
+    requested, the hashes of larger amounts of data are calculated
+    concurrently in threads, taking advantage of hashlib releasing
+    the GIL.  :class:`TreeHash` algorithms are supported in hashalg.
     """
     if not hashalg:
         return {}
-    m = { h:hashlib.new(h) for h in hashalg }
-    chunksize = 8192
+    hashalg = list(hashalg)
+    size = _remaining_size(fileobj)
+    segments = None
+    if size and is_plain_file(fileobj) and fileobj.tell() == 0:
+        segments = sparse_map(fileobj.fileno(), size)
+    if (len(hashalg) == 1 and not segments and
+        hasattr(hashlib, 'file_digest') and
+        hasattr(fileobj, 'readinto') and hasattr(fileobj, 'readable')):
+        # Python 3.11 and newer
+        h = hashalg[0]
+        try:
+            digest = hashlib.file_digest(fileobj, lambda: new_hash(h))
+        except ValueError:
+            # file_digest() checks fileobj before reading anything.
+            pass
+        else:
+            return { h: digest.hexdigest() }
+    m = { h:new_hash(h) for h in hashalg }
+    hashes = list(m.values())
+    if len(hashes) > 1:
+        # Note that the worker threads are only started on demand.
+        executor = concurrent.futures.ThreadPoolExecutor(len(hashes))
+    else:
+        executor = None
+    try:
+        if segments:
+            _checksum_sparse(fileobj, segments, hashes, executor)
+        else:
+            _checksum_read(fileobj, hashes, executor)
+    finally:
+        if executor:
+            executor.shutdown()
+    return { h: m[h].hexdigest() for h in hashalg }
+
+
+def hashed_copy(chunks, dst, hashalg):
+    """Write the data from the iterable of bytes-like objects chunks
+    to the binary file object dst, calculating hashes along the way.
+    dst may be :const:`None` to only calculate the hashes.  Return the
+    size of the data and a dict mapping the algorithms in hashalg to
+    the hex digests.
+    """
+    m = { h:new_hash(h) for h in hashalg }
+    size = 0
+    for data in chunks:
+        size += len(data)
+        for h in m.values():
+            h.update(data)
+        if dst is not None:
+            dst.write(data)
+    return size, { h: m[h].hexdigest() for h in hashalg }
+
+
+def _copy_file_range(src_fd, offset, dst_fd, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+def _sendfile(src_fd, offset, dst_fd, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+_copy_range_methods = []
+if hasattr(os, "copy_file_range"):
+    # Python 3.8 and newer
+    _copy_range_methods.append(_copy_file_range)
+if hasattr(os, "sendfile"):
+    _copy_range_methods.append(_sendfile)
+
+_copy_range_fallback_errno = {
+    errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP,
+}
+
+def copy_range(src_fd, offset, dst_fd, count):
+    """Copy data between file descriptors in the kernel.
+
+    Copy count bytes from src_fd, starting at offset, to the current
+    position of dst_fd, using :func:`os.copy_file_range` or
+    :func:`os.sendfile`, whichever is available and supported for the
+    file descriptors at hand.  The file offset of src_fd is not
+    changed.  Return the number of bytes copied.  This may be less
+    then count if kernel side copying is not supported or if the end
+    of src_fd is hit.  The caller is supposed to copy the rest in
+    user space.
+    """
+    methods = list(_copy_range_methods)
+    copied = 0
+    while copied < count and methods:
+        try:
+            n = methods[0](src_fd, offset + copied, dst_fd, count - copied)
+        except OSError as e:
+            if e.errno in _copy_range_fallback_errno:
+                methods.pop(0)
+                continue
+            raise
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+# struct fiemap and struct fiemap_extent from <linux/fiemap.h>
+_FS_IOC_FIEMAP = 0xC020660B
+_fiemap = struct.Struct("=QQLLLL")
+_fiemap_extent = struct.Struct("=QQQQQLLLL")
+
+def physical_offset(fd):
+    """Return the physical position on disk of the start of a file.
+
+    The position is determined with the Linux FIEMAP ioctl.  Return
+    :const:`None` if the file has no data on disk or if FIEMAP is not
+    supported.
+    """
+    if fcntl is None:
+        return None
+    buf = bytearray(_fiemap.size + _fiemap_extent.size)
+    _fiemap.pack_into(buf, 0, 0, 0xffffffffffffffff, 0, 0, 1, 0)
+    try:
+        fcntl.ioctl(fd, _FS_IOC_FIEMAP, buf)
+    except OSError:
+        return None
+    if not _fiemap.unpack_from(buf)[3]:
+        return None
+    return _fiemap_extent.unpack_from(buf, _fiemap.size)[1]
+
+def reorder_windows(func, iterable, key, count, size=None, weight=None):
+    """Call func on items in the order of key, but keep them in order.
+
+    The items are taken from iterable in windows of at most count
+    items.  If size is not :const:`None`, a window is also closed if
+    the sum of weight(item) reaches size.  Within each window, func
+    is called on the items sorted by key.  Yield each window as a
+    list of tuples of the items along with the result of func in the
+    original order.  Items for which key returns :const:`None` are
+    not passed to func, None is returned as their result.  They count
+    against count, but not against size.
+    """
+    it = iter(iterable)
     while True:
-        chunk = fileobj.read(chunksize)
-        if not chunk:
+        window = []
+        keys = []
+        total = 0
+        for item in it:
+            k = key(item)
+            window.append(item)
+            keys.append(k)
+            if k is not None and size is not None:
+                total += weight(item)
+            if len(window) >= count or (size is not None and total >= size):
+                break
+        if not window:
             break
-        for h in hashalg:
-            m[h].update(chunk)
-    return { h: m[h].hexdigest() for h in hashalg }
+        results = [None] * len(window)
+        order = sorted((k, i) for i, k in enumerate(keys) if k is not None)
+        for k, i in order:
+            results[i] = func(window[i])
+        yield list(zip(window, results))
+
+def reorder_map(func, iterable, key, count, size=None, weight=None):
+    """Call func on items in the order of key, but yield them in order.
+
+    Same as :func:`reorder_windows`, but yield the tuples one by one.
+    """
+    for window in reorder_windows(func, iterable, key, count, size, weight):
+        window.reverse()
+        while window:
+            # Drop our reference to the result as soon as it has been
+            # consumed, it might be large.
+            yield window.pop()
+
+def bounded_map(func, iterable, workers, ahead=None):
+    """Call func on the items of iterable in a pool of threads.
+
+    At most ahead items (twice the number of workers by default) are
+    submitted to the pool beyond the one last yielded.  Yield tuples
+    of the items along with the result of func in the original
+    order.  Exceptions raised by func are reraised when yielding the
+    respective item.  Note that iterable itself is consumed in the
+    calling thread, concurrently to the workers.
+    """
+    if ahead is None:
+        ahead = 2 * workers
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        try:
+            for item in iterable:
+                pending.append((item, executor.submit(func, item)))
+                if len(pending) > ahead:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+def background(iterable, maxsize):
+    """Iterate over iterable in a background thread.
+
+    Items are passed from the background thread through a queue that
+    holds at most maxsize items.  Exceptions raised in the background
+    thread are reraised in the consumer.
+    """
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((end, None))
+        except BaseException as e:
+            put((end, e))
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exc = q.get()
+            if item is end:
+                if exc is not None:
+                    raise exc
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class BackgroundWriter(io.RawIOBase):
+    """Write to a file object in a background thread.
+
+    The data is collected into chunks of bufsize bytes that are passed
+    to the background thread through a queue of at most queuesize
+    chunks.  Exceptions raised in the background thread are reraised
+    in the next call to write, flush, or close.  Closing the
+    BackgroundWriter does not close the underlying file object.
+    """
+
+    def __init__(self, fileobj, bufsize=_chunksize, queuesize=8):
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, 'name', None)
+        self._bufsize = bufsize
+        self._buf = bytearray()
+        self._queue = queue.Queue(queuesize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            try:
+                if data is None:
+                    return
+                if self._error is None:
+                    self.fileobj.write(data)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._check_error()
+        n = memoryview(b).nbytes
+        self._buf += b
+        if len(self._buf) >= self._bufsize:
+            self._queue.put(bytes(self._buf))
+            self._buf.clear()
+        return n
+
+    def flush(self):
+        if self._buf:
+            self._queue.put(bytes(self._buf))
+            self._buf.clear()
+        self._queue.join()
+        self._check_error()
+        self.fileobj.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+            super().close()
+
+def parse_size(s):
+    """Parse a size string into a number of bytes.
+
+    The string may have one of the binary suffixes K, M, G, or T.
+    """
+    units = {'K': 1<<10, 'M': 1<<20, 'G': 1<<30, 'T': 1<<40}
+    s = s.strip()
+    try:
+        factor = units[s[-1:].upper()]
+        s = s[:-1]
+    except KeyError:
+        factor = 1
+    try:
+        return int(float(s) * factor)
+    except ValueError:
+        raise ValueError("Invalid size string: '%s'" % s) from None
+
+
+class Throttle:
+    """Limit the rate of I/O operations.
+
+    Each call blocks the calling thread as long as needed to keep the
+    data rate below bandwidth bytes per second and the number of
+    operations below iops per second.  Either limit may be None.  The
+    object may be shared between threads.
+    """
+
+    def __init__(self, bandwidth=None, iops=None):
+        self.bandwidth = bandwidth
+        self.iops = iops
+        self._lock = threading.Lock()
+        self._due = time.monotonic()
+
+    def __call__(self, nbytes=0, nops=1):
+        delay = 0.0
+        if self.bandwidth:
+            delay += nbytes / self.bandwidth
+        if self.iops:
+            delay = max(delay, nops / self.iops)
+        if not delay:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._due = max(self._due, now) + delay
+            wait = self._due - now - delay
+        if wait > 0:
+            time.sleep(wait)
+
+
+input_throttle = None
+"""A :class:`Throttle` applied to the files opened by :func:`open_input`."""
+
+
+class tmp_throttle():
+    """A context manager to temporarily set :data:`input_throttle`.
+    """
+    def __init__(self, throttle):
+        self.save_throttle = None
+        self.throttle = throttle
+    def __enter__(self):
+        global input_throttle
+        self.save_throttle = input_throttle
+        input_throttle = self.throttle
+    def __exit__(self, type, value, tb):
+        global input_throttle
+        input_throttle = self.save_throttle
+
+
+class _InputFile(io.FileIO):
+    """A FileIO for reading a file once, sequentially.
+
+    Try to avoid updating the access time of the file, advise the
+    kernel on the access pattern, and drop the file from the page
+    cache when it is closed, unless drop_cache is false.
+    """
+
+    def __init__(self, path, drop_cache=True):
+        flags = os.O_RDONLY | getattr(os, "O_CLOEXEC", 0)
+        noatime = getattr(os, "O_NOATIME", 0)
+        try:
+            fd = os.open(path, flags | noatime)
+        except PermissionError:
+            if not noatime:
+                raise
+            # O_NOATIME is only permitted to the owner of the file.
+            fd = os.open(path, flags)
+        try:
+            super().__init__(fd, "rb")
+        except:
+            os.close(fd)
+            raise
+        self.name = path
+        self.drop_cache = drop_cache
+        self._fadvise("POSIX_FADV_SEQUENTIAL")
+
+    def _fadvise(self, advice):
+        if hasattr(os, "posix_fadvise"):
+            try:
+                os.posix_fadvise(self.fileno(), 0, 0, getattr(os, advice))
+            except OSError:
+                pass
+
+    def close(self):
+        if not self.closed and self.drop_cache:
+            self._fadvise("POSIX_FADV_DONTNEED")
+        super().close()
+
+
+class _ThrottledInput(io.RawIOBase):
+    """Wrap a raw file, delaying the reads as required by a throttle.
+    """
+
+    def __init__(self, raw, throttle):
+        self.raw = raw
+        self.throttle = throttle
+        self.name = raw.name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.raw.seekable()
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        return self.raw.seek(pos, whence)
+
+    def tell(self):
+        return self.raw.tell()
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def readinto(self, b):
+        n = self.raw.readinto(b)
+        self.throttle(n or 0)
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
+
+def open_input(path, drop_cache=True):
+    """Open a file for reading its content once, sequentially.
+
+    Avoid updating the access time of the file and trashing the page
+    cache where possible.  drop_cache should be false if the file is
+    going to be read again soon, such as for calculating the checksum
+    before adding it to an archive.  The reads are throttled if
+    :data:`input_throttle` is set.  Note that the file is not
+    considered a plain file by :func:`is_plain_file` in this case, as
+    the data must not be copied in the kernel behind the throttle's
+    back.
+    """
+    raw = _InputFile(os.fspath(path), drop_cache)
+    if input_throttle is not None:
+        try:
+            input_throttle(0)
+            raw = _ThrottledInput(raw, input_throttle)
+        except:
+            raw.close()
+            raise
+    return io.BufferedReader(raw)
 
 
 mode_ft = {
@@ -0,0 +1,419 @@
+"""Provide the VolumeSet class to split archives into volumes.
+"""
+
+import concurrent.futures
+import copy
+import itertools
+import os
+from pathlib import Path
+import re
+import tarfile
+from archive.archive import Archive, DedupMode, compression_map
+from archive.exception import ArchiveCreateError, ArchiveReadError
+from archive.manifest import FileInfo, Manifest, ReadOrder
+from archive.tools import now_str, tmp_chdir
+
+
+def volume_path(path, index, count):
+    """Return the path of volume number index out of count volumes.
+
+    The volume number is inserted before the suffix of path,
+    e.g. `backup.tar.gz` becomes `backup.vol001.tar.gz`.
+    """
+    name = path.name
+    for suffix in sorted(compression_map.keys(), key=len, reverse=True):
+        if name.endswith(suffix):
+            stem = name[:-len(suffix)]
+            break
+    else:
+        stem, suffix = name, ""
+    width = max(3, len(str(count)))
+    return path.with_name("%s.vol%0*d%s" % (stem, width, index, suffix))
+
+def volume_paths(path, count):
+    """Return the paths of all volumes in the set having the volume
+    path.  Return :const:`None` if path is not named like a volume.
+    """
+    m = re.fullmatch(r"(.*)\.vol(\d+)(.*)", path.name)
+    if not m:
+        return None
+    stem, num, suffix = m.groups()
+    width = len(num)
+    return [ path.with_name("%s.vol%0*d%s" % (stem, width, i, suffix))
+             for i in range(1, count+1) ]
+
+def parse_volume_tags(tags):
+    """Return the volume number, the number of volumes and the name of
+    the volume set from the tags of a volume.  Return (None, None,
+    None) if the tags do not mark a volume.
+    """
+    volume = count = volset = None
+    for t in tags:
+        k, _, v = t.partition(':')
+        if k == 'volume':
+            try:
+                volume, count = (int(n) for n in v.split('/'))
+            except ValueError:
+                pass
+        elif k == 'volset':
+            volset = v
+    if volume is None or volset is None:
+        return (None, None, None)
+    return (volume, count, volset)
+
+def _item_size(fi):
+    """Estimate the space an item takes in an uncompressed archive,
+    including its entry in the manifest.
+    """
+    size = tarfile.BLOCKSIZE
+    if len(str(fi.path)) > 100:
+        # Need a pax header for the long name.
+        size += 2*tarfile.BLOCKSIZE
+    if fi.is_file() and not fi.ref and fi.chunks is None:
+        blocks, remainder = divmod(fi.size, tarfile.BLOCKSIZE)
+        size += (blocks + (remainder > 0)) * tarfile.BLOCKSIZE
+        size += 256 + 2*len(str(fi.path))
+    return size
+
+
+class _Volume(Archive):
+    """One volume in a set.
+
+    Force the date in the manifest to be the same for all volumes.
+    """
+
+    def __init__(self, date):
+        super().__init__()
+        self._date = date
+
+    def _create(self, mode):
+        self.manifest.head['Date'] = self._date
+        super()._create(mode)
+
+
+def _create_shard(date, path, compression, fileinfos, **kwargs):
+    """Create one shard of a volume set.
+
+    This is run in a worker process.  Return the base directory and
+    the manifest of the shard.
+    """
+    v = _Volume(date).create(path, compression, fileinfos=fileinfos, **kwargs)
+    return (v.basedir, v.manifest)
+
+
+class VolumeSet:
+    """A set of archives that together hold the content of one
+    logical archive.
+
+    Each volume is a complete archive on its own, having a manifest
+    with the subset of the items in this volume.  The volumes are
+    marked with the tags `volume:<n>/<count>` and `volset:<name>`.
+    """
+
+    Workers = os.cpu_count() or 1
+    """Maximum number of volumes to be written or verified
+    concurrently.
+    """
+
+    def __init__(self):
+        self.volumes = []
+        self.manifest = None
+
+    @property
+    def path(self):
+        """The path of the first volume."""
+        return self.volumes[0].path if self.volumes else None
+
+    @property
+    def paths(self):
+        """The paths of all volumes."""
+        return [ v.path for v in self.volumes ]
+
+    @property
+    def basedir(self):
+        return self.volumes[0].basedir if self.volumes else None
+
+    def create(self, path, compression=None, paths=None, fileinfos=None,
+               basedir=None, workdir=None, excludes=None,
+               dedup=DedupMode.LINK, tags=None, sortbuffer=None,
+               checksums=None, readorder=ReadOrder.PATH, volumesize=None,
+               shards=None, resolve=None, deleted=None, recursive=True):
+        """Create the volume set.
+
+        The arguments are the same as for :meth:`Archive.create`.
+        path is the name of the set, the path of each volume is
+        derived from it using :func:`volume_path`.  Exactly one of
+        volumesize or shards must be given.
+
+        With volumesize, the items are distributed to the volumes in
+        path order, such that the uncompressed size of each volume
+        does not exceed volumesize.  A file that is larger then
+        volumesize gets a volume on its own.  The volumes are written
+        concurrently.
+
+        With shards, the items are distributed in path order to at
+        most that many volumes of about the same size.  Each volume
+        is written in a separate worker process, including the
+        calculation of the checksums.  The list of all items is held
+        in memory in this case, sortbuffer is ignored.
+
+        The deleted items are recorded in the manifest of the first
+        volume.
+        """
+        if (volumesize is None) == (shards is None):
+            raise TypeError("Either volumesize or shards must be provided")
+        if volumesize is not None and volumesize <= 0:
+            raise ValueError("volumesize must be positive")
+        if shards is not None and shards <= 0:
+            raise ValueError("shards must be positive")
+        workdir = Path(workdir or os.curdir).resolve()
+        with tmp_chdir(workdir):
+            path = path.resolve()
+            if shards:
+                # Do not calculate the checksums here, this is left
+                # to the worker processes.
+                if checksums is None:
+                    checksums = FileInfo.Checksums
+                checksums = list(checksums)
+                if fileinfos is None:
+                    if not paths:
+                        raise ArchiveCreateError("refusing to create an "
+                                                 "empty archive")
+                    fileinfos = FileInfo.iterpaths(paths, excludes,
+                                                   checksums, recursive)
+                manifest = sorted(fileinfos, key=lambda fi: fi.path)
+                bounds = self._partition_shards(manifest, shards)
+                date = now_str()
+            else:
+                try:
+                    if fileinfos is not None:
+                        manifest = Manifest(fileinfos=fileinfos,
+                                            sortbuffer=sortbuffer,
+                                            checksums=checksums,
+                                            readorder=readorder)
+                    else:
+                        if not paths:
+                            raise ArchiveCreateError("refusing to create an "
+                                                     "empty archive")
+                        manifest = Manifest(paths=paths, excludes=excludes,
+                                            sortbuffer=sortbuffer,
+                                            checksums=checksums,
+                                            readorder=readorder,
+                                            recursive=recursive,
+                                            hashworkers=Manifest.HashWorkers)
+                except ValueError as e:
+                    raise ArchiveCreateError(str(e))
+                bounds = self._partition(manifest, volumesize)
+                date = manifest.head['Date']
+                checksums = manifest.checksums
+            count = len(bounds)
+            if not count:
+                raise ArchiveCreateError("refusing to create an "
+                                         "empty archive")
+            name = path.name.split('.')[0]
+            if basedir is None and manifest[0].path.is_absolute():
+                basedir = Path(name)
+            it = iter(manifest)
+            def volume_args(index):
+                voltags = list(tags or ()) + [
+                    "volume:%d/%d" % (index, count),
+                    "volset:%s" % name,
+                ]
+                kwargs = dict(basedir=basedir, dedup=dedup, tags=voltags,
+                              checksums=checksums, readorder=readorder,
+                              resolve=resolve)
+                if index == 1 and deleted is not None:
+                    kwargs['deleted'] = list(deleted)
+                return kwargs
+            if shards:
+                def submit(executor, index, chunk):
+                    p = volume_path(path, index, count)
+                    return executor.submit(_create_shard, date, p,
+                                           compression, chunk,
+                                           workdir=workdir,
+                                           **volume_args(index))
+                def result(index, f):
+                    v = _Volume(date)
+                    v.path = volume_path(path, index, count)
+                    v.basedir, v.manifest = f.result()
+                    return v
+                workers = min(shards, count)
+                executor = concurrent.futures.ProcessPoolExecutor(workers)
+            else:
+                def submit(executor, index, chunk):
+                    p = volume_path(path, index, count)
+                    return executor.submit(_Volume(date).create, p,
+                                           compression, fileinfos=chunk,
+                                           **volume_args(index))
+                def result(index, f):
+                    return f.result()
+                workers = min(self.Workers, count)
+                executor = concurrent.futures.ThreadPoolExecutor(workers)
+            submitted = []
+            try:
+                with executor:
+                    # Only take the items of at most twice as many
+                    # volumes as we have workers into memory at a time.
+                    pending = []
+                    volumes = []
+                    try:
+                        for index, n in enumerate(bounds, start=1):
+                            chunk = list(itertools.islice(it, n))
+                            f = submit(executor, index, chunk)
+                            submitted.append((index, f))
+                            pending.append((index, f))
+                            if len(pending) >= 2*workers:
+                                volumes.append(result(*pending.pop(0)))
+                        for p in pending:
+                            volumes.append(result(*p))
+                    finally:
+                        for _, f in pending:
+                            f.cancel()
+            except BaseException:
+                self._remove_volumes(path, count, submitted)
+                raise
+        self.volumes = volumes
+        self.manifest = self._merge_manifests()
+        return self
+
+    @staticmethod
+    def _remove_volumes(path, count, submitted):
+        """Remove the volumes written so far after an error.  submitted
+        is a list of the volume numbers and the futures having created
+        the volumes, all of them must be done.
+        """
+        for index, f in submitted:
+            if f.cancelled():
+                continue
+            if isinstance(f.exception(), FileExistsError):
+                # Not ours.
+                continue
+            try:
+                volume_path(path, index, count).unlink()
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _partition(manifest, volumesize):
+        """Return the number of items in each volume.
+        """
+        bounds = []
+        n = 0
+        size = 0
+        # Leave some room for the head of the manifest, the end of
+        # archive marker and the padding to the record size.
+        volumesize -= tarfile.RECORDSIZE + 4*tarfile.BLOCKSIZE
+        for fi in manifest:
+            s = _item_size(fi)
+            if n and size + s > volumesize:
+                bounds.append(n)
+                n = 0
+                size = 0
+            n += 1
+            size += s
+        if n:
+            bounds.append(n)
+        return bounds
+
+    @staticmethod
+    def _partition_shards(fileinfos, shards):
+        """Return the number of items in each shard.
+
+        Each item goes to the shard in which the middle of its
+        estimated size falls, if the items were laid out one after
+        the other and cut into pieces of equal size.
+        """
+        sizes = [ _item_size(fi) for fi in fileinfos ]
+        total = sum(sizes)
+        bounds = [0] * shards
+        pos = 0
+        for s in sizes:
+            k = min(int((pos + s/2) * shards / total), shards - 1)
+            bounds[k] += 1
+            pos += s
+        return [ n for n in bounds if n ]
+
+    def open(self, paths):
+        """Open the volumes of a set for reading.
+
+        paths must include all volumes of the set, in any order.
+        """
+        volumes = []
+        try:
+            for p in paths:
+                volumes.append(Archive().open(p))
+            info = [ parse_volume_tags(v.manifest.tags) for v in volumes ]
+            if not volumes or any(i[0] is None for i in info):
+                raise ArchiveReadError("not a volume set")
+            names = { i[2] for i in info }
+            if len(names) > 1:
+                raise ArchiveReadError("volumes from different sets: %s"
+                                       % ", ".join(sorted(names)))
+            count = info[0][1]
+            numbers = sorted(i[0] for i in info)
+            if numbers != list(range(1, count+1)):
+                raise ArchiveReadError("incomplete volume set %s"
+                                       % info[0][2])
+        except:
+            for v in volumes:
+                v.close()
+            raise
+        order = sorted(range(len(volumes)), key=lambda k: info[k][0])
+        self.volumes = [ volumes[k] for k in order ]
+        self.manifest = self._merge_manifests()
+        return self
+
+    def _merge_manifests(self):
+        """Return a manifest having the items of all volumes.
+        """
+        manifest = copy.copy(self.volumes[0].manifest)
+        manifest.head = copy.deepcopy(manifest.head)
+        manifest.head['Tags'] = [
+            t for t in manifest.tags
+            if t.partition(':')[0] not in ('volume', 'volset')
+        ]
+        manifest.sortbuffer = None
+        manifest.fileinfos = list(itertools.chain.from_iterable(
+            v.manifest for v in self.volumes
+        ))
+        return manifest
+
+    def verify(self):
+        """Verify all volumes concurrently.
+        """
+        workers = min(self.Workers, len(self.volumes))
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for f in [ executor.submit(v.verify) for v in self.volumes ]:
+                f.result()
+
+    def _content_member(self, path):
+        for v in self.volumes:
+            try:
+                return v._content_member(path)
+            except ArchiveReadError:
+                pass
+        raise ArchiveReadError("%s:%s: not found" % (self.path, path))
+
+    def extract_file(self, fi, target, resolve=None):
+        for v in self.volumes:
+            if v.manifest.find(fi.path) is not None:
+                return v.extract_file(fi, target, resolve)
+        raise ArchiveReadError("%s:%s: not found" % (self.path, fi.path))
+
+    def extract(self, targetdir, inclmeta=False, resolve=None):
+        # Extract the volumes in reverse order.  The directories
+        # precede their content in path order, so this ensures that
+        # the attributes of a directory are set after all of its
+        # content has been written.
+        for v in reversed(self.volumes):
+            v.extract(targetdir, inclmeta=inclmeta, resolve=resolve)
+
+    def close(self):
+        for v in self.volumes:
+            v.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
@@ -0,0 +1,67 @@
+#! /usr/bin/python3
+"""Benchmark the calculation of checksums in archive-tools.
+
+Write a file with random data and compare the throughput of
+:func:`archive.tools.checksum` with the raw speed of hashlib hashing
+the data from memory as well as with a naive reading loop using small
+chunks.
+"""
+
+import argparse
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+import time
+from archive.tools import checksum
+
+
+def naive_checksum(fileobj, hashalg):
+    m = { h:hashlib.new(h) for h in hashalg }
+    while True:
+        chunk = fileobj.read(8192)
+        if not chunk:
+            break
+        for h in hashalg:
+            m[h].update(chunk)
+    return { h: m[h].hexdigest() for h in hashalg }
+
+def raw_checksum(data, hashalg):
+    return { h: hashlib.new(h, data).hexdigest() for h in hashalg }
+
+def bench(name, func, size):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print("%-12s %8.1f MB/s" % (name, size / elapsed / 1e6))
+    return result
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument('--size', type=int, default=256,
+                           help=("size of the test file in MiB"))
+    argparser.add_argument('--dir', type=Path,
+                           help=("directory to create the test file in"))
+    argparser.add_argument('hashalg', nargs='*', default=['sha256'],
+                           help=("hash algorithms"))
+    args = argparser.parse_args()
+
+    args.hashalg = list(dict.fromkeys(args.hashalg))
+    size = args.size * 1024 * 1024
+    data = os.urandom(size)
+    with tempfile.NamedTemporaryFile(dir=args.dir) as tmpf:
+        tmpf.write(data)
+        tmpf.flush()
+        print("hash algorithms: %s" % ", ".join(args.hashalg))
+        cs_raw = bench("hashlib", lambda: raw_checksum(data, args.hashalg),
+                       size)
+        with open(tmpf.name, "rb") as f:
+            cs_naive = bench("naive", lambda: naive_checksum(f, args.hashalg),
+                             size)
+        with open(tmpf.name, "rb") as f:
+            cs = bench("checksum", lambda: checksum(f, args.hashalg), size)
+        assert cs == cs_raw == cs_naive
+
+
+if __name__ == "__main__":
+    main()
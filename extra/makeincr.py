@@ -7,21 +7,30 @@ input archive that are not present in any of the basis archives.
 """
 
 import argparse
+import copy
 from pathlib import Path
 import tarfile
 from archive.archive import Archive
+from archive.exception import ArchiveReadError
 from archive.manifest import DiffStatus, _common_checksum, diff_manifest
+from archive.tools import is_plain_file
 
 
 class CopyArchive(Archive):
     """Read items from a TarFile.
 
     An Archive that copies all items from another Archive rather then
-    reading them from the file system on create().
+    reading them from the file system on create().  The input archive
+    is read in one pass, in the order of its members, which is the
+    order of its manifest.  If the input archive is not compressed,
+    the members are copied raw, without going through extractfile().
     """
 
     def __init__(self, inp_arch):
         self.inp_arch = inp_arch
+        self._inp_members = None
+        self._inp_regular = None
+        self._inp_raw = None
         super().__init__()
 
     def _create(self, mode):
@@ -37,28 +46,74 @@ class CopyArchive(Archive):
                     tags.append(t)
         if tags:
             self.manifest.head['Tags'] = tags
-        super()._create(mode)
+        inp_tarf = self.inp_arch._file
+        self._inp_members = iter(inp_tarf)
+        self._inp_regular = {}
+        try:
+            if is_plain_file(inp_tarf.fileobj):
+                # Use a file object of our own, so as not to disturb
+                # the position of the input tar file.
+                self._inp_raw = open(self.inp_arch.path, "rb")
+            super()._create(mode)
+        finally:
+            if self._inp_raw:
+                self._inp_raw.close()
+                self._inp_raw = None
+
+    def _read_key(self, fi):
+        # The content is taken from the input archive, not from the
+        # file system, there is nothing to read ahead.
+        return None
+
+    def _next_member(self, fi):
+        """Skip ahead in the input archive to the member for fi.
+        """
+        name = self.inp_arch._arcname(fi.path)
+        for ti in self._inp_members:
+            if ti.isreg():
+                # Keep the possible targets of hard links.
+                self._inp_regular[ti.name] = ti
+            if ti.name == name:
+                return ti
+        raise ArchiveReadError("%s: %s not found in the input archive"
+                               % (self.inp_arch.path, fi.path))
 
-    def _add_item(self, tarf, fi, arcname):
+    def _add_item(self, tarf, fi, arcname, data=None):
         inp_tarf = self.inp_arch._file
-        inp_arcname = self.inp_arch._arcname(fi.path)
-        ti = inp_tarf.getmember(inp_arcname)
+        ti = self._next_member(fi)
+        raw = self._inp_raw
         if fi.is_file():
             dup = self._check_duplicate(ti, arcname)
+            out = copy.copy(ti)
+            out.name = arcname
             if dup:
-                ti.type = tarfile.LNKTYPE
-                ti.linkname = dup
-                ti.name = arcname
-                tarf.addfile(ti)
+                out.type = tarfile.LNKTYPE
+                out.linkname = dup
+                out.size = 0
+                tarf.addfile(out)
+                return
+            src = self._inp_regular[ti.linkname] if ti.islnk() else ti
+            if src is ti and raw and ti.name == arcname and ti.sparse is None:
+                tarf.addraw(ti, raw)
+                return
+            out.type = tarfile.REGTYPE
+            out.linkname = ''
+            out.size = src.size
+            out.sparse = src.sparse
+            if raw and src.sparse is None:
+                raw.seek(src.offset_data)
+                tarf.addfile(out, fileobj=raw)
             else:
-                with inp_tarf.extractfile(ti) as f:
-                    ti.type = tarfile.REGTYPE
-                    ti.linkname = ''
-                    ti.name = arcname
-                    tarf.addfile(ti, fileobj=f)
+                # A hard link to a member that has not been copied
+                # requires seeking back in a compressed input.
+                with inp_tarf.extractfile(src) as f:
+                    tarf.addfile(out, fileobj=f)
+        elif raw and ti.name == arcname:
+            tarf.addraw(ti, raw)
         else:
-            ti.name = arcname
-            tarf.addfile(ti)
+            out = copy.copy(ti)
+            out.name = arcname
+            tarf.addfile(out)
 
     def _check_duplicate(self, ti, name):
         if ti.islnk() and ti.linkname in self._dupindex:
@@ -94,7 +149,9 @@ def main():
         with Archive().open(p) as base:
             fileinfos = filter_fileinfos(base.manifest, fileinfos, algorithm)
 
-    archive = CopyArchive(inp_archive).create(args.output, fileinfos=fileinfos)
+    checksums = inp_archive.manifest.checksums
+    archive = CopyArchive(inp_archive).create(args.output, fileinfos=fileinfos,
+                                              checksums=checksums)
 
 
 if __name__ == "__main__":
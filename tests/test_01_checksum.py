@@ -0,0 +1,145 @@
+"""Test archive.tools.checksum().
+"""
+
+import hashlib
+import io
+from random import getrandbits
+import pytest
+import archive.tools
+from archive.tools import TreeHash, checksum
+from conftest import *
+
+
+sizes = [0, 1000, 100000, 300000]
+
+@pytest.fixture(scope="module")
+def test_files(tmpdir):
+    files = {}
+    for size in sizes:
+        path = tmpdir / ("rnd-%d.dat" % size)
+        data = bytes(getrandbits(8) for _ in range(size))
+        path.write_bytes(data)
+        files[size] = (path, data)
+    return files
+
+@pytest.fixture(params=["default", "small-thresholds"])
+def thresholds(request, monkeypatch):
+    # Lower the thresholds, so that all the code paths are exercised
+    # with our moderately sized test files.
+    if request.param == "small-thresholds":
+        monkeypatch.setattr(archive.tools, "_chunksize", 4096)
+        monkeypatch.setattr(archive.tools, "_buffers",
+                            archive.tools.threading.local())
+        monkeypatch.setattr(archive.tools, "_concurrent_min_size", 8192)
+        monkeypatch.setattr(TreeHash, "LeafSize", 10000)
+        monkeypatch.setattr(TreeHash, "Workers", 3)
+    return request.param
+
+def _tree_hash(algorithm, data, leafsize):
+    leaves = []
+    for i in range(0, max(len(data), 1), leafsize):
+        leaves.append(hashlib.new(algorithm, b'\x00' + data[i:i+leafsize]))
+    root = hashlib.new(algorithm, b'\x01')
+    for l in leaves:
+        root.update(l.digest())
+    return root.hexdigest()
+
+def _expected(data, hashalg):
+    cs = {}
+    for h in hashalg:
+        if h.startswith("tree-"):
+            cs[h] = _tree_hash(h[5:], data, TreeHash.LeafSize)
+        else:
+            cs[h] = hashlib.new(h, data).hexdigest()
+    return cs
+
+@pytest.mark.parametrize("size", sizes)
+@pytest.mark.parametrize("hashalg", [
+    ["sha256"],
+    ["sha256", "md5"],
+    ["sha512", "sha1", "blake2b"],
+    ["tree-sha256"],
+    ["sha256", "tree-blake2b"],
+])
+def test_checksum_file(test_files, thresholds, size, hashalg):
+    """Calculate checksums of regular files.
+    """
+    path, data = test_files[size]
+    with path.open("rb") as f:
+        assert checksum(f, hashalg) == _expected(data, hashalg)
+        # The file has been read to the end.
+        assert f.read() == b""
+
+@pytest.mark.parametrize("hashalg", [["sha256"], ["sha256", "md5"]])
+def test_checksum_file_offset(test_files, thresholds, hashalg):
+    """Calculate checksums of the remainder of a file.
+    """
+    path, data = test_files[300000]
+    with path.open("rb") as f:
+        f.seek(1234)
+        assert checksum(f, hashalg) == _expected(data[1234:], hashalg)
+
+@pytest.mark.parametrize("hashalg", [
+    ["sha256"],
+    ["sha256", "md5"],
+    ["tree-sha256", "md5"],
+])
+def test_checksum_fileobj(test_files, thresholds, hashalg):
+    """Calculate checksums of file objects that are not regular files.
+    """
+    path, data = test_files[300000]
+    assert checksum(io.BytesIO(data), hashalg) == _expected(data, hashalg)
+    with path.open("rb", buffering=0) as f:
+        assert checksum(f, hashalg) == _expected(data, hashalg)
+
+class ReadOnly:
+    """A file object only providing read().
+    """
+    def __init__(self, data):
+        self._f = io.BytesIO(data)
+    def read(self, size=-1):
+        return self._f.read(size)
+
+@pytest.mark.parametrize("hashalg", [["sha256"], ["sha256", "md5"]])
+def test_checksum_read_only(test_files, thresholds, hashalg):
+    """Calculate checksums of file objects only having read().
+    """
+    path, data = test_files[300000]
+    assert checksum(ReadOnly(data), hashalg) == _expected(data, hashalg)
+
+def test_checksum_empty_hashalg(test_files):
+    path, data = test_files[1000]
+    with path.open("rb") as f:
+        assert checksum(f, []) == {}
+
+@pytest.mark.parametrize("chunksize", [1, 999, 10000, 10001, 65536])
+def test_tree_hash_update(test_files, monkeypatch, chunksize):
+    """The tree hash does not depend on how the data is fed in.
+    """
+    monkeypatch.setattr(TreeHash, "LeafSize", 10000)
+    path, data = test_files[100000]
+    h = TreeHash("tree-sha256")
+    for i in range(0, len(data), chunksize):
+        h.update(data[i:i+chunksize])
+    assert h.hexdigest() == _tree_hash("sha256", data, 10000)
+    assert h.digest_size == hashlib.sha256().digest_size
+
+@pytest.mark.parametrize("zeros", [0, 999, 10000, 25000])
+def test_tree_hash_update_zeros(test_files, monkeypatch, zeros):
+    """Feeding zeros with update_zeros() gives the same hash as
+    feeding them as data.
+    """
+    monkeypatch.setattr(TreeHash, "LeafSize", 10000)
+    path, data = test_files[1000]
+    h = TreeHash("tree-sha256")
+    h.update(data)
+    h.update_zeros(zeros)
+    h.update(data)
+    expected = data + bytes(zeros) + data
+    assert h.hexdigest() == _tree_hash("sha256", expected, 10000)
+
+def test_tree_hash_invalid():
+    with pytest.raises(ValueError):
+        TreeHash("tree-no-such-hash")
+    with pytest.raises(ValueError):
+        TreeHash("sha256")
@@ -0,0 +1,92 @@
+"""Test content defined chunking and the chunk store.
+"""
+
+import io
+from random import Random
+import pytest
+import archive.chunks
+from archive.chunks import ChunkStore, iter_chunks
+from archive.exception import ArchiveIntegrityError
+
+
+_random = Random(1103)
+
+def randbytes(n):
+    return bytes(_random.getrandbits(8) for _ in range(n))
+
+chunk_args = dict(minsize=1024, avgsize=4096, maxsize=16384)
+data = randbytes(200000)
+
+def test_chunks_boundaries():
+    chunks = list(iter_chunks(io.BytesIO(data), **chunk_args))
+    assert b"".join(chunks) == data
+    assert all(len(c) <= 16384 for c in chunks)
+    assert all(len(c) >= 1024 for c in chunks[:-1])
+    assert len(chunks) > 10
+
+def test_chunks_insert():
+    """Inserting data only changes the chunks around the insertion.
+    """
+    chunks = list(iter_chunks(io.BytesIO(data), **chunk_args))
+    modified = data[:100000] + b"inserted" + data[100000:]
+    chunks2 = list(iter_chunks(io.BytesIO(modified), **chunk_args))
+    assert b"".join(chunks2) == modified
+    assert len(set(chunks) - set(chunks2)) <= 2
+
+def test_chunks_cut_point_numpy(monkeypatch):
+    """Finding the cut points with numpy yields the same chunks.
+    """
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(archive.chunks, "_cut_block", 1000)
+    chunks = []
+    for f in (archive.chunks._cut_point_py, archive.chunks._cut_point_numpy):
+        monkeypatch.setattr(archive.chunks, "_cut_point", f)
+        chunks.append(list(iter_chunks(io.BytesIO(data), **chunk_args)))
+    assert chunks[0] == chunks[1]
+
+def test_chunks_empty():
+    assert list(iter_chunks(io.BytesIO(b""))) == []
+
+def test_chunk_store(tmpdir):
+    path = tmpdir / "store"
+    with ChunkStore(path) as store:
+        cids = store.add_file(io.BytesIO(data))
+        assert len(store) == len(set(cids))
+        assert b"".join(store.iter_read(cids)) == data
+    with ChunkStore(path) as store:
+        n = len(store)
+        assert all(c in store for c in cids)
+        assert store.add_file(io.BytesIO(data)) == cids
+        assert len(store) == n
+        assert b"".join(store.iter_read(cids)) == data
+    assert len(list((path / "packs").glob("*.pack"))) == 1
+
+def test_chunk_store_open_files(tmpdir, monkeypatch):
+    """Only a limited number of pack files is kept open for reading.
+    """
+    monkeypatch.setattr(ChunkStore, "PackSize", 20000)
+    monkeypatch.setattr(ChunkStore, "MaxOpenFiles", 2)
+    path = tmpdir / "store-open-files"
+    parts = [ data[i:i+40000] for i in range(0, len(data), 40000) ]
+    with ChunkStore(path) as store:
+        cids = [ store.add_file(io.BytesIO(p)) for p in parts ]
+    assert len(list((path / "packs").glob("*.pack"))) >= len(parts)
+    with ChunkStore(path) as store:
+        for i in range(2):
+            for p, c in zip(parts, cids):
+                assert b"".join(store.iter_read(c)) == p
+                assert len(store._files) <= 2
+
+def test_chunk_store_corrupt(tmpdir):
+    path = tmpdir / "store"
+    with ChunkStore(path) as store:
+        cids = store.add_file(io.BytesIO(data))
+    pack = next((path / "packs").glob("*.pack"))
+    with pack.open("r+b") as f:
+        f.seek(100)
+        f.write(b"garbage")
+    with ChunkStore(path) as store:
+        with pytest.raises(ArchiveIntegrityError):
+            list(store.iter_read(cids))
+        with pytest.raises(ArchiveIntegrityError):
+            store.read("00" * 32)
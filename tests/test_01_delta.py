@@ -0,0 +1,89 @@
+"""Test the binary delta encoding.
+"""
+
+import io
+from random import Random
+import pytest
+import archive.delta
+from archive.delta import Signature, block_size, delta, patch
+
+
+_random = Random(2907)
+
+def randbytes(n):
+    return bytes(_random.getrandbits(8) for _ in range(n))
+
+base_data = randbytes(200000)
+
+def modify_inplace(data):
+    data = bytearray(data)
+    data[5000:5040] = randbytes(40)
+    data[150000:150010] = randbytes(10)
+    return bytes(data)
+
+def insert_delete(data):
+    return data[:30000] + randbytes(777) + data[30000:90000] + data[91000:]
+
+def append(data):
+    return data + randbytes(5000)
+
+def truncate(data):
+    return data[:123456]
+
+def unrelated(data):
+    return randbytes(20000)
+
+def empty(data):
+    return b""
+
+def make_delta(base, new):
+    sig = Signature(io.BytesIO(base), block_size(len(base)))
+    d = io.BytesIO()
+    delta(sig, io.BytesIO(new), d)
+    return d.getvalue()
+
+def apply_delta(base, d):
+    out = io.BytesIO()
+    patch(io.BytesIO(base), io.BytesIO(d), out)
+    return out.getvalue()
+
+@pytest.mark.parametrize("modify", [
+    modify_inplace, insert_delete, append, truncate, unrelated, empty
+])
+def test_delta_roundtrip(modify):
+    new = modify(base_data)
+    d = make_delta(base_data, new)
+    assert apply_delta(base_data, d) == new
+
+@pytest.mark.parametrize("modify", [modify_inplace, insert_delete, truncate])
+def test_delta_small(modify):
+    """The delta of a slightly modified file is small.
+    """
+    d = make_delta(base_data, modify(base_data))
+    assert len(d) < 10*block_size(len(base_data))
+
+def test_delta_empty_base():
+    new = randbytes(3000)
+    assert apply_delta(b"", make_delta(b"", new)) == new
+
+def test_patch_invalid():
+    d = make_delta(base_data, modify_inplace(base_data))
+    with pytest.raises(ValueError):
+        apply_delta(base_data, b"garbage" + d)
+    with pytest.raises(ValueError):
+        apply_delta(base_data, d[:-1])
+    with pytest.raises(ValueError):
+        apply_delta(base_data[:1000], d)
+
+@pytest.mark.parametrize("modify", [
+    modify_inplace, insert_delete, append, truncate, unrelated
+])
+def test_delta_numpy(monkeypatch, modify):
+    """Scanning for matching blocks with numpy yields the same delta.
+    """
+    pytest.importorskip("numpy")
+    monkeypatch.setattr(archive.delta, "ScanWindow", 1000)
+    new = modify(base_data)
+    d = make_delta(base_data, new)
+    monkeypatch.setattr(archive.delta, "numpy", None)
+    assert make_delta(base_data, new) == d
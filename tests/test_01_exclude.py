@@ -0,0 +1,152 @@
+"""Test class archive.exclude.ExcludeRules.
+"""
+
+from pathlib import Path
+import re
+import pytest
+from archive.exclude import ExcludeRules
+from archive.manifest import FileInfo
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "build"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "data", "cache"), 0o750),
+    DataDir(Path("base", "src"), 0o755),
+    DataDir(Path("base", "src", "node_modules"), 0o755),
+    DataContentFile(Path("base", "build", "out.o"), b"obj\n", 0o644),
+    DataContentFile(Path("base", "data", "cache", "c.dat"), b"c\n", 0o600),
+    DataContentFile(Path("base", "data", "x.tmp"), b"tmp\n", 0o600),
+    DataRandomFile(Path("base", "data", "big.dat"), 0o600, size=4000),
+    DataContentFile(Path("base", "src", "cache"), b"file\n", 0o644),
+    DataContentFile(Path("base", "src", "main.c"), b"main\n", 0o644),
+    DataContentFile(Path("base", "src", "main.o"), b"obj\n", 0o644),
+    DataContentFile(Path("base", "src", "node_modules", "m.js"), b"m\n",
+                    0o644),
+    DataContentFile(Path("base", "src", ".archiveignore"),
+                    b"# build products\n*.o\n/node_modules\n\n", 0o644),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+def scan(excludes, paths=(Path("base"),)):
+    return { fi.path for fi in FileInfo.iterpaths(paths, excludes) }
+
+def all_paths(excluded=()):
+    return { d.path for d in testdata } - set(map(Path, excluded))
+
+@pytest.mark.parametrize("path, expected", [
+    ("base/x.tmp", True),
+    ("base/sub/x.tmp", True),
+    ("base/x.tmp.gz", False),
+    ("base/node_modules", True),
+    ("base/a/node_modules/x", False),
+    ("base/data/cache", True),
+    ("base/src/cache", True),
+    ("base/data/x", False),
+    ("base/build/out.o", True),
+    ("base/build/sub/out.o", False),
+    ("base/logs/2021/a.log", True),
+    ("base/logs/a.log", True),
+    ("base/logs/a.txt", False),
+    ("/base/x.log", False),
+])
+def test_match_path(path, expected):
+    """Match paths against glob patterns and regular expressions.
+    """
+    rules = ExcludeRules(patterns=["*.tmp", "node_modules", "base/*/cache",
+                                   "base/build/*.[!c]", "base/logs/**/*.log"])
+    assert rules.match_path(Path(path)) == expected
+
+def test_parse():
+    """Tell paths, patterns and regular expressions apart.
+    """
+    rules = ExcludeRules.parse(["/root/.cache", "*.tmp", "node_modules/",
+                                "/home/*/tmp", r"re:\.bak$"])
+    assert rules.paths == {Path("/root/.cache")}
+    assert rules.patterns == ["*.tmp", "node_modules/", "/home/*/tmp"]
+    assert rules.regexes == [r"\.bak$"]
+    assert rules.match_path(Path("/home/jdoe/tmp"))
+    assert rules.match_path(Path("/home/jdoe/x.bak"))
+    assert not rules.match_path(Path("/home/jdoe/x.bak/y"))
+    with pytest.raises(re.error):
+        ExcludeRules.parse(["re:("])
+
+def test_iterpaths_patterns(test_dir, monkeypatch):
+    """Exclude items by name, path, type, and size.  Excluded
+    directories are not descended.
+    """
+    monkeypatch.chdir(test_dir)
+    visited = []
+    iterdir = Path.iterdir
+    def mock_iterdir(self):
+        visited.append(self)
+        return iterdir(self)
+    monkeypatch.setattr(Path, "iterdir", mock_iterdir)
+    rules = ExcludeRules(patterns=["cache/", "base/build"],
+                         regexes=[r"\.tmp$"], maxsize=1000)
+    assert scan(rules) == all_paths([
+        "base/build", "base/build/out.o",
+        "base/data/cache", "base/data/cache/c.dat",
+        "base/data/x.tmp", "base/data/big.dat",
+    ])
+    assert Path("base", "build") not in visited
+    assert Path("base", "data", "cache") not in visited
+
+def test_iterpaths_ignorefile(test_dir, monkeypatch):
+    """Read patterns from ignore files, applying to the directory
+    containing the file only.
+    """
+    monkeypatch.chdir(test_dir)
+    rules = ExcludeRules(ignorefile=".archiveignore")
+    assert scan(rules) == all_paths([
+        "base/src/main.o",
+        "base/src/node_modules", "base/src/node_modules/m.js",
+    ])
+
+def test_iterpaths_onefs(test_dir, monkeypatch):
+    """Do not descend into directories on another file system.
+    """
+    monkeypatch.chdir(test_dir)
+    device = ExcludeRules.device
+    def mock_device(self, path):
+        if self.onefs and path == Path("base", "data"):
+            return -1
+        return device(self, path)
+    monkeypatch.setattr(ExcludeRules, "device", mock_device)
+    assert scan(ExcludeRules()) == all_paths()
+    rules = ExcludeRules(onefs=True)
+    assert scan(rules) == all_paths([
+        "base/data/cache", "base/data/cache/c.dat",
+        "base/data/x.tmp", "base/data/big.dat",
+    ])
+
+def test_iterpaths_not_recursive(test_dir, monkeypatch):
+    """Items in excluded directories are skipped also if not
+    descending directories.
+    """
+    monkeypatch.chdir(test_dir)
+    rules = ExcludeRules(patterns=["node_modules"])
+    paths = [ d.path for d in testdata ]
+    fileinfos = FileInfo.iterpaths(paths, rules, recursive=False)
+    assert { fi.path for fi in fileinfos } == all_paths([
+        "base/src/node_modules", "base/src/node_modules/m.js",
+    ])
+
+def test_rules_for(test_dir, monkeypatch):
+    """Get the rules to apply to a path found deeper in the tree.
+    """
+    monkeypatch.chdir(test_dir)
+    rules = ExcludeRules(patterns=["cache/"], ignorefile=".archiveignore")
+    base = Path("base")
+    assert rules.rules_for(base, base) is rules
+    assert rules.rules_for(base, Path("base", "data", "cache", "c.dat")) \
+        is None
+    src_rules = rules.rules_for(base, Path("base", "src", "main.o"))
+    assert src_rules.match_path(Path("base", "src", "main.o"))
+    assert not rules.match_path(Path("base", "src", "main.o"))
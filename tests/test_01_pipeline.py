@@ -0,0 +1,96 @@
+"""Test the helpers to run the stages of creating an archive concurrently.
+"""
+
+import io
+import threading
+import time
+import pytest
+from archive.tools import background, bounded_map, BackgroundWriter
+
+
+class SlowFile(io.RawIOBase):
+    """A file that takes some time to write and that may fail.
+    """
+    def __init__(self, fail_after=None):
+        self.data = bytearray()
+        self.fail_after = fail_after
+        self.threads = set()
+    def writable(self):
+        return True
+    def write(self, b):
+        self.threads.add(threading.get_ident())
+        time.sleep(0.001)
+        if self.fail_after is not None and len(self.data) >= self.fail_after:
+            raise OSError("disk full")
+        self.data += b
+        return len(b)
+
+
+def test_bounded_map():
+    def square(i):
+        time.sleep(0.001 * (i % 3))
+        return i*i
+    result = list(bounded_map(square, range(50), 4))
+    assert result == [(i, i*i) for i in range(50)]
+
+def test_bounded_map_error():
+    def check(i):
+        if i == 7:
+            raise ValueError("bad item %d" % i)
+        return i
+    items = []
+    with pytest.raises(ValueError, match="bad item 7"):
+        for i, _ in bounded_map(check, range(50), 3):
+            items.append(i)
+    assert items == list(range(7))
+
+def test_background():
+    main = threading.get_ident()
+    def produce():
+        for i in range(100):
+            yield i, threading.get_ident()
+    result = list(background(produce(), 5))
+    assert [i for i, _ in result] == list(range(100))
+    assert all(t != main for _, t in result)
+
+def test_background_error():
+    def produce():
+        yield from range(10)
+        raise ValueError("producer failed")
+    items = []
+    with pytest.raises(ValueError, match="producer failed"):
+        for i in background(produce(), 2):
+            items.append(i)
+    assert items == list(range(10))
+
+def test_background_abandon():
+    """Abandoning the consumer stops the producer thread.
+    """
+    produced = []
+    def produce():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+    it = background(produce(), 2)
+    assert next(it) == 0
+    it.close()
+    n = len(produced)
+    time.sleep(0.2)
+    assert len(produced) == n < 1000
+
+def test_background_writer():
+    f = SlowFile()
+    data = [bytes([i % 256]) * (i * 100) for i in range(50)]
+    with BackgroundWriter(f, bufsize=10000, queuesize=2) as w:
+        for d in data:
+            assert w.write(d) == len(d)
+        w.write(memoryview(b"end"))
+    assert f.data == b"".join(data) + b"end"
+    assert threading.get_ident() not in f.threads
+
+def test_background_writer_error():
+    f = SlowFile(fail_after=5000)
+    with pytest.raises(OSError, match="disk full"):
+        with BackgroundWriter(f, bufsize=1000, queuesize=2) as w:
+            for i in range(100):
+                w.write(b"x" * 1000)
@@ -0,0 +1,138 @@
+"""Test creating archives with different checksum algorithms.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from archive.archive import DedupMode
+from archive.exception import ArchiveCreateError, ArchiveReadError
+from archive.manifest import (DiffStatus, Manifest, _common_checksum,
+                              diff_manifest)
+from archive.tools import new_hash
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(Path("base", "data", "rnd.dat"), 0o600),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+def _check_checksums(manifest, hashalg, test_dir):
+    assert manifest.checksums == tuple(hashalg)
+    for fi in manifest:
+        if not fi.is_file():
+            continue
+        data = (test_dir / fi.path).read_bytes()
+        assert set(fi.checksum.keys()) == set(hashalg)
+        for h in hashalg:
+            m = new_hash(h)
+            m.update(data)
+            assert fi.checksum[h] == m.hexdigest()
+
+@pytest.mark.parametrize("hashalg", [
+    ["blake2b"],
+    ["sha256", "blake2b"],
+    ["sha512", "md5", "sha3_256"],
+    ["tree-sha256"],
+    ["sha256", "tree-blake2b"],
+])
+def test_create_checksums(test_dir, monkeypatch, hashalg):
+    """Create archives using different hash algorithms.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=hashalg))
+    Archive().create(archive_path, "", [Path("base")], checksums=hashalg)
+    with Archive().open(archive_path) as archive:
+        _check_checksums(archive.manifest, hashalg, test_dir)
+        archive.verify()
+
+def test_create_checksums_dedup(test_dir, monkeypatch):
+    """Deduplicate content using a non-default hash algorithm.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["blake2b", "dedup"]))
+    paths = [Path("base"), Path("base", "msg.txt")]
+    Archive().create(archive_path, "", paths, checksums=["blake2b"],
+                     dedup=DedupMode.CONTENT)
+    with Archive().open(archive_path) as archive:
+        archive.verify()
+
+@pytest.mark.parametrize("hashalg", ["no-such-hash", "shake_128",
+                                     "tree-shake_256"])
+def test_create_checksums_invalid(test_dir, monkeypatch, hashalg):
+    """Unsupported hash algorithms are rejected.  This includes those
+    having a variable digest length.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["invalid-checksum"]))
+    with pytest.raises(ArchiveCreateError) as err:
+        Archive().create(archive_path, "", [Path("base")],
+                         checksums=[hashalg])
+    assert hashalg in str(err.value)
+    assert not archive_path.exists()
+
+def test_diff_checksums(test_dir, monkeypatch):
+    """Compare archives having different sets of hash algorithms.
+    """
+    monkeypatch.chdir(test_dir)
+    manifests = {}
+    for hashalg in (["sha256"], ["blake2b", "sha256"], ["blake2b"]):
+        archive_path = Path(archive_name(tags=["diff"] + hashalg))
+        Archive().create(archive_path, "", [Path("base")], checksums=hashalg)
+        with Archive().open(archive_path) as archive:
+            manifests[tuple(hashalg)] = archive.manifest
+    m_sha256 = manifests["sha256",]
+    m_both = manifests["blake2b", "sha256"]
+    m_blake2b = manifests["blake2b",]
+    assert _common_checksum(m_both, m_sha256) == "sha256"
+    assert _common_checksum(m_both, m_blake2b) == "blake2b"
+    with pytest.raises(ArchiveReadError):
+        _common_checksum(m_sha256, m_blake2b)
+    for m_a, m_b in ((m_both, m_sha256), (m_blake2b, m_both)):
+        for status, fi_a, fi_b in diff_manifest(m_a, m_b):
+            assert status == DiffStatus.MATCH
+    with pytest.raises(ArchiveReadError):
+        list(diff_manifest(m_sha256, m_blake2b))
+    # Items taken from the file system calculate the algorithm missing.
+    m_fs = Manifest(paths=[Path("base")], checksums=["blake2b"])
+    for status, fi_a, fi_b in diff_manifest(m_sha256, m_fs):
+        assert status == DiffStatus.MATCH
+    m_fs = Manifest(paths=[Path("base")], checksums=["blake2b"])
+    for status, fi_a, fi_b in diff_manifest(m_fs, m_sha256):
+        assert status == DiffStatus.MATCH
+
+def test_cli_check_tree_hash(test_dir, monkeypatch):
+    """archive-tool check with an archive using a tree hash.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = archive_name(tags=["cli", "check", "tree"])
+    Archive().create(Path(archive_path), "", [Path("base")],
+                     checksums=["tree-sha256"])
+    with TemporaryFile(mode="w+t", dir=str(test_dir)) as f:
+        args = ["check", archive_path, "base"]
+        callscript("archive-tool.py", args, stdout=f)
+        f.seek(0)
+        assert list(get_output(f)) == []
+
+def test_cli_create_checksums(test_dir, monkeypatch):
+    """Set the hash algorithms using the --checksum argument.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = archive_name(tags=["cli", "checksums"])
+    args = ["create", "--checksum", "sha256", "--checksum", "blake2b",
+            archive_path, "base"]
+    callscript("archive-tool.py", args)
+    with Archive().open(Path(archive_path)) as archive:
+        _check_checksums(archive.manifest, ["sha256", "blake2b"], test_dir)
+        check_manifest(archive.manifest, testdata)
@@ -0,0 +1,83 @@
+"""Test archives storing the content of files in a chunk store.
+"""
+
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.chunks import ChunkStore
+from archive.exception import ArchiveIntegrityError, ArchiveReadError
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1633263300),
+    DataDir(Path("base", "data"), 0o750, mtime=1633263300),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataContentFile(Path("base", "empty.txt"), b"", 0o644,
+                    mtime=1547911753),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=30000,
+                   mtime=1626052455),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o640, size=5000,
+                   mtime=1626052455),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat"),
+                mtime=1626052455),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+@pytest.mark.parametrize("compression", ["", "gz"])
+def test_create_chunks(test_dir, monkeypatch, compression):
+    monkeypatch.chdir(test_dir)
+    name = archive_name(ext=compression, tags=["chunks"])
+    store_path = test_dir / ("chunks-%s" % (compression or "none"))
+    with ChunkStore(store_path) as store:
+        Archive().create(Path(name), compression, [Path("base")],
+                         chunkstore=store)
+        n = len(store)
+    with Archive().open(Path(name)) as archive:
+        assert archive.manifest.head["ChunkStore"] == store_path.name
+        check_manifest(archive.manifest, testdata)
+        fi = archive.manifest.find(Path("base", "data", "rnd1.dat"))
+        assert len(fi.chunks) == 1
+        assert archive.manifest.find(Path("base", "empty.txt")).chunks == []
+        names = archive._file.getnames()
+        assert "base/data" in names
+        assert "base/data/rnd1.dat" not in names
+        archive.verify()
+        targetdir = test_dir / ("extract-chunks-%s" % (compression or "none"))
+        archive.extract(targetdir)
+    for item in testdata:
+        target = targetdir / item.path
+        if item.type == 'f':
+            assert target.read_bytes() == (test_dir / item.path).read_bytes()
+            assert (target.stat().st_mode & 0o7777) == item.mode
+        if item.type != 'l':
+            assert int(target.stat().st_mtime) == item.mtime
+    # A second archive of the same content adds no new chunks.
+    with ChunkStore(store_path) as store:
+        Archive().create(Path("2" + name), compression, [Path("base")],
+                         chunkstore=store)
+        assert len(store) == n
+    with Archive().open(Path("2" + name)) as archive:
+        archive.verify()
+
+def test_chunks_errors(test_dir, monkeypatch):
+    monkeypatch.chdir(test_dir)
+    store_path = test_dir / "chunks-err"
+    with ChunkStore(store_path) as store:
+        Archive().create(Path("err-chunks.tar"), "", [Path("base")],
+                         chunkstore=store)
+    for pack in (store_path / "packs").glob("*.pack"):
+        data = bytearray(pack.read_bytes())
+        data[-100] ^= 0xff
+        pack.write_bytes(data)
+    with Archive().open(Path("err-chunks.tar")) as archive:
+        with pytest.raises(ArchiveIntegrityError):
+            archive.verify()
+    store_path.rename(test_dir / "chunks-moved")
+    with Archive().open(Path("err-chunks.tar")) as archive:
+        with pytest.raises(ArchiveReadError, match="chunk store"):
+            archive.verify()
@@ -0,0 +1,65 @@
+"""Test kernel side copying of data with uncompressed archives.
+"""
+
+import errno
+import os
+from pathlib import Path
+import pytest
+from archive import Archive
+import archive.tools
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=73251),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o600, size=512),
+    DataRandomFile(Path("base", "data", "empty.dat"), 0o600, size=0),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+def _unsupported(src_fd, offset, dst_fd, count):
+    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+def _partial(src_fd, offset, dst_fd, count):
+    # Copy at most a few bytes each time and give up after the first
+    # block, the caller needs to take care of the rest.
+    if offset >= 1000:
+        return 0
+    data = os.pread(src_fd, min(count, 100), offset)
+    return os.write(dst_fd, data)
+
+@pytest.mark.parametrize("methods", [
+    None,
+    [_unsupported],
+    [_unsupported, _partial],
+    [],
+])
+def test_create_copy_range(test_dir, monkeypatch, methods):
+    """Create an uncompressed archive and extract it again.
+    """
+    if methods is not None:
+        monkeypatch.setattr(archive.tools, "_copy_range_methods", methods)
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["copy-range"],
+                                     counter="create_copy_range"))
+    Archive().create(archive_path, "", [Path("base")])
+    with Archive().open(archive_path) as arch:
+        check_manifest(arch.manifest, testdata)
+        arch.verify()
+        targetdir = test_dir / archive_path.name.split('.')[0]
+        arch.extract(targetdir)
+    for item in testdata:
+        if item.type == 'f':
+            with (targetdir / item.path).open("rb") as f:
+                data = f.read()
+            assert data == (test_dir / item.path).read_bytes()
@@ -0,0 +1,97 @@
+"""Test storing modified files as a binary delta against a previous
+version in another archive.
+"""
+
+import os
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.exception import ArchiveIntegrityError, ArchiveReadError
+from archive.index import ArchiveIndex
+from archive.manifest import Manifest
+from archive.bt.create import (add_delta_bases, filter_fileinfos,
+                               index_delta_bases)
+from conftest import *
+
+
+big = Path("base", "data", "big.dat")
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1633263300),
+    DataDir(Path("base", "data"), 0o750, mtime=1633263300),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataRandomFile(big, 0o600, size=100000, mtime=1626052455),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+def create_incr(base, name, deltasize=50000):
+    bases = {}
+    index_delta_bases(base.manifest, base.path.name, bases, deltasize)
+    fileinfos = Manifest(paths=[Path("base")])
+    fileinfos = filter_fileinfos(base.manifest, fileinfos)
+    fileinfos = add_delta_bases(bases, fileinfos)
+    idx = ArchiveIndex()
+    idx.add_archives([base.path])
+    return Archive().create(Path(name), "", fileinfos=fileinfos,
+                            resolve=idx.open_archive), idx
+
+def test_delta(test_dir, monkeypatch):
+    monkeypatch.chdir(test_dir)
+    full = Archive().create(Path("full.tar.gz"), "", [Path("base")])
+    data = bytearray(big.read_bytes())
+    data[1000:1010] = b"0123456789"
+    big.write_bytes(data)
+    incr, idx = create_incr(full, "incr.tar")
+    fi = incr.manifest.find(big)
+    assert fi.delta['archive'] == "full.tar.gz"
+    assert fi.delta['path'] == str(big)
+    assert fi.delta['size'] < 10000
+    with Archive().open(Path("incr.tar")) as archive:
+        fi = archive.manifest.find(big)
+        assert fi.size == 100000
+        assert fi.delta['size'] < 10000
+        assert archive._file.getmember(str(big)).size == fi.delta['size']
+        archive.verify()
+        with pytest.raises(ArchiveReadError):
+            archive.extract(test_dir / "extract-nodelta")
+        targetdir = test_dir / "extract-delta"
+        archive.extract(targetdir, resolve=idx.open_archive)
+    target = targetdir / big
+    assert target.read_bytes() == data
+    assert (target.stat().st_mode & 0o7777) == 0o600
+
+def test_delta_not_smaller(test_dir, monkeypatch):
+    """A file that has been completely rewritten is stored in full.
+    """
+    monkeypatch.chdir(test_dir)
+    full = Archive().create(Path("full2.tar"), "", [Path("base")])
+    big.write_bytes(os.urandom(100000))
+    incr, idx = create_incr(full, "incr2.tar")
+    assert incr.manifest.find(big).delta is None
+    with Archive().open(Path("incr2.tar")) as archive:
+        archive.verify()
+        assert archive.manifest.find(big).delta is None
+        archive.extract(test_dir / "extract-full2")
+
+def test_delta_corrupt_base(test_dir, monkeypatch):
+    """Restoring from a wrong base version is detected.
+    """
+    monkeypatch.chdir(test_dir)
+    full = Archive().create(Path("full3.tar"), "", [Path("base")])
+    data = bytearray(big.read_bytes())
+    data[50000:50004] = b"abcd"
+    big.write_bytes(data)
+    incr, idx = create_incr(full, "incr3.tar")
+    assert incr.manifest.find(big).delta
+    # Replace the base archive with one having another version.
+    Path("full3.tar").unlink()
+    data[70000:70004] = b"efgh"
+    big.write_bytes(data)
+    Archive().create(Path("full3.tar"), "", [Path("base")])
+    with Archive().open(Path("incr3.tar")) as archive:
+        with pytest.raises(ArchiveIntegrityError):
+            archive.extract(test_dir / "extract-corrupt",
+                            resolve=idx.open_archive)
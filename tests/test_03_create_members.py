@@ -0,0 +1,90 @@
+"""Test adding members having their content from a file object or an
+iterable rather then from the file system.
+"""
+
+import hashlib
+import io
+import os
+from pathlib import Path
+import subprocess
+import sys
+import pytest
+from archive import Archive
+from archive.archive import DedupMode
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1565100853),
+    DataDir(Path("base", "data"), 0o750, mtime=1555271302),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataSymLink(Path("base", "s.dat"), Path("msg.txt"), mtime=1565100853),
+]
+
+class MemberData(DataContentFile):
+    """A member to be added with Archive.add_member().
+    """
+    def __init__(self, path, data, mode=0o644, mtime=1634000000):
+        super().__init__(path, data, mode, mtime=mtime)
+        self._checksum = hashlib.sha256(data).hexdigest()
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+@pytest.mark.parametrize("dedup", [DedupMode.LINK, DedupMode.CONTENT])
+def test_create_members(test_dir, monkeypatch, dedup):
+    """Add members from an iterable, a file object and the output of a
+    subprocess to the files from the file system.
+    """
+    monkeypatch.chdir(test_dir)
+    dump = b"".join(b"row %d\n" % i for i in range(20000))
+    members = [
+        MemberData(Path("base", "chunks.txt"), b"Hello world!\n"),
+        MemberData(Path("base", "data", "dump.sql"), dump, mode=0o600),
+        MemberData(Path("base", "empty.dat"), b""),
+        MemberData(Path("base", "sub.txt"), b"Hello world!\n"),
+    ]
+    archive_path = Path(archive_name(tags=["members", dedup.value]))
+    cmd = [sys.executable, "-c", "import sys; "
+           "sys.stdout.buffer.write(b'Hello world!\\n')"]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        archive = Archive()
+        archive.add_member(Path("base", "chunks.txt"),
+                           [b"Hello ", b"world", b"!\n"], mtime=1634000000)
+        archive.add_member(Path("base", "data", "dump.sql"),
+                           io.BytesIO(dump), mode=0o600, mtime=1634000000)
+        archive.add_member(Path("base", "empty.dat"), [], mtime=1634000000)
+        archive.add_member(Path("base", "sub.txt"), proc.stdout,
+                           mtime=1634000000)
+        archive.create(archive_path, "", [Path("base")], dedup=dedup)
+    with Archive().open(archive_path) as archive:
+        check_manifest(archive.manifest, testdata + members)
+        archive.verify()
+        for m in members:
+            fi = archive.manifest.find(m.path)
+            assert fi.uid == os.getuid()
+            member = archive._file.getmember(str(m.path))
+            if member.isreg():
+                data = archive._file.extractfile(member).read()
+                assert data == m.data
+
+def test_create_members_only(test_dir, monkeypatch):
+    """Create an archive from members only, written to a stream.
+    """
+    monkeypatch.chdir(test_dir)
+    members = [
+        MemberData(Path("dump", "a.sql"), b"a" * 100000),
+        MemberData(Path("dump", "b.sql"), b"b" * 100),
+    ]
+    archive_path = Path(archive_name(tags=["members", "stream"]))
+    with archive_path.open("wb") as f:
+        archive = Archive()
+        for m in members:
+            archive.add_member(m.path, io.BytesIO(m.data), mtime=m.mtime)
+        archive.create(None, "gz", fileobj=f)
+    with Archive().open(archive_path) as archive:
+        assert archive.basedir == Path("dump")
+        check_manifest(archive.manifest, members)
+        archive.verify()
@@ -0,0 +1,84 @@
+"""Test reading the content of files in a different order then path order.
+"""
+
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.manifest import Manifest, ReadOrder
+from archive.tools import physical_offset, reorder_map
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=73251),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o600, size=385),
+    DataRandomFile(Path("base", "data", "rnd3.dat"), 0o600, size=120000),
+    DataRandomFile(Path("base", "data", "rnd4.dat"), 0o600, size=20000),
+    DataRandomFile(Path("base", "data", "rnd5.dat"), 0o600, size=0),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+@pytest.fixture
+def small_window(monkeypatch):
+    monkeypatch.setattr(Manifest, "ReadWindow", 3)
+    monkeypatch.setattr(Archive, "ReadBufferSize", 100000)
+
+def test_reorder_map():
+    """reorder_map() calls func in key order, but yields in input order.
+    """
+    items = [5, 3, None, 4, 1, 2, 8, 7, None, 6]
+    calls = []
+    def func(i):
+        calls.append(i)
+        return 2*i
+    key = lambda i: None if i is None else -i
+    result = list(reorder_map(func, items, key, 4))
+    assert result == [(i, None if i is None else 2*i) for i in items]
+    assert calls == [5, 4, 3, 8, 7, 2, 1, 6]
+    calls = []
+    weight = lambda i: i
+    result = list(reorder_map(func, items, key, 10, 9, weight))
+    assert result == [(i, None if i is None else 2*i) for i in items]
+    assert calls == [5, 4, 3, 8, 2, 1, 7, 6]
+
+def test_physical_offset(test_dir):
+    """physical_offset() returns a non-negative int or None.
+    """
+    with (test_dir / "base" / "data" / "rnd1.dat").open("rb") as f:
+        offset = physical_offset(f.fileno())
+    assert offset is None or offset >= 0
+
+@pytest.mark.parametrize("sortbuffer", [None, 2])
+@pytest.mark.parametrize("compression", ["", "gz"])
+@pytest.mark.parametrize("readorder", list(ReadOrder))
+def test_create_readorder(test_dir, monkeypatch, small_window,
+                          readorder, compression, sortbuffer):
+    """Create an archive reading the files in readorder.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(ext=compression, tags=["readorder"],
+                                     counter="create_readorder"))
+    Archive().create(archive_path, compression, [Path("base")],
+                     sortbuffer=sortbuffer, readorder=readorder)
+    with Archive().open(archive_path) as arch:
+        check_manifest(arch.manifest, testdata)
+        arch.verify()
+        assert [ti.name for ti in arch._file.getmembers()][1:] == \
+            [str(fi.path) for fi in arch.manifest]
+        targetdir = test_dir / archive_path.name.split('.')[0]
+        arch.extract(targetdir)
+    for item in testdata:
+        if item.type == 'f':
+            assert ((targetdir / item.path).read_bytes() ==
+                    (test_dir / item.path).read_bytes())
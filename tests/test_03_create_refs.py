@@ -0,0 +1,70 @@
+"""Test items referring to the content in another archive.
+"""
+
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.exception import ArchiveReadError
+from archive.index import ArchiveIndex
+from archive.manifest import Manifest
+from archive.bt.create import add_content_refs, filter_fileinfos, index_content
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1633263300),
+    DataDir(Path("base", "data"), 0o750, mtime=1633263300),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=3000,
+                   mtime=1626052455),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o640, size=5000,
+                   mtime=1626052455),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+def test_refs(test_dir, monkeypatch):
+    """A moved file is stored as a reference to the content in the
+    base archive.
+    """
+    monkeypatch.chdir(test_dir)
+    full = Archive().create(Path("full.tar.bz2"), "", [Path("base")])
+    # Move a file to another directory.
+    Path("base", "new").mkdir()
+    Path("base", "data", "rnd2.dat").rename(Path("base", "new", "rnd.dat"))
+    try:
+        contents = {}
+        index_content(full.manifest, full.path.name, contents)
+        fileinfos = Manifest(paths=[Path("base")])
+        fileinfos = filter_fileinfos(full.manifest, fileinfos)
+        fileinfos = add_content_refs(contents, fileinfos)
+        incr = Archive().create(Path("incr.tar.bz2"), "", fileinfos=fileinfos)
+    finally:
+        Path("base", "new", "rnd.dat").rename(Path("base", "data", "rnd2.dat"))
+        Path("base", "new").rmdir()
+    moved = incr.manifest.find(Path("base", "new", "rnd.dat"))
+    assert moved.ref == {
+        'archive': "full.tar.bz2",
+        'path': "base/data/rnd2.dat",
+    }
+    with Archive().open(Path("incr.tar.bz2")) as archive:
+        moved = archive.manifest.find(Path("base", "new", "rnd.dat"))
+        assert moved.ref['archive'] == "full.tar.bz2"
+        names = archive._file.getnames()
+        assert "base/new" in names
+        assert "base/new/rnd.dat" not in names
+        archive.verify()
+        with pytest.raises(ArchiveReadError):
+            archive.extract(test_dir / "extract-noref")
+        idx = ArchiveIndex()
+        idx.add_archives([test_dir / "full.tar.bz2"])
+        targetdir = test_dir / "extract-ref"
+        archive.extract(targetdir, resolve=idx.open_archive)
+    target = targetdir / "base" / "new" / "rnd.dat"
+    source = test_dir / "base" / "data" / "rnd2.dat"
+    assert target.read_bytes() == source.read_bytes()
+    assert (target.stat().st_mode & 0o7777) == 0o640
+    assert int(target.stat().st_mtime) == int(source.stat().st_mtime)
@@ -0,0 +1,106 @@
+"""Test creating archives in shards in parallel worker processes.
+"""
+
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.volume import VolumeSet, volume_path, volume_paths
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=30000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o600, size=25000),
+    DataRandomFile(Path("base", "data", "rnd3.dat"), 0o600, size=35000),
+    DataRandomFile(Path("base", "data", "rnd4.dat"), 0o600, size=28000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+    DataDir(Path("base", "zz"), 0o755),
+    DataRandomFile(Path("base", "zz", "rnd5.dat"), 0o600, size=32000),
+    DataRandomFile(Path("base", "zz", "rnd6.dat"), 0o600, size=27000),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+def test_volume_paths():
+    p = Path("x", "b-210101-full.vol02.tar.bz2")
+    assert volume_paths(p, 3) == [
+        Path("x", "b-210101-full.vol01.tar.bz2"),
+        Path("x", "b-210101-full.vol02.tar.bz2"),
+        Path("x", "b-210101-full.vol03.tar.bz2"),
+    ]
+    assert volume_paths(Path("x", "b.tar.bz2"), 3) is None
+
+@pytest.mark.parametrize("compression", ["", "gz"])
+def test_create_shards(test_dir, monkeypatch, compression):
+    """Create a sharded archive and read it back as one volume set.
+    """
+    monkeypatch.chdir(test_dir)
+    name = archive_name(ext=compression, tags=["shards"])
+    volset = VolumeSet().create(Path(name), compression, [Path("base")],
+                                tags=["a"], shards=3)
+    paths = volset.paths
+    assert len(paths) == 3
+    check_manifest(volset.manifest, testdata)
+    sizes = []
+    for i, p in enumerate(paths, start=1):
+        assert p == volume_path(test_dir / name, i, 3)
+        with Archive().open(p) as arch:
+            arch.verify()
+            assert arch.basedir == Path("base")
+            assert arch.manifest.tags == ("a", "volume:%d/3" % i,
+                                          "volset:archive-shards")
+            sizes.append(sum(fi.size for fi in arch.manifest
+                             if fi.is_file()))
+    # The shards are balanced: each one gets two of the random files.
+    assert max(sizes) < 2*min(sizes)
+    with VolumeSet().open(paths) as volset:
+        assert volset.manifest.tags == ("a",)
+        check_manifest(volset.manifest, testdata)
+        volset.verify()
+        targetdir = test_dir / ("extract-shards-%s" % compression)
+        volset.extract(targetdir)
+    for item in testdata:
+        target = targetdir / item.path
+        if item.type == 'f':
+            assert target.read_bytes() == (test_dir / item.path).read_bytes()
+
+def test_create_shards_workdir(test_dir, tmpdir, monkeypatch):
+    """The workdir argument is honored by the worker processes.
+    """
+    monkeypatch.chdir(tmpdir)
+    path = tmpdir / "workdir-shards.tar"
+    volset = VolumeSet().create(path, "", [Path("base")],
+                                workdir=test_dir, shards=2)
+    assert volset.paths == [volume_path(path, i, 2) for i in (1, 2)]
+    with VolumeSet().open(volset.paths) as volset:
+        check_manifest(volset.manifest, testdata)
+        volset.verify()
+
+def test_create_shards_few_items(test_dir, monkeypatch):
+    """Do not create empty shards.
+    """
+    monkeypatch.chdir(test_dir)
+    volset = VolumeSet().create(Path("few-shards.tar"), "",
+                                [Path("base", "msg.txt")],
+                                basedir=Path("base"), shards=4)
+    assert len(volset.paths) == 1
+
+def test_create_shards_args(test_dir, monkeypatch):
+    monkeypatch.chdir(test_dir)
+    with pytest.raises(TypeError):
+        VolumeSet().create(Path("err-shards.tar"), "", [Path("base")])
+    with pytest.raises(TypeError):
+        VolumeSet().create(Path("err-shards.tar"), "", [Path("base")],
+                           volumesize=1<<20, shards=2)
+    with pytest.raises(ValueError):
+        VolumeSet().create(Path("err-shards.tar"), "", [Path("base")],
+                           shards=0)
@@ -0,0 +1,85 @@
+"""Test creating archives with a bounded sort buffer.
+"""
+
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.exception import ArchiveCreateError
+from archive.manifest import FileInfo, Manifest
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "data", "sub"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(Path("base", "rnd.dat"), 0o600),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=732),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o600, size=487),
+    DataRandomFile(Path("base", "data", "sub", "rnd3.dat"), 0o600, size=42),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+
+@pytest.mark.parametrize("sortbuffer", [1, 3, 100])
+def test_manifest_sortbuffer(test_dir, monkeypatch, sortbuffer):
+    """Create a manifest with a bounded sort buffer.
+    """
+    monkeypatch.chdir(test_dir)
+    manifest = Manifest(paths=[Path("base")], sortbuffer=sortbuffer)
+    assert len(manifest) == len(testdata)
+    check_manifest(manifest, testdata)
+    # The manifest may be iterated more then once.
+    check_manifest(manifest, testdata)
+    assert manifest[-1].path == Path("base", "s.dat")
+    manifest.sort(key=lambda fi: fi.path, reverse=True)
+    paths = [fi.path for fi in manifest]
+    assert paths == sorted((i.path for i in testdata), reverse=True)
+
+def test_manifest_sortbuffer_invalid(test_dir, monkeypatch):
+    """The sort buffer must be positive.
+    """
+    monkeypatch.chdir(test_dir)
+    with pytest.raises(ValueError):
+        Manifest(paths=[Path("base")], sortbuffer=0)
+
+@pytest.mark.parametrize("sortbuffer", [2, 100])
+def test_create_sortbuffer_paths(test_dir, monkeypatch, sortbuffer):
+    """Create an archive from paths with a bounded sort buffer.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["sortbuffer", "paths"],
+                                     counter="sortbuffer_paths"))
+    Archive().create(archive_path, "", [Path("base")], sortbuffer=sortbuffer)
+    with Archive().open(archive_path) as archive:
+        check_manifest(archive.manifest, testdata)
+        archive.verify()
+
+def test_create_sortbuffer_fileinfos(test_dir, monkeypatch):
+    """Create an archive from a generator of fileinfos with a bounded
+    sort buffer.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["sortbuffer", "fileinfos"]))
+    fileinfos = FileInfo.iterpaths([Path("base")], set())
+    Archive().create(archive_path, "", fileinfos=fileinfos, sortbuffer=3)
+    with Archive().open(archive_path) as archive:
+        check_manifest(archive.manifest, testdata)
+        archive.verify()
+
+def test_create_sortbuffer_empty(test_dir, monkeypatch):
+    """Refuse to create an empty archive also with a sort buffer.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["sortbuffer", "empty"]))
+    with pytest.raises(ArchiveCreateError):
+        Archive().create(archive_path, "", fileinfos=[], sortbuffer=3)
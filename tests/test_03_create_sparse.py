@@ -0,0 +1,98 @@
+"""Test archiving sparse files.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.tools import TreeHash, checksum, sparse_map
+from conftest import *
+
+
+# The data segments and the total size of the sparse files.
+sparse_files = {
+    Path("base", "data", "sparse1.dat"): ([(1048576, 8192)], 4194304),
+    Path("base", "data", "sparse2.dat"):
+        ([(0, 4096), (2097152, 12288), (5242880, 4096)], 5246976),
+    Path("base", "data", "s" + 120*"x" + ".dat"): ([(65536, 4096)], 1048576),
+}
+
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd.dat"), 0o600, size=73251),
+]
+
+def _write_sparse(path, segments, size):
+    with path.open("wb") as f:
+        f.truncate(size)
+        for offset, length in segments:
+            f.seek(offset)
+            f.write(os.urandom(length))
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    for p, (segments, size) in sparse_files.items():
+        _write_sparse(tmpdir / p, segments, size)
+    with (tmpdir / p).open("rb") as f:
+        if sparse_map(f.fileno()) is None:
+            pytest.skip("file system does not support sparse files")
+    return tmpdir
+
+def test_sparse_map(test_dir):
+    """sparse_map() finds the data segments.
+    """
+    for p, (segments, size) in sparse_files.items():
+        with (test_dir / p).open("rb") as f:
+            f.seek(10)
+            smap = sparse_map(f.fileno())
+            assert f.tell() == 10
+        # The file system may allocate somewhat larger blocks than
+        # what we have written.
+        data = [s for s in smap if s[1]]
+        assert len(data) == len(segments)
+        for (o, l), (so, sl) in zip(data, segments):
+            assert o <= so and so + sl <= o + l
+        o, l = smap[-1]
+        assert o + l == size
+    with (test_dir / "base" / "data" / "rnd.dat").open("rb") as f:
+        assert sparse_map(f.fileno()) is None
+
+def test_checksum_sparse(test_dir, monkeypatch):
+    """The checksum of a sparse file is the same as for its content.
+    """
+    monkeypatch.setattr(TreeHash, "LeafSize", 65536)
+    for p in sparse_files.keys():
+        data = (test_dir / p).read_bytes()
+        with (test_dir / p).open("rb") as f:
+            cs = checksum(f, ["sha256", "md5", "tree-sha256"])
+        assert cs["sha256"] == hashlib.sha256(data).hexdigest()
+        assert cs["md5"] == hashlib.md5(data).hexdigest()
+        with (test_dir / p).open("rb", buffering=0) as f:
+            assert checksum(f, ["tree-sha256"]) == \
+                { "tree-sha256": cs["tree-sha256"] }
+
+@pytest.mark.parametrize("compression", ["", "gz"])
+def test_create_sparse(test_dir, monkeypatch, compression):
+    """Create an archive with sparse files and extract it again.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(ext=compression, tags=["sparse"]))
+    Archive().create(archive_path, compression, [Path("base")])
+    with Archive().open(archive_path) as arch:
+        arch.verify()
+        for p, (segments, size) in sparse_files.items():
+            ti = arch._file.getmember(str(p))
+            assert ti.issparse()
+            assert ti.size == size
+        targetdir = test_dir / archive_path.name.split('.')[0]
+        arch.extract(targetdir)
+    # The archive only contains the data segments.
+    assert archive_path.stat().st_size < 1048576
+    for p, (segments, size) in sparse_files.items():
+        target = targetdir / p
+        assert target.read_bytes() == (test_dir / p).read_bytes()
+        assert target.stat().st_blocks * 512 < size
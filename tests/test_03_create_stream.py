@@ -0,0 +1,108 @@
+"""Test writing archives to and reading them from streams.
+"""
+
+import io
+from pathlib import Path
+import shutil
+import pytest
+from archive import Archive
+from archive.archive import DedupMode
+from archive.exception import ArchiveCreateError, ArchiveIntegrityError
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=73251),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o600, size=385),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    shutil.copy(str(tmpdir / "base" / "data" / "rnd1.dat"),
+                str(tmpdir / "base" / "rnd1-copy.dat"))
+    testdata.append(DataFile(Path("base", "rnd1-copy.dat"), 0o600,
+                             checksum=testdata[4].checksum))
+    return tmpdir
+
+
+class PipeReader(io.RawIOBase):
+    """A non-seekable stream returning short reads, like a pipe.
+    """
+    def __init__(self, data, maxread=1000):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.maxread = maxread
+    def readable(self):
+        return True
+    def readinto(self, b):
+        n = min(len(b), self.maxread, len(self.data) - self.pos)
+        b[:n] = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+
+class PipeWriter(io.RawIOBase):
+    """A non-seekable output stream.
+    """
+    def __init__(self):
+        self.data = bytearray()
+    def writable(self):
+        return True
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+@pytest.mark.parametrize("dedup", [DedupMode.LINK, DedupMode.CONTENT])
+@pytest.mark.parametrize("compression", ["", "gz", "bz2", "xz"])
+def test_create_stream(test_dir, monkeypatch, compression, dedup):
+    """Write an archive to a stream and read it back as a stream.
+    """
+    monkeypatch.chdir(test_dir)
+    out = PipeWriter()
+    Archive().create(None, compression, [Path("base")], dedup=dedup,
+                     fileobj=out)
+    assert not out.closed
+    with Archive().open(fileobj=PipeReader(out.data)) as arch:
+        assert arch.path is None
+        assert arch.basedir == Path("base")
+        check_manifest(arch.manifest, testdata)
+        arch.verify()
+    # The result is also a regular archive.
+    archive_path = Path(archive_name(ext=compression, tags=["stream"],
+                                     counter="create_stream"))
+    archive_path.write_bytes(out.data)
+    with Archive().open(archive_path) as arch:
+        check_manifest(arch.manifest, testdata)
+        arch.verify()
+
+def test_verify_stream_truncated(test_dir, monkeypatch):
+    """Verifying a truncated stream fails.
+    """
+    monkeypatch.chdir(test_dir)
+    out = PipeWriter()
+    Archive().create(None, "", [Path("base")], fileobj=out)
+    data = out.data[:len(out.data)//2]
+    with Archive().open(fileobj=PipeReader(data)) as arch:
+        with pytest.raises(ArchiveIntegrityError):
+            arch.verify()
+
+def test_create_stream_abspath(test_dir, monkeypatch):
+    """basedir is required to stream an archive with absolute paths.
+    """
+    monkeypatch.chdir(test_dir)
+    with pytest.raises(ArchiveCreateError, match="basedir is required"):
+        Archive().create(None, "", [test_dir / "base"], fileobj=PipeWriter())
+    out = PipeWriter()
+    Archive().create(None, "", [test_dir / "base"], basedir=Path("base"),
+                     fileobj=out)
+    with Archive().open(fileobj=PipeReader(out.data)) as arch:
+        arch.verify()
@@ -0,0 +1,106 @@
+"""Test reading input files politely: fadvise, O_NOATIME and throttling.
+"""
+
+import os
+from pathlib import Path
+import time
+import pytest
+from archive import Archive
+from archive.manifest import FileInfo
+import archive.tools
+from archive.tools import (Throttle, is_plain_file, open_input, parse_size,
+                           tmp_throttle)
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=73251),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o600, size=8000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+@pytest.mark.parametrize(("size", "value"), [
+    ("512", 512),
+    ("4k", 4096),
+    ("1.5M", 1572864),
+    ("2G", 2147483648),
+    ("1T", 1099511627776),
+])
+def test_parse_size(size, value):
+    assert parse_size(size) == value
+
+def test_parse_size_invalid():
+    with pytest.raises(ValueError):
+        parse_size("10X")
+
+def test_throttle_iops():
+    """The throttle delays operations exceeding the limit.
+    """
+    throttle = Throttle(iops=50)
+    start = time.monotonic()
+    for i in range(11):
+        throttle()
+    assert time.monotonic() - start >= 0.2
+
+def test_throttle_bandwidth():
+    throttle = Throttle(bandwidth=1000000)
+    start = time.monotonic()
+    for i in range(6):
+        throttle(50000)
+    assert time.monotonic() - start >= 0.25
+
+def test_open_input(test_dir):
+    """open_input() returns a plain file unless throttled.
+    """
+    path = test_dir / "base" / "data" / "rnd1.dat"
+    data = path.read_bytes()
+    with open_input(path) as f:
+        assert is_plain_file(f)
+        assert f.read() == data
+    with tmp_throttle(Throttle(bandwidth=10000000)):
+        with open_input(path) as f:
+            assert not is_plain_file(f)
+            f.seek(1000)
+            assert f.read() == data[1000:]
+    assert archive.tools.input_throttle is None
+
+def test_create_drop_cache(test_dir, monkeypatch):
+    """Files are only dropped from the page cache after adding them to
+    the archive, not after calculating the checksums before.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        pytest.skip("os.posix_fadvise() not available")
+    monkeypatch.chdir(test_dir)
+    dropped = []
+    def fadvise(fd, offset, length, advice):
+        if advice == os.POSIX_FADV_DONTNEED:
+            dropped.append(os.readlink("/proc/self/fd/%d" % fd))
+    monkeypatch.setattr(os, "posix_fadvise", fadvise)
+    path = test_dir / "base" / "data" / "rnd1.dat"
+    fi = FileInfo(path=path)
+    assert fi.checksum
+    assert dropped == []
+    archive_path = Path(archive_name(tags=["drop-cache"]))
+    Archive().create(archive_path, "", [Path("base")])
+    files = [ str(test_dir / d.path) for d in testdata if d.type == "f" ]
+    assert sorted(dropped) == sorted(files)
+
+@pytest.mark.parametrize("compression", ["", "gz"])
+def test_create_throttled(test_dir, monkeypatch, compression):
+    """Create an archive with the reads throttled.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(ext=compression, tags=["throttle"]))
+    with tmp_throttle(Throttle(bandwidth=10000000, iops=1000)):
+        Archive().create(archive_path, compression, [Path("base")])
+    with Archive().open(archive_path) as arch:
+        check_manifest(arch.manifest, testdata)
+        arch.verify()
@@ -0,0 +1,145 @@
+"""Test splitting archives into volumes.
+"""
+
+from io import BytesIO
+from pathlib import Path
+import pytest
+from archive import Archive
+from archive.exception import ArchiveReadError, ArchiveWarning
+from archive.index import ArchiveIndex
+from archive.volume import VolumeSet, volume_path
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "empty"), 0o755),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=30000),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o600, size=25000),
+    DataRandomFile(Path("base", "data", "rnd3.dat"), 0o600, size=120000),
+    DataRandomFile(Path("base", "data", "rnd4.dat"), 0o600, size=12000),
+    DataRandomFile(Path("base", "data", "rnd5.dat"), 0o600, size=38000),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat")),
+    DataDir(Path("base", "zz"), 0o755),
+    DataRandomFile(Path("base", "zz", "rnd6.dat"), 0o600, size=3000),
+]
+volumesize = 64000
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+@pytest.mark.parametrize(("path", "index", "count", "expected"), [
+    ("a.tar", 1, 4, "a.vol001.tar"),
+    ("b-210101-full.tar.bz2", 12, 99, "b-210101-full.vol012.tar.bz2"),
+    ("c.tar.gz", 1000, 1200, "c.vol1000.tar.gz"),
+    ("d.dat", 7, 2000, "d.dat.vol0007"),
+])
+def test_volume_path(path, index, count, expected):
+    assert volume_path(Path("x", path), index, count) == Path("x", expected)
+
+@pytest.mark.parametrize("compression", ["", "gz"])
+def test_create_volumes(test_dir, monkeypatch, compression):
+    """Create a volume set and read it back.
+    """
+    monkeypatch.chdir(test_dir)
+    name = archive_name(ext=compression, tags=["vol"])
+    volset = VolumeSet().create(Path(name), compression, [Path("base")],
+                                tags=["a"], volumesize=volumesize)
+    paths = volset.paths
+    n = len(paths)
+    assert n > 2
+    big = Path("base", "data", "rnd3.dat")
+    for i, p in enumerate(paths, start=1):
+        assert p == volume_path(test_dir / name, i, n)
+        with Archive().open(p) as arch:
+            arch.verify()
+            assert arch.basedir == Path("base")
+            assert arch.manifest.tags == ("a", "volume:%d/%d" % (i, n),
+                                          "volset:archive-vol")
+            items = [fi.path for fi in arch.manifest]
+            if big in items:
+                # The file larger then volumesize has a volume of
+                # its own.
+                assert items == [big]
+            else:
+                assert p.stat().st_size <= volumesize
+    with VolumeSet().open(reversed(paths)) as volset:
+        assert volset.paths == paths
+        assert volset.basedir == Path("base")
+        assert volset.manifest.tags == ("a",)
+        check_manifest(volset.manifest, testdata)
+        volset.verify()
+        targetdir = test_dir / ("extract-vol-%s" % compression)
+        volset.extract(targetdir)
+    for item in testdata:
+        target = targetdir / item.path
+        if item.type == 'f':
+            assert target.read_bytes() == (test_dir / item.path).read_bytes()
+        if item.type != 'l':
+            src_mtime = (test_dir / item.path).stat().st_mtime
+            assert int(target.stat().st_mtime) == int(src_mtime)
+
+def test_open_volumes_incomplete(test_dir, monkeypatch):
+    monkeypatch.chdir(test_dir)
+    Archive().create(Path("plain.tar"), "", [Path("base")])
+    volset = VolumeSet().create(Path("incomplete.tar"), "", [Path("base")],
+                                volumesize=volumesize)
+    with pytest.raises(ArchiveReadError, match="incomplete volume set"):
+        VolumeSet().open(volset.paths[:-1])
+    with pytest.raises(ArchiveReadError, match="not a volume set"):
+        VolumeSet().open(volset.paths[:1] + [test_dir / "plain.tar"])
+
+def test_index_volumes(test_dir, monkeypatch):
+    """ArchiveIndex combines the volumes of a set into one item.
+    """
+    monkeypatch.chdir(test_dir)
+    idxdir = test_dir / "index"
+    idxdir.mkdir()
+    Archive().create(idxdir / "plain.tar", "", [Path("base")])
+    volset = VolumeSet().create(idxdir / "set.tar", "", [Path("base")],
+                                volumesize=volumesize)
+    idx = ArchiveIndex()
+    idx.add_archives(idxdir.glob("*.tar"))
+    idx.sort(key=lambda i: i.path)
+    assert len(idx) == 2
+    assert idx[0].path == idxdir / "plain.tar"
+    assert idx[0].volumes is None
+    assert idx[1].path == volset.paths[0]
+    assert idx[1].volumes == volset.paths
+    assert idx.find(volset.paths[2]) is idx[1]
+    with idx[1].open() as vs:
+        check_manifest(vs.manifest, testdata)
+    # Write the index and read it back.
+    f = BytesIO()
+    idx.write(f)
+    f.seek(0)
+    idx2 = ArchiveIndex(f)
+    assert [i.as_dict() for i in idx2] == [i.as_dict() for i in idx]
+    # Prune the set if a volume is missing, skip incomplete sets.
+    volset.paths[-1].unlink()
+    idx2.add_archives(idxdir.glob("*.tar"), prune=True)
+    assert [i.path for i in idx2] == [idxdir / "plain.tar"]
+    idx3 = ArchiveIndex()
+    with pytest.warns(ArchiveWarning, match="incomplete volume set"):
+        idx3.add_archives(idxdir.glob("*.tar"))
+    assert [i.path for i in idx3] == [idxdir / "plain.tar"]
+
+def test_create_volumes_error(test_dir, monkeypatch):
+    """The volumes already written are removed if a later one fails.
+    """
+    monkeypatch.chdir(test_dir)
+    errdir = test_dir / "error"
+    errdir.mkdir()
+    # Let the creation of the third volume fail.
+    (errdir / "err.vol003.tar").write_text("not ours\n")
+    with pytest.raises(FileExistsError):
+        VolumeSet().create(errdir / "err.tar", "", [Path("base")],
+                           volumesize=volumesize)
+    assert [p.name for p in errdir.iterdir()] == ["err.vol003.tar"]
+    assert (errdir / "err.vol003.tar").read_text() == "not ours\n"
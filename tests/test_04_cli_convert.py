@@ -0,0 +1,91 @@
+"""Test the convert subcommand of archive-tool.
+"""
+
+import bz2
+import gzip
+import lzma
+from pathlib import Path
+import tarfile
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from archive.archive import compression_map
+from archive.tools import tmp_chdir
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1565100853),
+    DataDir(Path("base", "data"), 0o750, mtime=1555271302),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataFile(Path("base", "data", "rnd.dat"), 0o600, mtime=1563112510),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat"),
+                mtime=1565100853),
+]
+
+decompress = {
+    '': lambda data: data,
+    'gz': gzip.decompress,
+    'bz2': bz2.decompress,
+    'xz': lzma.decompress,
+}
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    with tmp_chdir(tmpdir):
+        Archive().create(Path("archive.tar.bz2"), "bz2", [Path("base")])
+    return tmpdir
+
+@pytest.mark.parametrize("suffix", [".tar", ".tar.gz", ".tar.xz"])
+def test_cli_convert(test_dir, monkeypatch, suffix):
+    """Convert an archive, the compression is taken from the suffix.
+    The uncompressed tar file, including the manifest, is unchanged.
+    """
+    monkeypatch.chdir(test_dir)
+    output = Path("archive-convert%s" % suffix)
+    callscript("archive-tool.py", ["convert", "archive.tar.bz2", str(output)])
+    compression = compression_map[suffix]
+    assert (decompress[compression](output.read_bytes()) ==
+            bz2.decompress(Path("archive.tar.bz2").read_bytes()))
+    with Archive().open(Path("archive.tar.bz2")) as orig:
+        with Archive().open(output) as archive:
+            assert archive.manifest.head == orig.manifest.head
+            check_manifest(archive.manifest, testdata)
+            archive.verify()
+
+@pytest.mark.parametrize("compression", ["none", "gz", "xz"])
+def test_cli_convert_stream(test_dir, monkeypatch, compression):
+    """Convert an archive read from stdin and written to stdout.
+    """
+    monkeypatch.chdir(test_dir)
+    output = Path("archive-stream-%s" % compression)
+    args = ["convert", "--compression", compression, "--verify", "-", "-"]
+    with Path("archive.tar.bz2").open("rb") as i, output.open("wb") as o:
+        callscript("archive-tool.py", args, stdin=i, stdout=o)
+    with Archive().open(output) as archive:
+        check_manifest(archive.manifest, testdata)
+        archive.verify()
+
+def test_cli_convert_verify_error(test_dir, monkeypatch):
+    """Convert a corrupted archive with --verify.  The error is
+    reported and no output is left behind.
+    """
+    monkeypatch.chdir(test_dir)
+    data = bytearray(bz2.decompress(Path("archive.tar.bz2").read_bytes()))
+    with tarfile.open("archive.tar.bz2", "r") as tarf:
+        ti = tarf.getmember("base/msg.txt")
+        data[ti.offset_data] ^= 0xff
+    Path("archive-corrupt.tar").write_bytes(data)
+    output = Path("archive-corrupt.tar.xz")
+    args = ["convert", "--verify", "archive-corrupt.tar", str(output)]
+    with TemporaryFile(mode="w+t", dir=test_dir) as f:
+        callscript("archive-tool.py", args, returncode=3, stderr=f)
+        f.seek(0)
+        line = f.readline()
+        assert "base/msg.txt: checksum does not match" in line
+    assert not output.exists()
+    # Without --verify, the archive is converted as is.
+    callscript("archive-tool.py",
+               ["convert", "archive-corrupt.tar", str(output)])
+    assert lzma.decompress(output.read_bytes()) == data
@@ -78,3 +78,19 @@ def test_cli_create_exclude_include(test_dir, testname, monkeypatch):
     callscript("archive-tool.py", args)
     with Archive().open(Path(name)) as archive:
         check_manifest(archive.manifest, data)
+
+
+def test_cli_create_exclude_pattern(test_dir, testname, monkeypatch):
+    """Exclude items matching glob patterns and regular expressions.
+    """
+    monkeypatch.chdir(test_dir)
+    name = archive_name(tags=[testname])
+    data = testdata
+    for excl in ("base/data/sub", "base/msg.txt", "base/data/rnd2.dat"):
+        data = sub_testdata(data, Path(excl))
+    args = ["create", "--exclude-pattern", "sub/",
+            "--exclude-pattern", "*.txt",
+            "--exclude-regex", "/rnd2", name, "base"]
+    callscript("archive-tool.py", args)
+    with Archive().open(Path(name)) as archive:
+        check_manifest(archive.manifest, data)
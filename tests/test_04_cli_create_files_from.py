@@ -0,0 +1,74 @@
+"""Test the '--files-from' command line argument to 'archive-tool create'.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from conftest import *
+
+
+# Setup a directory with some test data to be put into an archive.
+# Make sure that we have all kind of different things in there.
+testdata = [
+    DataDir(Path("base"), 0o755),
+    DataDir(Path("base", "data"), 0o750),
+    DataDir(Path("base", "data", "sub"), 0o750),
+    DataFile(Path("base", "msg.txt"), 0o644),
+    DataFile(Path("base", "rnd.dat"), 0o600),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=732),
+    DataRandomFile(Path("base", "data", "sub", "rnd3.dat"), 0o600, size=42),
+    DataSymLink(Path("base", "s n.dat"), Path("data", "rnd1.dat")),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+
+def test_cli_create_files_from(test_dir, testname, monkeypatch):
+    """Read the list of files from a file.  Only the listed items are
+    added, directories are not descended.
+    """
+    monkeypatch.chdir(test_dir)
+    name = archive_name(tags=[testname])
+    data = [ testdata[i] for i in (0, 1, 3, 5, 7) ]
+    listfile = Path("files-%s.txt" % testname)
+    listfile.write_text("".join("%s\n" % d.path for d in data))
+    args = ["create", "--files-from", str(listfile), name]
+    callscript("archive-tool.py", args)
+    with Archive().open(Path(name)) as archive:
+        check_manifest(archive.manifest, data)
+        archive.verify()
+
+def test_cli_create_files_from_stdin(test_dir, testname, monkeypatch):
+    """Read a null separated list of files from stdin, as written by
+    find -print0.  Excludes still apply.
+    """
+    monkeypatch.chdir(test_dir)
+    name = archive_name(tags=[testname])
+    exclude = Path("base", "data", "sub")
+    data = list(sub_testdata(testdata, exclude))
+    with TemporaryFile(dir=test_dir) as f:
+        for d in testdata:
+            f.write(b"./%s\0" % str(d.path).encode())
+        f.seek(0)
+        args = ["create", "--files-from", "-", "--null",
+                "--exclude", str(exclude), name]
+        callscript("archive-tool.py", args, stdin=f)
+    with Archive().open(Path(name)) as archive:
+        check_manifest(archive.manifest, data)
+        archive.verify()
+
+def test_cli_create_files_from_args(test_dir, testname, monkeypatch):
+    """--files-from and the files argument are mutually exclusive.
+    """
+    monkeypatch.chdir(test_dir)
+    name = archive_name(tags=[testname])
+    with TemporaryFile(mode="w+t", dir=test_dir) as f:
+        args = ["create", "--files-from", "-", name, "base"]
+        callscript("archive-tool.py", args, returncode=2, stderr=f)
+        f.seek(0)
+        line = f.readlines()[-1]
+        assert "can't accept both, --files-from and the files" in line
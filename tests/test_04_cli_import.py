@@ -0,0 +1,101 @@
+"""Test importing plain tar files with archive-tool.
+"""
+
+import os
+import subprocess
+from pathlib import Path
+import tarfile
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from archive.archive import compression_map
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1565100853),
+    DataDir(Path("base", "data"), 0o750, mtime=1555271302),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataFile(Path("base", "data", "rnd.dat"), 0o600, mtime=1563112510),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat"),
+                mtime=1565100853),
+]
+linkdata = DataFile(Path("base", "rnd-hl.dat"), 0o600, mtime=1563112510,
+                    checksum=DataFile.Checksums["rnd.dat"])
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    base = tmpdir / "base"
+    os.link(str(base / "data" / "rnd.dat"), str(base / "rnd-hl.dat"))
+    os.utime(str(base), (1565100853, 1565100853))
+    for suffix in (".tar", ".tar.gz"):
+        mode = "w:" + compression_map[suffix]
+        with tarfile.open(str(tmpdir / ("input" + suffix)), mode) as tarf:
+            tarf.add(str(base), arcname="base")
+            # A member of a type not supported in archives.
+            ti = tarfile.TarInfo("base/fifo")
+            ti.type = tarfile.FIFOTYPE
+            tarf.addfile(ti)
+    # The same members in an order different from the archive.
+    with tarfile.open(str(tmpdir / "input.tar")) as inp:
+        members = sorted(inp.getmembers(),
+                         key=lambda ti: ti.name != "base/msg.txt")
+        path = str(tmpdir / "input-unsorted.tar.gz")
+        with tarfile.open(path, "w:gz") as tarf:
+            for ti in members:
+                tarf.addfile(ti, inp.extractfile(ti))
+        # Reversed, only keeping hard links after their target.
+        members = sorted(inp.getmembers(),
+                         key=lambda ti: (ti.islnk(), ti.name), reverse=True)
+        members.sort(key=lambda ti: ti.islnk())
+        path = str(tmpdir / "input-reversed.tar.gz")
+        with tarfile.open(path, "w:gz") as tarf:
+            for ti in members:
+                tarf.addfile(ti, inp.extractfile(ti))
+    return tmpdir
+
+@pytest.mark.parametrize("options", [
+    ("input.tar", []),
+    ("input.tar", ["--spool"]),
+    ("input.tar.gz", []),
+    ("input.tar.gz", ["--spool"]),
+    ("input-unsorted.tar.gz", []),
+    ("input-reversed.tar.gz", ["--spool-limit", "0"]),
+    ("input-reversed.tar.gz", ["--spool-limit", "1k"]),
+], ids=["tar", "tar-spool", "tar.gz", "tar.gz-spool", "unsorted.tar.gz",
+        "reversed.tar.gz-nospool", "reversed.tar.gz-spool-limit"])
+def test_cli_import(test_dir, monkeypatch, options):
+    """Import a tar file, hard links are kept, members of unsupported
+    types are ignored with a warning.
+    """
+    monkeypatch.chdir(test_dir)
+    inp, opts = options
+    archive_path = Path(archive_name(tags=["import"] + inp.split(".") +
+                                     [o.strip("-") for o in opts]))
+    args = ["import"] + opts + [inp, str(archive_path)]
+    with TemporaryFile(mode="w+t", dir=test_dir) as f:
+        callscript("archive-tool.py", args, stderr=f)
+        f.seek(0)
+        line = f.readline()
+        assert "base/fifo: FIFO ignored" in line
+    with Archive().open(archive_path) as archive:
+        check_manifest(archive.manifest, testdata + [linkdata])
+        ti = archive._file.getmember("base/rnd-hl.dat")
+        assert ti.islnk() and ti.linkname == "base/data/rnd.dat"
+        archive.verify()
+
+def test_cli_import_stream(test_dir, monkeypatch):
+    """Import a tar file read from stdin, prepending a base directory.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["import", "stream"]))
+    args = ["import", "--basedir", "archive", "-", str(archive_path)]
+    with Path("input.tar.gz").open("rb") as f:
+        callscript("archive-tool.py", args, stdin=f,
+                   stderr=subprocess.DEVNULL)
+    with Archive().open(archive_path) as archive:
+        assert archive.basedir == Path("archive")
+        check_manifest(archive.manifest, testdata + [linkdata],
+                       prefix_dir=Path("archive"))
+        archive.verify()
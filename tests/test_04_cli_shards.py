@@ -0,0 +1,59 @@
+"""Test the command line tool on volume sets.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from archive.volume import volume_path
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1565100853),
+    DataDir(Path("base", "data"), 0o750, mtime=1555271302),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataRandomFile(Path("base", "data", "rnd1.dat"), 0o600, size=20000,
+                   mtime=1563112510),
+    DataRandomFile(Path("base", "data", "rnd2.dat"), 0o600, size=20000,
+                   mtime=1563112510),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd1.dat"),
+                mtime=1565100853),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+@pytest.mark.parametrize("option", [["--shards", "2"],
+                                    ["--volume-size", "24K"]])
+def test_cli_volumes(test_dir, monkeypatch, option):
+    """Create a volume set and use the volumes as one archive.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["volumes", option[0][2:]]))
+    args = ["create", "--compression", "gz"] + option + [str(archive_path),
+                                                          "base"]
+    callscript("archive-tool.py", args)
+    paths = [volume_path(archive_path, i, 2) for i in (1, 2)]
+    for p in paths:
+        assert p.is_file()
+    callscript("archive-tool.py", ["verify", str(paths[1])])
+    with TemporaryFile(mode="w+t", dir=test_dir) as out:
+        callscript("archive-tool.py", ["ls", str(paths[0])], stdout=out)
+        out.seek(0)
+        for entry in sorted(testdata, key=lambda e: e.path):
+            fields = out.readline().split()
+            assert fields[5] == str(entry.path)
+    with TemporaryFile(mode="w+t", dir=test_dir) as out:
+        args = ["find", "--type", "f"] + [str(p) for p in paths]
+        callscript("archive-tool.py", args, stdout=out)
+        out.seek(0)
+        result = sorted(get_output(out))
+        expected = sorted("%s:%s" % (paths[0], e.path)
+                          for e in testdata if e.type == 'f')
+        assert result == expected
+    plain = Path(archive_name(tags=["volumes", option[0][2:], "plain"]))
+    Archive().create(plain, "gz", [Path("base")])
+    callscript("archive-tool.py", ["diff", str(plain), str(paths[1])])
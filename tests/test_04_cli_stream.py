@@ -0,0 +1,71 @@
+"""Test writing archives to stdout and reading them from stdin.
+"""
+
+from pathlib import Path
+from tempfile import TemporaryFile
+import pytest
+from archive import Archive
+from conftest import *
+
+
+testdata = [
+    DataDir(Path("base"), 0o755, mtime=1565100853),
+    DataDir(Path("base", "data"), 0o750, mtime=1555271302),
+    DataFile(Path("base", "msg.txt"), 0o644, mtime=1547911753),
+    DataFile(Path("base", "data", "rnd.dat"), 0o600, mtime=1563112510),
+    DataSymLink(Path("base", "s.dat"), Path("data", "rnd.dat"),
+                mtime=1565100853),
+]
+
+@pytest.fixture(scope="module")
+def test_dir(tmpdir):
+    setup_testdata(tmpdir, testdata)
+    return tmpdir
+
+@pytest.mark.parametrize("compression", ["none", "gz", "xz"])
+def test_cli_stream(test_dir, monkeypatch, compression):
+    """Pipe an archive from create to verify and ls.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["stream", compression]))
+    with archive_path.open("wb") as f:
+        args = ["create", "--compression", compression, "-", "base"]
+        callscript("archive-tool.py", args, stdout=f)
+    with Archive().open(archive_path) as archive:
+        check_manifest(archive.manifest, testdata)
+        archive.verify()
+    with archive_path.open("rb") as f:
+        callscript("archive-tool.py", ["verify", "-"], stdin=f)
+    with TemporaryFile(mode="w+t", dir=test_dir) as out:
+        with archive_path.open("rb") as f:
+            callscript("archive-tool.py", ["ls", "-"], stdin=f, stdout=out)
+        out.seek(0)
+        for entry in sorted(testdata, key=lambda e: e.path):
+            fields = out.readline().split()
+            assert fields[5] == str(entry.path)
+
+def test_cli_stdin_member(test_dir, monkeypatch):
+    """Pipe data into create, adding it as a regular file.
+    """
+    monkeypatch.chdir(test_dir)
+    archive_path = Path(archive_name(tags=["stdin-member"]))
+    dump = Path("base", "msg.txt")
+    args = ["create", "--stdin-member", "base/dump.sql",
+            str(archive_path), "base"]
+    with dump.open("rb") as f:
+        callscript("archive-tool.py", args, stdin=f)
+    dumpdata = DataFile(Path("base", "dump.sql"), 0o644,
+                        checksum=testdata[2].checksum)
+    with Archive().open(archive_path) as archive:
+        check_manifest(archive.manifest, testdata + [dumpdata])
+        archive.verify()
+    # Only the data from stdin, written to stdout.
+    archive_path = Path(archive_name(tags=["stdin-member", "only"]))
+    args = ["create", "--stdin-member", "dump/dump.sql", "-"]
+    with dump.open("rb") as f, archive_path.open("wb") as out:
+        callscript("archive-tool.py", args, stdin=f, stdout=out)
+    dumpdata = DataFile(Path("dump", "dump.sql"), 0o644,
+                        checksum=testdata[2].checksum)
+    with Archive().open(archive_path) as archive:
+        check_manifest(archive.manifest, [dumpdata])
+        archive.verify()
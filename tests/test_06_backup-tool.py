@@ -252,7 +252,7 @@ schedule.incr.date = Mon *
 name = %(user)s-%(date)s-%(schedule)s.tar.bz2
 dirs = $root/%(home)s
 excludes =
-    $root/%(home)s/.cache
+    .cache/
     $root/%(home)s/.thumbnails
     $root/%(home)s/tmp
 schedules = full/cumu/incr
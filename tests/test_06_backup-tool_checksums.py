@@ -0,0 +1,84 @@
+"""Test backup-tool after changing the checksums in the configuration.
+"""
+
+import datetime
+from pathlib import Path
+import socket
+import string
+import sys
+from archive import Archive
+from archive.bt import backup_tool
+import pytest
+from conftest import *
+
+
+cfg = """# Configuration file for backup-tool.
+
+[DEFAULT]
+backupdir = $root/backup
+checksums = $checksums
+
+[serv]
+
+[sys]
+dirs =
+    $root/data
+schedules = full/incr
+schedule.full.date = Mon *-*-2..8
+schedule.incr.date = *
+"""
+
+testdata = [
+    DataDir(Path("data"), 0o755, mtime=1633129414),
+    DataRandomFile(Path("data", "rnd1.dat"), 0o600, size=7964,
+                   mtime=1626052455),
+    DataContentFile(Path("data", "msg.txt"), b"Hello\n", 0o644,
+                    mtime=1632596683),
+]
+
+def run_backup_tool(monkeypatch, argv):
+    monkeypatch.setattr(sys, "argv", argv.split())
+    with pytest.raises(SystemExit) as excinfo:
+        backup_tool()
+    assert excinfo.value.code == 0
+
+def write_cfg(root, checksums):
+    cfg_path = root / "backup.cfg"
+    cfg_path.write_text(string.Template(cfg).substitute(root=root,
+                                                        checksums=checksums))
+    return cfg_path
+
+def backup(root, monkeypatch, day, checksums):
+    write_cfg(root, checksums)
+    FrozenDateTime.freeze(datetime.datetime(2021, 10, day, 3, 0))
+    run_backup_tool(monkeypatch, "backup-tool create --policy sys")
+    run_backup_tool(monkeypatch, "backup-tool index")
+    schedule = "full" if day == 4 else "incr"
+    path = root / "backup" / ("serv-2110%02d-%s.tar.bz2" % (day, schedule))
+    with Archive().open(path) as archive:
+        assert archive.manifest.checksums == tuple(checksums.split())
+        return { fi.path for fi in archive.manifest }
+
+def test_change_checksums(tmpdir, monkeypatch):
+    """Change the checksums between a full and an incremental backup.
+    Unchanged files are still recognized as such.
+    """
+    root = tmpdir / "change-checksums"
+    root.mkdir()
+    monkeypatch.setattr(datetime, "datetime", FrozenDateTime)
+    monkeypatch.setattr(datetime, "date", FrozenDate)
+    monkeypatch.setattr(socket, "gethostname", MockFunction("serv"))
+    monkeypatch.setenv("BACKUP_CFG", str(write_cfg(root, "sha256")))
+    (root / "backup").mkdir()
+    setup_testdata(root, testdata)
+    assert backup(root, monkeypatch, 4, "sha256") == {
+        root / d.path for d in testdata
+    }
+    setup_testdata(root, [
+        DataContentFile(Path("data", "msg.txt"), b"Hello world\n", 0o644,
+                        mtime=1632596683),
+    ])
+    data = root / "data"
+    assert backup(root, monkeypatch, 5, "blake2b") == {
+        data, data / "msg.txt"
+    }
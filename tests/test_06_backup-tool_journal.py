@@ -0,0 +1,267 @@
+"""Test incremental backups with backup-tool driven by the change journal.
+"""
+
+import argparse
+import datetime
+import os
+from pathlib import Path
+import shutil
+import socket
+import string
+import sys
+from archive import Archive
+from archive.bt import backup_tool
+from archive.bt.config import Config
+from archive.bt.journal import ChangeJournal
+from archive.bt.watch import Watcher
+import pytest
+from conftest import *
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"),
+                                reason="Need inotify")
+
+cfg = """# Configuration file for backup-tool.
+
+[DEFAULT]
+backupdir = $root/backup
+journal = $root/journal
+
+[serv]
+
+[sys]
+dirs =
+    $root/data
+excludes =
+    *.tmp
+schedules = full/incr
+schedule.full.date = Mon *-*-2..8
+schedule.incr.date = *
+"""
+
+testdata = [
+    DataDir(Path("data"), 0o755, mtime=1633129414),
+    DataDir(Path("data", "sub"), 0o750, mtime=1633129414),
+    DataDir(Path("data", "old"), 0o755, mtime=1633129414),
+    DataRandomFile(Path("data", "rnd1.dat"), 0o600, size=7964,
+                   mtime=1626052455),
+    DataRandomFile(Path("data", "rnd2.dat"), 0o600, size=385,
+                   mtime=1626052455),
+    DataContentFile(Path("data", "sub", "msg.txt"), b"Hello\n", 0o644,
+                    mtime=1632596683),
+    DataContentFile(Path("data", "old", "a.txt"), b"a\n", 0o644,
+                    mtime=1632596683),
+    DataSymLink(Path("data", "rnd.dat"), Path("rnd1.dat"),
+                mtime=1633243020),
+]
+
+def run_backup_tool(monkeypatch, argv):
+    monkeypatch.setattr(sys, "argv", argv.split())
+    with pytest.raises(SystemExit) as excinfo:
+        backup_tool()
+    assert excinfo.value.code == 0
+
+@pytest.fixture
+def env(tmpdir, monkeypatch, request):
+    root = tmpdir / request.function.__name__
+    root.mkdir()
+    monkeypatch.setattr(datetime, "datetime", FrozenDateTime)
+    monkeypatch.setattr(datetime, "date", FrozenDate)
+    monkeypatch.setattr(socket, "gethostname", MockFunction("serv"))
+    cfg_path = root / "backup.cfg"
+    cfg_path.write_text(string.Template(cfg).substitute(root=root))
+    monkeypatch.setenv("BACKUP_CFG", str(cfg_path))
+    (root / "backup").mkdir()
+    setup_testdata(root, testdata)
+    return root
+
+@pytest.fixture
+def watcher(env, monkeypatch):
+    config = Config(argparse.Namespace(policy="sys", user=None))
+    with Watcher(ChangeJournal(config.journal), config.dirs,
+                 config.excludes) as w:
+        yield w
+
+def backup(env, monkeypatch, day):
+    FrozenDateTime.freeze(datetime.datetime(2021, 10, day, 3, 0))
+    run_backup_tool(monkeypatch, "backup-tool create --policy sys")
+    run_backup_tool(monkeypatch, "backup-tool index")
+    schedule = "full" if day == 4 else "incr"
+    path = env / "backup" / ("serv-2110%02d-%s.tar.bz2" % (day, schedule))
+    with Archive().open(path) as archive:
+        return ({ fi.path for fi in archive.manifest },
+                set(archive.manifest.deleted))
+
+def modify(env):
+    """Modify the test data: change a file, create a file and a
+    directory tree, delete a file and a directory, and create an
+    excluded file.  Return the items expected in the next incremental
+    backup and the deleted items.
+    """
+    data = env / "data"
+    setup_testdata(env, [
+        DataContentFile(Path("data", "sub", "msg.txt"), b"Hello world\n",
+                        0o644, mtime=1633330000),
+        DataContentFile(Path("data", "new.txt"), b"new\n", 0o644,
+                        mtime=1633330000),
+        DataDir(Path("data", "tree"), 0o755, mtime=1633330000),
+        DataDir(Path("data", "tree", "a"), 0o755, mtime=1633330000),
+        DataContentFile(Path("data", "tree", "a", "b.txt"), b"b\n", 0o644,
+                        mtime=1633330000),
+        DataContentFile(Path("data", "x.tmp"), b"x\n", 0o644,
+                        mtime=1633330000),
+    ])
+    (data / "rnd2.dat").unlink()
+    shutil.rmtree(str(data / "old"))
+    items = {
+        data, data / "sub", data / "sub" / "msg.txt", data / "new.txt",
+        data / "tree", data / "tree" / "a", data / "tree" / "a" / "b.txt",
+    }
+    deleted = { data / "rnd2.dat", data / "old" }
+    return items, deleted
+
+def test_journal_incr(env, watcher, monkeypatch):
+    """The incremental backup taken from the journal is the same as
+    from scanning the directories.  Changes not yet recorded in the
+    journal are not seen.
+    """
+    data = env / "data"
+    items, deleted = backup(env, monkeypatch, 4)
+    assert items == { env / d.path for d in testdata }
+    items, deleted = modify(env)
+    watcher.process(timeout=1)
+    setup_testdata(env, [
+        DataContentFile(Path("data", "late.txt"), b"late\n", 0o644,
+                        mtime=1633340000),
+    ])
+    assert backup(env, monkeypatch, 5) == (items, deleted)
+    # The directories created before are being watched as well.
+    setup_testdata(env, [
+        DataContentFile(Path("data", "tree", "a", "c.txt"), b"c\n", 0o644,
+                        mtime=1633340000),
+    ])
+    watcher.process(timeout=1)
+    items = { data / "late.txt", data / "tree" / "a",
+              data / "tree" / "a" / "c.txt" }
+    assert backup(env, monkeypatch, 6) == (items, set())
+
+def test_journal_fallback_restart(env, watcher, monkeypatch):
+    """Fall back to scanning the directories if the watcher has been
+    restarted since the last backup.
+    """
+    data = env / "data"
+    backup(env, monkeypatch, 4)
+    watcher.close()
+    items, deleted = modify(env)
+    with Watcher(watcher.journal, watcher.dirs, watcher.excludes):
+        setup_testdata(env, [
+            DataContentFile(Path("data", "late.txt"), b"late\n", 0o644,
+                            mtime=1633340000),
+        ])
+        items.add(data / "late.txt")
+        assert backup(env, monkeypatch, 5) == (items, deleted)
+
+def test_journal_fallback_overflow(env, watcher, monkeypatch):
+    """Fall back to scanning the directories if changes have been
+    lost.
+    """
+    data = env / "data"
+    backup(env, monkeypatch, 4)
+    items, deleted = modify(env)
+    watcher.journal.overflow()
+    setup_testdata(env, [
+        DataContentFile(Path("data", "late.txt"), b"late\n", 0o644,
+                        mtime=1633340000),
+    ])
+    items.add(data / "late.txt")
+    assert backup(env, monkeypatch, 5) == (items, deleted)
+
+def test_journal_no_watcher(env, monkeypatch):
+    """Without a running watcher, no position is recorded and the
+    next incremental backup scans the directories.
+    """
+    backup(env, monkeypatch, 4)
+    path = env / "backup" / "serv-211004-full.tar.bz2"
+    with Archive().open(path) as archive:
+        assert not any(t.startswith("journal:")
+                       for t in archive.manifest.tags)
+    items, deleted = modify(env)
+    assert backup(env, monkeypatch, 5) == (items, deleted)
+
+def test_journal_record_once(env, watcher):
+    """A path changed again is only recorded once until a reader has
+    taken a position in the journal.
+    """
+    journal = watcher.journal
+    path = env / "data" / "rnd2.dat"
+    start = journal.position()
+    for i in range(3):
+        with path.open("ab") as f:
+            f.write(b"x")
+        watcher.process(timeout=1)
+    data = journal.path.read_bytes()
+    assert data.count(b"P%s\0" % bytes(path)) == 1
+    # Take the position only after all events have been processed.
+    watcher.process(timeout=0.1)
+    position = journal.position()
+    watcher.process(timeout=1)
+    with path.open("ab") as f:
+        f.write(b"x")
+    watcher.process(timeout=1)
+    assert journal.changes(position, journal.position()) == ({path}, set())
+    assert journal.changes(start, position) == ({path}, set())
+
+def test_journal_changes_blocks(env, watcher, monkeypatch):
+    """Records crossing the blocks read from the journal are parsed
+    correctly.
+    """
+    monkeypatch.setattr(ChangeJournal, "BlockSize", 7)
+    journal = watcher.journal
+    start = journal.position()
+    data = env / "data"
+    paths = { data / ("file-%d.txt" % i) for i in range(20) }
+    trees = { data / "tree" }
+    journal.record(paths, trees)
+    assert journal.changes(start, journal.position()) == (paths, trees)
+
+def test_journal_open_file(env, watcher):
+    """Changes to a file kept open are recorded without closing it.
+    """
+    journal = watcher.journal
+    path = env / "data" / "rnd1.dat"
+    with path.open("ab", buffering=0) as f:
+        f.write(b"x")
+        watcher.process(timeout=1)
+        start = journal.position()
+        watcher.process(timeout=0.1)
+        f.write(b"x")
+        watcher.process(timeout=1)
+        assert journal.changes(start, journal.position()) == ({path}, set())
+
+def delete_only(env):
+    """Delete a file, keeping the modification time of its directory.
+    Return the items expected in the next incremental backup and the
+    deleted items.
+    """
+    data = env / "data"
+    (data / "rnd2.dat").unlink()
+    os.utime(str(data), (1633129414, 1633129414))
+    return { data }, { data / "rnd2.dat" }
+
+def test_deleted_only(env, monkeypatch):
+    """An incremental backup is created if the only changes are
+    deletions, the directory that contained the deleted item is taken
+    in the archive to record them.
+    """
+    backup(env, monkeypatch, 4)
+    expected = delete_only(env)
+    assert backup(env, monkeypatch, 5) == expected
+
+def test_journal_deleted_only(env, watcher, monkeypatch):
+    """Same as test_deleted_only(), taking the changes from the
+    journal.
+    """
+    backup(env, monkeypatch, 4)
+    expected = delete_only(env)
+    watcher.process(timeout=1)
+    assert backup(env, monkeypatch, 5) == expected
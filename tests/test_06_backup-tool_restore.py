@@ -0,0 +1,221 @@
+"""Test restoring and consolidating backups with backup-tool.
+"""
+
+import datetime
+import os
+from pathlib import Path
+import shutil
+import socket
+import string
+import sys
+from archive import Archive
+from archive.bt import backup_tool
+import archive.bt.consolidate
+import pytest
+from conftest import *
+
+
+cfg = """# Configuration file for backup-tool.
+
+[DEFAULT]
+backupdir = $root/backup
+
+[serv]
+
+[sys]
+dirs =
+    $root/data
+schedules = full/incr
+schedule.full.date = Mon *-*-2..8
+schedule.incr.date = *
+$options
+"""
+
+def snapshot(root):
+    """Return the type, mode, modification time and content of all
+    items in the directory root.
+    """
+    items = {}
+    for dirpath, dirnames, filenames in os.walk(str(root)):
+        for n in dirnames + filenames:
+            p = Path(dirpath, n)
+            st = p.lstat()
+            if p.is_symlink():
+                data = ('l', os.readlink(str(p)))
+            elif p.is_dir():
+                data = ('d', st.st_mode & 0o7777)
+            else:
+                data = ('f', st.st_mode & 0o7777, p.read_bytes())
+            items[p.relative_to(root)] = data + (int(st.st_mtime),)
+    return items
+
+def run_backup_tool(monkeypatch, argv):
+    monkeypatch.setattr(sys, "argv", argv.split())
+    with pytest.raises(SystemExit) as excinfo:
+        backup_tool()
+    assert excinfo.value.code == 0
+
+@pytest.fixture(params=[
+    ("plain", ""),
+    ("refs", "dedup = content\ndeltasize = 4K"),
+], ids=lambda p: p[0])
+def env(tmpdir, monkeypatch, request):
+    name, options = request.param
+    root = tmpdir / ("%s-%s" % (request.function.__name__, name))
+    root.mkdir()
+    monkeypatch.setattr(datetime, "datetime", FrozenDateTime)
+    monkeypatch.setattr(datetime, "date", FrozenDate)
+    monkeypatch.setattr(socket, "gethostname", MockFunction("serv"))
+    cfg_path = root / "backup.cfg"
+    cfg_data = string.Template(cfg).substitute(root=root, options=options)
+    cfg_path.write_text(cfg_data)
+    monkeypatch.setenv("BACKUP_CFG", str(cfg_path))
+    (root / "backup").mkdir()
+    return root
+
+def create_chain(env, monkeypatch):
+    """Create a chain of a full and two incremental backups, the last
+    one deleting files.  With the refs options, the incremental
+    backups have a file referring to content in the full backup and a
+    file stored as a delta.  Return the dates of the backups and the
+    state of the files at these dates.
+    """
+    data = env / "data"
+    testdata = [
+        DataDir(Path("data"), 0o755, mtime=1633129414),
+        DataDir(Path("data", "sub"), 0o750, mtime=1633129414),
+        DataDir(Path("data", "hl"), 0o755, mtime=1633129414),
+        DataRandomFile(Path("data", "rnd1.dat"), 0o600, size=7964,
+                       mtime=1626052455),
+        DataContentFile(Path("data", "sub", "msg.txt"), b"Hello\n", 0o644,
+                        mtime=1632596683),
+        DataSymLink(Path("data", "rnd.dat"), Path("rnd1.dat"),
+                    mtime=1633243020),
+        DataRandomFile(Path("data", "hl.dat"), 0o644, size=1200,
+                       mtime=1626052455),
+    ]
+    setup_testdata(env, testdata)
+    os.link(str(data / "hl.dat"), str(data / "hl" / "hl.dat"))
+    os.utime(str(data / "hl"), (1633129414, 1633129414))
+    states = []
+    date_fmt = "2021-10-%02d 03:00"
+    def backup(day):
+        FrozenDateTime.freeze(datetime.datetime(2021, 10, day, 3, 0))
+        run_backup_tool(monkeypatch, "backup-tool create --policy sys")
+        run_backup_tool(monkeypatch, "backup-tool index")
+        states.append((date_fmt % day, snapshot(data)))
+
+    backup(4)
+    setup_testdata(env, [
+        DataContentFile(Path("data", "sub", "msg.txt"), b"Hello world\n",
+                        0o644, mtime=1633330000),
+        DataRandomFile(Path("data", "rnd2.dat"), 0o640, size=385,
+                       mtime=1633330000),
+        DataContentFile(Path("data", "copy.txt"), b"Hello\n", 0o600,
+                        mtime=1633330000),
+    ])
+    backup(5)
+    rnd1 = (data / "rnd1.dat").read_bytes()
+    setup_testdata(env, [
+        DataContentFile(Path("data", "rnd1.dat"), rnd1 + b"more data\n",
+                        0o600, mtime=1633420000),
+    ])
+    (data / "rnd2.dat").unlink()
+    shutil.rmtree(str(data / "sub"))
+    os.utime(str(data), (1633420000, 1633420000))
+    backup(6)
+    assert len(list((env / "backup").glob("*.tar.bz2"))) == 3
+    with Archive().open(env / "backup" / "serv-211006-incr.tar.bz2") as a:
+        assert a.manifest.deleted == (data / "rnd2.dat", data / "sub")
+    return states
+
+def test_restore_chain(env, monkeypatch):
+    """Restore the state at different points in a chain of backups.
+    """
+    data = env / "data"
+    states = create_chain(env, monkeypatch)
+    for k, (date, state) in enumerate(states):
+        targetdir = env / ("restore-%d" % k)
+        run_backup_tool(monkeypatch,
+                        "backup-tool restore --policy sys --at %s %s"
+                        % (date.replace(" ", "T"), targetdir))
+        restored = targetdir / data.relative_to(data.anchor)
+        assert snapshot(restored) == state
+    # Without --at, restore the latest state.
+    targetdir = env / "restore-latest"
+    run_backup_tool(monkeypatch, "backup-tool restore --policy sys %s"
+                    % targetdir)
+    restored = targetdir / data.relative_to(data.anchor)
+    assert snapshot(restored) == states[-1][1]
+
+def test_consolidate(env, monkeypatch):
+    """Consolidate a chain of backups into a new full backup.
+    """
+    data = env / "data"
+    states = create_chain(env, monkeypatch)
+    FrozenDateTime.freeze(datetime.datetime(2021, 10, 7, 3, 0))
+    run_backup_tool(monkeypatch, "backup-tool consolidate --policy sys")
+    path = env / "backup" / "serv-211007-full.tar.bz2"
+    with Archive().open(path) as archive:
+        assert "type:full" in archive.manifest.tags
+        for fi in archive.manifest:
+            assert not fi.ref and not fi.delta
+        arcname = archive._arcname(data / "hl.dat")
+        assert archive._file.getmember(arcname).islnk()
+        archive.verify()
+    run_backup_tool(monkeypatch, "backup-tool index")
+    targetdir = env / "restore-consolidated"
+    run_backup_tool(monkeypatch, "backup-tool restore --policy sys %s"
+                    % targetdir)
+    restored = targetdir / data.relative_to(data.anchor)
+    assert snapshot(restored) == states[-1][1]
+    # The next incremental backup is based on the consolidated one.
+    setup_testdata(env, [
+        DataContentFile(Path("data", "new.txt"), b"New\n", 0o644,
+                        mtime=1633590000),
+    ])
+    os.utime(str(data), (1633590000, 1633590000))
+    FrozenDateTime.freeze(datetime.datetime(2021, 10, 8, 3, 0))
+    run_backup_tool(monkeypatch, "backup-tool create --policy sys")
+    path = env / "backup" / "serv-211008-incr.tar.bz2"
+    with Archive().open(path) as archive:
+        paths = { fi.path for fi in archive.manifest }
+        assert paths == { data, data / "new.txt" }
+
+def test_consolidate_sequential(env, monkeypatch):
+    """Consolidate taking content referred to in other archives and
+    targets of hard links not in the consolidated archive from the
+    sources sequentially, without spooling.  Only the base of deltas
+    is read by random access.
+    """
+    data = env / "data"
+    states = create_chain(env, monkeypatch)
+    # Replace the target of the hard link in the full backup.
+    (data / "hl" / "hl.dat").unlink()
+    setup_testdata(env, [
+        DataContentFile(Path("data", "hl", "hl.dat"), b"other\n", 0o644,
+                        mtime=1633500000),
+    ])
+    FrozenDateTime.freeze(datetime.datetime(2021, 10, 7, 3, 0))
+    run_backup_tool(monkeypatch, "backup-tool create --policy sys")
+    run_backup_tool(monkeypatch, "backup-tool index")
+    state = snapshot(data)
+    random_access = set()
+    content_member = Archive._content_member
+    def spy(self, path):
+        random_access.add(path)
+        return content_member(self, path)
+    monkeypatch.setattr(Archive, "_content_member", spy)
+    monkeypatch.setattr(archive.bt.consolidate, "SpoolLimit", 0)
+    FrozenDateTime.freeze(datetime.datetime(2021, 10, 8, 3, 0))
+    run_backup_tool(monkeypatch, "backup-tool consolidate --policy sys")
+    assert random_access <= { data / "rnd1.dat" }
+    path = env / "backup" / "serv-211008-full.tar.bz2"
+    with Archive().open(path) as arch:
+        arch.verify()
+    run_backup_tool(monkeypatch, "backup-tool index")
+    targetdir = env / "restore-consolidated"
+    run_backup_tool(monkeypatch, "backup-tool restore --policy sys %s"
+                    % targetdir)
+    restored = targetdir / data.relative_to(data.anchor)
+    assert snapshot(restored) == state